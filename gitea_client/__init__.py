@@ -1,4 +1,46 @@
-from gitea_client.auth import Authentication, Token, UsernamePassword
-from gitea_client.entities import GiteaUser, GiteaRepo, GiteaBranch, GiteaCommit, GiteaOrg, GiteaTeam
-from gitea_client.interface import GiteaApi, ApiFailure, NetworkFailure
-from gitea_client.updates import GiteaUserUpdate, GiteaHookUpdate
+"""
+A client for the Gitea HTTP API.
+
+On Python 3.7 and later, submodules are imported on first use of the names exported
+here, so importing the package itself does not load ``requests`` or ``attrs``.
+"""
+import importlib
+import sys
+
+_EXPORTS = {
+    "Authentication": "gitea_client.auth",
+    "Token": "gitea_client.auth",
+    "UsernamePassword": "gitea_client.auth",
+    "GiteaUser": "gitea_client.entities",
+    "GiteaRepo": "gitea_client.entities",
+    "GiteaBranch": "gitea_client.entities",
+    "GiteaCommit": "gitea_client.entities",
+    "GiteaOrg": "gitea_client.entities",
+    "GiteaTeam": "gitea_client.entities",
+    "GiteaApi": "gitea_client.interface",
+    "ApiFailure": "gitea_client.interface",
+    "NetworkFailure": "gitea_client.interface",
+    "GiteaUserUpdate": "gitea_client.updates",
+    "GiteaHookUpdate": "gitea_client.updates",
+}
+
+__all__ = sorted(_EXPORTS)
+
+
+def __getattr__(name):
+    module_name = _EXPORTS.get(name)
+    if module_name is None:
+        raise AttributeError("module 'gitea_client' has no attribute '{}'".format(name))
+    value = getattr(importlib.import_module(module_name), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
+
+
+if sys.version_info < (3, 7):
+    # module-level __getattr__ is not supported
+    for _name in __all__:
+        __getattr__(_name)
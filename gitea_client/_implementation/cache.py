@@ -0,0 +1,68 @@
+"""
+In-memory caching utilities
+"""
+import threading
+import time
+from collections import OrderedDict
+
+
+class TtlCache(object):
+    """
+    A thread-safe mapping whose entries expire ``ttl`` seconds after being set.
+    Once ``max_size`` entries are stored, the least recently set entry is evicted.
+    """
+
+    def __init__(self, ttl, max_size=10000):
+        """
+        :param float ttl: lifetime of entries, in seconds
+        :param int max_size: maximum number of entries
+        """
+        self._ttl = ttl
+        self._max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def ttl(self):
+        return self._ttl
+
+    @property
+    def max_size(self):
+        return self._max_size
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return default
+            expires, value = entry
+            if expires < time.time():
+                del self._entries[key]
+                return default
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (time.time() + self._ttl, value)
+            while len(self._entries) > self._max_size:
+                self._entries.popitem(last=False)
+
+    def discard(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def discard_matching(self, predicate):
+        """
+        Removes every entry whose key satisfies ``predicate``
+        """
+        with self._lock:
+            for key in [k for k in self._entries if predicate(k)]:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
@@ -0,0 +1,38 @@
+"""
+Utilities for running many API operations concurrently
+"""
+import itertools
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+
+def bounded_map(func, items, concurrency):
+    """
+    Applies ``func`` to every element of ``items`` on up to ``concurrency`` worker
+    threads, yielding ``(item, result, exception)`` tuples in completion order.
+    Exactly one of ``result`` and ``exception`` is meaningful for each tuple.
+
+    At most ``2 * concurrency`` items are pulled from ``items`` before their results
+    have been yielded, so ``items`` may be a lazily generated iterable of any length.
+
+    :param func: callable taking a single item
+    :param items: iterable of items
+    :param int concurrency: maximum number of concurrent calls to ``func``
+    """
+    if concurrency < 1:
+        raise ValueError("concurrency must be positive")
+    items = iter(items)
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        pending = {}
+
+        def fill():
+            for item in itertools.islice(items, 2 * concurrency - len(pending)):
+                pending[executor.submit(func, item)] = item
+
+        fill()
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                item = pending.pop(future)
+                exc = future.exception()
+                yield item, (None if exc is not None else future.result()), exc
+            fill()
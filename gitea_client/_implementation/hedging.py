@@ -0,0 +1,129 @@
+"""
+Hedging of idempotent requests
+"""
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+from gitea_client.hedging import HedgeStats
+
+
+class Hedger(object):
+    """
+    Runs idempotent requests, sending a duplicate of any request that has not been
+    answered after a percentile of recent response times, within a budget.
+    """
+
+    def __init__(self, policy, workers=32, metrics=None):
+        """
+        :param HedgePolicy policy: when to hedge
+        :param int workers: maximum number of attempts in flight at once
+        :param metrics.Metrics metrics: if given, hedges sent, won and refused are counted
+                                        there as ``"hedge_sent"``, ``"hedge_win"`` and
+                                        ``"hedge_over_budget"`` events
+        """
+        self._policy = policy
+        self._metrics = metrics
+        self._workers = workers
+        self._lock = threading.Lock()
+        self._samples = deque(maxlen=policy.window)
+        self._delay = policy.initial_delay
+        self._requests = 0
+        self._hedged = 0
+        self._hedge_wins = 0
+        self._over_budget = 0
+        self._reset_executor()
+
+    def _reset_executor(self):
+        self._pid = os.getpid()
+        self._executor = ThreadPoolExecutor(max_workers=self._workers)
+
+    def stats(self):
+        """
+        :rtype: HedgeStats
+        """
+        with self._lock:
+            return HedgeStats(self._requests, self._hedged, self._hedge_wins,
+                              self._over_budget, self._delay)
+
+    def call(self, send):
+        """
+        Returns the response of ``send()``, called once or twice.
+
+        :param send: callable sending the request and returning a ``requests.Response``
+        :raises: the exception raised by the last attempt, if every attempt fails
+        """
+        if self._pid != os.getpid():
+            # forked: the parent's worker threads do not exist in this process
+            self._reset_executor()
+        with self._lock:
+            self._requests += 1
+            delay = self._delay
+        # the delay runs from when the first attempt starts, not from when it is
+        # queued: time spent waiting for a busy worker says nothing about the server
+        started = []
+        starting = threading.Event()
+
+        def attempt():
+            started.append(time.time())
+            starting.set()
+            return send()
+
+        first = self._executor.submit(attempt)
+        starting.wait()
+        start = started[0]
+        done, _ = wait([first], timeout=max(0.0, start + delay - time.time()))
+        if done:
+            self._record(time.time() - start)
+            return first.result()
+
+        with self._lock:
+            allowed = self._hedged < self._policy.budget * self._requests
+            if allowed:
+                self._hedged += 1
+            else:
+                self._over_budget += 1
+        if self._metrics is not None:
+            self._metrics.count("hedge_sent" if allowed else "hedge_over_budget")
+        if not allowed:
+            response = first.result()
+            self._record(time.time() - start)
+            return response
+
+        second = self._executor.submit(send)
+        pending = {first, second}
+        error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is not None:
+                    error = future.exception()
+                    continue
+                self._record(time.time() - start)
+                if future is second:
+                    with self._lock:
+                        self._hedge_wins += 1
+                    if self._metrics is not None:
+                        self._metrics.count("hedge_win")
+                # the slower attempt cannot be interrupted; release its connection once it answers
+                for loser in pending:
+                    loser.add_done_callback(_close_response)
+                return future.result()
+        raise error
+
+    def _record(self, elapsed):
+        policy = self._policy
+        with self._lock:
+            self._samples.append(elapsed)
+            count = len(self._samples)
+            if count >= policy.min_samples and count % 8 == 0:
+                ordered = sorted(self._samples)
+                index = min(count - 1, int(count * policy.percentile / 100.0))
+                self._delay = max(policy.min_delay, ordered[index])
+
+
+def _close_response(future):
+    if future.exception() is None:
+        future.result().close()
@@ -1,20 +1,128 @@
 """
 Various HTTP utilities
 """
+import os
+import random
+import threading
+import time
+from urllib.parse import urlencode, urljoin
 
 import requests
-from future.moves.urllib.parse import urljoin
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
 
 
 class RelativeHttpRequestor(object):
     """
     A thin wrapper around the requests module that allows for endpoint paths
-    to be given relative to a fixed base URL
+    to be given relative to a fixed base URL.
+
+    Unless a session is supplied, each thread gets its own ``requests.Session``, and
+    all of them share one connection pool, so a requestor can be used from many
+    threads at once. Connections inherited from a parent process through ``fork``
+    are discarded, and pickling preserves only the configuration, so a requestor
+    can also be handed to worker processes.
+
+    With a disk cache, successful GET responses are served from the cache while
+    fresh, and revalidated with their ``ETag`` once stale. Requests that are streamed
+    or carry their own ``If-None-Match`` header bypass the cache. Requests with a
+    ``Cache-Control: no-cache`` header (see :data:`NO_CACHE`) are always sent to the
+    server, and their responses stored.
     """
 
-    def __init__(self, base_url, session=None):
+    def __init__(self, base_url, session=None, pool_size=16, max_retries=0, disk_cache=None,
+                 adapter=None):
+        """
+        :param str base_url: URL that relative paths are resolved against
+        :param requests.Session session: a session to use from every thread, instead of
+                                         per-thread sessions. The caller is responsible
+                                         for its thread safety
+        :param int pool_size: maximum number of connections kept open to the server
+        :param int max_retries: number of times to retry requests that fail to connect
+        :param cache.DiskCache disk_cache: cache for GET responses
+        :param requests.adapters.BaseAdapter adapter: transport adapter mounted on the
+                                                      per-thread sessions, instead of a
+                                                      pooling ``HTTPAdapter``
+        """
         self.base_url = base_url
-        self.session = session or requests.Session()
+        self._session = session
+        self._pool_size = pool_size
+        self._max_retries = max_retries
+        self._disk_cache = disk_cache
+        self._custom_adapter = adapter
+        self._reset_transport()
+
+    def __getstate__(self):
+        # a supplied session is not configuration, and is not carried over
+        return {"base_url": self.base_url, "pool_size": self._pool_size,
+                "max_retries": self._max_retries, "disk_cache": self._disk_cache,
+                "adapter": self._custom_adapter}
+
+    def __setstate__(self, state):
+        self.__init__(state["base_url"], pool_size=state["pool_size"],
+                      max_retries=state["max_retries"], disk_cache=state["disk_cache"],
+                      adapter=state["adapter"])
+
+    def _reset_transport(self):
+        self._pid = os.getpid()
+        self._local = threading.local()
+        self._adapter = None
+        if self._session is None:
+            self._adapter = self._custom_adapter
+            if self._adapter is None:
+                self._adapter = HTTPAdapter(pool_maxsize=self._pool_size,
+                                            max_retries=self._max_retries)
+
+    @property
+    def session(self):
+        """
+        The session used by the calling thread
+
+        :type: requests.Session
+        """
+        if self._session is not None:
+            return self._session
+        if self._pid != os.getpid():
+            # forked: the pooled sockets belong to the parent process
+            self._reset_transport()
+        session = getattr(self._local, "session", None)
+        if session is None:
+            session = requests.Session()
+            session.mount("http://", self._adapter)
+            session.mount("https://", self._adapter)
+            self._local.session = session
+        return session
+
+    @property
+    def pool_size(self):
+        return self._pool_size
+
+    @property
+    def max_retries(self):
+        return self._max_retries
+
+    @property
+    def disk_cache(self):
+        return self._disk_cache
+
+    @property
+    def adapter(self):
+        return self._custom_adapter
+
+    def discard_cached(self, relative_prefix):
+        """
+        Removes cached responses for ``relative_prefix`` and every path below it
+        """
+        if self._disk_cache is not None:
+            self._disk_cache.discard_prefix(self.absolute_url(relative_prefix))
+
+    def clear_cached(self):
+        """
+        Removes every cached response
+        """
+        if self._disk_cache is not None:
+            self._disk_cache.clear()
 
     def absolute_url(self, relative_path):
         """
@@ -24,6 +132,44 @@ class RelativeHttpRequestor(object):
         """
         return append_url(self.base_url, relative_path)
 
+    def warm_up(self, n, relative_path="/version", timeout=None):
+        """
+        Opens up to ``n`` pooled connections at once by sending simultaneous GET requests
+        to ``relative_path``. Without a supplied session, at most :data:`pool_size`
+        connections are kept.
+
+        :param int n: number of connections to open
+        :param str relative_path: relative URL of a cheap endpoint
+        :param float timeout: seconds to wait for each response
+        :return: for each request, either its round-trip time in seconds or the
+                 ``requests.RequestException`` it raised
+        :rtype: list
+        """
+        if self._session is None:
+            n = min(n, self._pool_size)
+        barrier = threading.Barrier(n)
+        results = [None] * n
+
+        def probe(i):
+            try:
+                barrier.wait(timeout)
+            except threading.BrokenBarrierError:
+                pass
+            start = time.time()
+            try:
+                # reading the whole body returns the connection to the pool
+                self.get(relative_path, timeout=timeout, headers=NO_CACHE).content
+                results[i] = time.time() - start
+            except requests.RequestException as exc:
+                results[i] = exc
+
+        threads = [threading.Thread(target=probe, args=(i,)) for i in range(n)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results
+
     # The below methods are identical to the corresponding functions in requests module,
     # except that they expect relative paths
 
@@ -31,7 +177,13 @@ class RelativeHttpRequestor(object):
         return self.session.delete(self.absolute_url(relative_path), **kwargs)
 
     def get(self, relative_path, params=None, **kwargs):
-        return self.session.get(self.absolute_url(relative_path), params=params, **kwargs)
+        url = self.absolute_url(relative_path)
+        if self._disk_cache is not None and not kwargs.get("stream"):
+            return self._cached_get(url, params, kwargs)
+        return self.session.get(url, params=params, **kwargs)
+
+    def head(self, relative_path, params=None, **kwargs):
+        return self.session.head(self.absolute_url(relative_path), params=params, **kwargs)
 
     def options(self, relative_path, params=None, **kwargs):
         return self.session.options(self.absolute_url(relative_path), params=params, **kwargs)
@@ -45,6 +197,255 @@ class RelativeHttpRequestor(object):
     def put(self, relative_path, params=None, data=None, **kwargs):
         return self.session.put(self.absolute_url(relative_path), params=params, json=data, **kwargs)
 
+    def _cached_get(self, url, params, kwargs):
+        headers = kwargs.get("headers") or {}
+        key = _cache_key(url, params, kwargs)
+        if key is None or any(name.lower() == "if-none-match" for name in headers):
+            return self.session.get(url, params=params, **kwargs)
+        cache_url, credentials = key
+        identity = self._disk_cache.identity(*credentials)
+        if identity is None:
+            return self.session.get(url, params=params, **kwargs)
+        no_cache = any(name.lower() == "cache-control" and "no-cache" in value.lower()
+                       for (name, value) in headers.items())
+        cached = None if no_cache else self._disk_cache.get(cache_url, identity)
+        if cached is not None and cached.fresh:
+            return _cached_response(cached, url)
+        if cached is not None and cached.etag:
+            kwargs = dict(kwargs, headers=dict(headers, **{"If-None-Match": cached.etag}))
+        response = self.session.get(url, params=params, **kwargs)
+        if response.status_code == 304 and cached is not None:
+            self._disk_cache.refresh(cache_url, identity)
+            return _cached_response(cached, url)
+        if response.status_code == 200:
+            stored_headers = {name: value for (name, value) in response.headers.items()
+                              if name.lower() not in TRANSFER_HEADERS}
+            self._disk_cache.put(cache_url, identity, response.status_code, stored_headers,
+                                 response.content, response.headers.get("ETag"))
+        return response
+
+
+#: Request headers making a requestor with a disk cache fetch a response from the server
+NO_CACHE = {"Cache-Control": "no-cache"}
+
+#: Lower-cased names of response headers that describe the transfer rather than the
+#: (decoded) body, and so are not stored with it
+TRANSFER_HEADERS = frozenset(["content-encoding", "content-length", "transfer-encoding", "connection"])
+
+
+def _cache_key(url, params, kwargs):
+    """
+    Returns the URL under which a GET response is cached, with any token removed from
+    its query, and the credentials of the request. Returns ``None`` for requests
+    whose credentials cannot be told apart
+    """
+    auth = kwargs.get("auth")
+    if auth is not None and not isinstance(auth, tuple):
+        return None
+    if params is None:
+        items = []
+    elif isinstance(params, dict):
+        items = list(params.items())
+    else:
+        items = list(params)
+    token = [value for (name, value) in items if name == "token"]
+    query = sorted(((name, value) for (name, value) in items if name != "token"),
+                   key=lambda item: item[0])
+    headers = kwargs.get("headers") or {}
+    authorization = [value for (name, value) in headers.items() if name.lower() == "authorization"]
+    if query:
+        url = "{}?{}".format(url, urlencode(query, doseq=True))
+    return url, (token, auth, authorization)
+
+
+def _cached_response(cached, url):
+    response = requests.Response()
+    response.status_code = cached.status
+    response.headers = CaseInsensitiveDict(cached.headers)
+    response._content = cached.body
+    response.url = url
+    response.reason = "OK"
+    response.encoding = get_encoding_from_headers(response.headers)
+    response.from_cache = True
+    return response
+
+
+class BalancingHttpRequestor(object):
+    """
+    A requestor with the same interface as :class:`~RelativeHttpRequestor` that spreads
+    GET, HEAD and OPTIONS requests over several equivalent endpoints, and sends all
+    other requests to the first ("primary") endpoint.
+
+    Reads go to the better of two randomly chosen endpoints, scored by an
+    exponentially weighted moving average of their latency times their number of
+    requests in flight. An endpoint that fails to connect, or answers with a 502,
+    503 or 504, is taken out of rotation for ``cooldown`` seconds, and the read is
+    retried on another endpoint.
+    """
+
+    _READS = ("get", "head", "options")
+
+    def __init__(self, base_urls, pool_size=16, max_retries=0, cooldown=10.0, ewma_alpha=0.3,
+                 disk_cache=None, adapter=None):
+        """
+        :param List[str] base_urls: URLs that relative paths are resolved against; the
+                                    first is the primary
+        :param int pool_size: maximum number of connections kept open to each endpoint
+        :param int max_retries: number of times to retry requests that fail to connect
+        :param float cooldown: seconds a failed endpoint stays out of rotation
+        :param float ewma_alpha: weight of the latest latency sample in each endpoint's average
+        :param cache.DiskCache disk_cache: cache for GET responses, shared by all endpoints
+        :param requests.adapters.BaseAdapter adapter: transport adapter, shared by all
+                                                      endpoints, instead of pooling
+                                                      ``HTTPAdapter`` instances
+        """
+        if not base_urls:
+            raise ValueError("At least one endpoint is required")
+        self.endpoints = [RelativeHttpRequestor(url, pool_size=pool_size, max_retries=max_retries,
+                                                disk_cache=disk_cache, adapter=adapter)
+                          for url in base_urls]
+        self._states = [_EndpointState() for _ in base_urls]
+        self._cooldown = cooldown
+        self._alpha = ewma_alpha
+        self._lock = threading.Lock()
+
+    @property
+    def base_url(self):
+        return self.endpoints[0].base_url
+
+    @property
+    def session(self):
+        return self.endpoints[0].session
+
+    def absolute_url(self, relative_path):
+        return self.endpoints[0].absolute_url(relative_path)
+
+    def discard_cached(self, relative_prefix):
+        for endpoint in self.endpoints:
+            endpoint.discard_cached(relative_prefix)
+
+    def clear_cached(self):
+        for endpoint in self.endpoints:
+            endpoint.clear_cached()
+
+    def healthy_endpoints(self):
+        """
+        :return: base URLs of the endpoints currently in rotation
+        :rtype: List[str]
+        """
+        now = time.time()
+        with self._lock:
+            return [endpoint.base_url for (endpoint, state) in zip(self.endpoints, self._states)
+                    if state.down_until <= now]
+
+    def warm_up(self, n, relative_path="/version", timeout=None):
+        """
+        Warms up every endpoint as :meth:`RelativeHttpRequestor.warm_up` does, and seeds
+        their latency averages with the measured round-trip times
+
+        :rtype: list
+        """
+        results = []
+        for endpoint, state in zip(self.endpoints, self._states):
+            endpoint_results = endpoint.warm_up(n, relative_path, timeout)
+            rtts = [r for r in endpoint_results if isinstance(r, float)]
+            if rtts:
+                with self._lock:
+                    state.latency = min(rtts)
+            results.extend(endpoint_results)
+        return results
+
+    def delete(self, relative_path, **kwargs):
+        return self._send(0, "delete", relative_path, kwargs)
+
+    def get(self, relative_path, params=None, **kwargs):
+        return self._read("get", relative_path, dict(kwargs, params=params))
+
+    def head(self, relative_path, params=None, **kwargs):
+        return self._read("head", relative_path, dict(kwargs, params=params))
+
+    def options(self, relative_path, params=None, **kwargs):
+        return self._read("options", relative_path, dict(kwargs, params=params))
+
+    def patch(self, relative_path, data=None, **kwargs):
+        return self._send(0, "patch", relative_path, dict(kwargs, data=data))
+
+    def post(self, relative_path, data=None, **kwargs):
+        return self._send(0, "post", relative_path, dict(kwargs, data=data))
+
+    def put(self, relative_path, params=None, data=None, **kwargs):
+        return self._send(0, "put", relative_path, dict(kwargs, params=params, data=data))
+
+    def _read(self, method, relative_path, kwargs):
+        tried = set()
+        while True:
+            index = self._choose(tried)
+            tried.add(index)
+            try:
+                response = self._send(index, method, relative_path, kwargs)
+            except requests.ConnectionError:
+                if len(tried) == len(self.endpoints):
+                    raise
+                continue
+            if response.status_code in (502, 503, 504) and len(tried) < len(self.endpoints):
+                response.close()
+                continue
+            return response
+
+    def _choose(self, exclude):
+        now = time.time()
+        with self._lock:
+            candidates = [i for i in range(len(self.endpoints))
+                          if i not in exclude and self._states[i].down_until <= now]
+            if not candidates:
+                # everything is out of rotation: try whichever comes back first
+                candidates = sorted((i for i in range(len(self.endpoints)) if i not in exclude),
+                                    key=lambda i: self._states[i].down_until)[:1]
+            if len(candidates) > 2:
+                candidates = random.sample(candidates, 2)
+            return min(candidates, key=lambda i: self._states[i].score())
+
+    def _send(self, index, method, relative_path, kwargs):
+        state = self._states[index]
+        with self._lock:
+            state.in_flight += 1
+        start = time.time()
+        failed = False
+        sampled = False
+        try:
+            response = getattr(self.endpoints[index], method)(relative_path, **kwargs)
+            failed = response.status_code in (502, 503, 504)
+            sampled = True
+            return response
+        except requests.ConnectionError:
+            # includes ConnectTimeout, but not a ReadTimeout from a single slow answer
+            failed = True
+            raise
+        except requests.Timeout:
+            sampled = True
+            raise
+        finally:
+            elapsed = time.time() - start
+            with self._lock:
+                state.in_flight -= 1
+                if failed:
+                    state.down_until = time.time() + self._cooldown
+                elif sampled and state.latency is None:
+                    state.latency = elapsed
+                elif sampled:
+                    state.latency += self._alpha * (elapsed - state.latency)
+
+
+class _EndpointState(object):
+    def __init__(self):
+        self.latency = None
+        self.in_flight = 0
+        self.down_until = 0.0
+
+    def score(self):
+        # endpoints without latency samples yet are tried first
+        return (self.latency or 0.0) * (self.in_flight + 1)
+
 
 def append_url(base_url, path):
     """
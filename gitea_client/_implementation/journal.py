@@ -0,0 +1,93 @@
+"""
+Append-only JSON Lines journals for resumable bulk operations
+"""
+import io
+import json
+import os
+import threading
+
+
+class Journal(object):
+    """
+    An append-only log of JSON records. Every record is flushed as soon as it is
+    appended, so a journal can be replayed after an interrupted run to find out
+    which work has already been done.
+    """
+
+    def __init__(self, path, sync=False):
+        """
+        :param str path: location of the journal file; created if it does not exist
+        :param bool sync: whether to ``fsync`` after every record
+        """
+        self._path = path
+        self._sync = sync
+        self._lock = threading.Lock()
+        self._file = None
+
+    @property
+    def path(self):
+        return self._path
+
+    def replay(self):
+        """
+        Returns the records previously written to the journal, oldest first. A
+        truncated final record (e.g. from a crash mid-write) is ignored.
+
+        :rtype: List[dict]
+        """
+        if not os.path.exists(self._path):
+            return []
+        records = []
+        with io.open(self._path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    break
+        return records
+
+    def append(self, record):
+        """
+        Appends ``record`` to the journal. Safe to call from multiple threads.
+
+        :param dict record: JSON-serializable record
+        """
+        line = json.dumps(record, sort_keys=True) + "\n"
+        with self._lock:
+            if self._file is None:
+                self._file = io.open(self._path, "a", encoding="utf-8")
+            self._file.write(line)
+            self._file.flush()
+            if self._sync:
+                os.fsync(self._file.fileno())
+
+    def rewrite(self, records):
+        """
+        Atomically replaces the journal's content with ``records``, e.g. to drop
+        records that are no longer needed.
+
+        :param List[dict] records: JSON-serializable records
+        """
+        temporary_path = self._path + ".tmp"
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+            with io.open(temporary_path, "w", encoding="utf-8") as f:
+                for record in records:
+                    f.write(json.dumps(record, sort_keys=True) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temporary_path, self._path)
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
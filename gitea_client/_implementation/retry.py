@@ -0,0 +1,54 @@
+"""
+Retrying of API calls that fail for transient reasons
+"""
+import random
+import time
+
+from gitea_client.interface import ApiFailure, NetworkFailure
+
+
+def is_transient(exc):
+    """
+    Returns whether ``exc`` signals a failure that may go away if the request is
+    repeated: a network-level failure, rate limiting, or a server-side error.
+
+    :param Exception exc: exception raised by a :class:`~gitea_client.GiteaApi` call
+    :rtype: bool
+    """
+    if isinstance(exc, NetworkFailure):
+        return True
+    if isinstance(exc, ApiFailure):
+        return exc.status_code == 429 or exc.status_code >= 500
+    return False
+
+
+def call_with_retries(func, retries, backoff=1.0, max_backoff=60.0,
+                      is_retryable=is_transient, before_retry=None):
+    """
+    Calls ``func`` until it succeeds, retrying up to ``retries`` times when it raises
+    an exception accepted by ``is_retryable``, with jittered exponential backoff.
+
+    :param func: callable taking no arguments
+    :param int retries: maximum number of retries
+    :param float backoff: delay in seconds before the first retry
+    :param float max_backoff: maximum delay in seconds between attempts
+    :param is_retryable: predicate deciding whether an exception is worth retrying
+    :param before_retry: optional callable invoked, with the retry number, before each
+                         retry. If it returns something other than ``None``, that
+                         value is returned instead of calling ``func`` again.
+    :return: the return value of ``func``
+    """
+    attempt = 0
+    while True:
+        try:
+            return func()
+        except Exception as exc:
+            if attempt >= retries or not is_retryable(exc):
+                raise
+        delay = min(max_backoff, backoff * (2 ** attempt))
+        time.sleep(delay * random.uniform(0.5, 1.0))
+        attempt += 1
+        if before_retry is not None:
+            result = before_retry(attempt)
+            if result is not None:
+                return result
@@ -0,0 +1,67 @@
+"""
+Approximate quantiles in bounded memory
+"""
+import math
+
+
+class LogSketch(object):
+    """
+    A quantile sketch of positive values, counted in logarithmically sized buckets so
+    that every quantile is within ``relative_accuracy`` of a recorded value. Once there
+    are more than ``max_buckets`` buckets, the lowest ones are merged, trading accuracy
+    of low quantiles for bounded memory. Not thread-safe.
+    """
+
+    def __init__(self, relative_accuracy=0.01, max_buckets=2048):
+        """
+        :param float relative_accuracy: maximum relative error of quantiles
+        :param int max_buckets: maximum number of buckets kept
+        """
+        self._gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = math.log(self._gamma)
+        self._max_buckets = max_buckets
+        self._buckets = {}
+        self._zeros = 0
+        self.count = 0
+
+    def add(self, value):
+        self.count += 1
+        if value <= 1e-9:
+            self._zeros += 1
+            return
+        index = int(math.ceil(math.log(value) / self._log_gamma))
+        self._buckets[index] = self._buckets.get(index, 0) + 1
+        if len(self._buckets) > self._max_buckets:
+            self._collapse()
+
+    def merge(self, other):
+        """
+        Adds the values counted by ``other``, which must have the same accuracy
+        """
+        self.count += other.count
+        self._zeros += other._zeros
+        for index, count in other._buckets.items():
+            self._buckets[index] = self._buckets.get(index, 0) + count
+        while len(self._buckets) > self._max_buckets:
+            self._collapse()
+
+    def quantile(self, q):
+        """
+        :param float q: between 0 and 1
+        :return: the approximate ``q``-quantile, or ``None`` if no values were added
+        """
+        if self.count == 0:
+            return None
+        rank = q * (self.count - 1)
+        seen = self._zeros
+        if rank < seen:
+            return 0.0
+        for index in sorted(self._buckets):
+            seen += self._buckets[index]
+            if rank < seen:
+                return 2 * self._gamma ** index / (self._gamma + 1)
+        return 2 * self._gamma ** max(self._buckets) / (self._gamma + 1)
+
+    def _collapse(self):
+        lowest, second = sorted(self._buckets)[:2]
+        self._buckets[second] += self._buckets.pop(lowest)
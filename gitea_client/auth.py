@@ -12,7 +12,10 @@ class Authentication(object):
 
     def update_kwargs(self, kwargs):
         """
-        Updates kwargs to include this object's authentication information
+        Updates kwargs to include this object's authentication information. Values
+        within ``kwargs`` (such as a ``params`` dict) are replaced rather than modified,
+        so they may be shared with other callers.
+
         :param dict kwargs: dictionary of keyword arguments to pass to a function from
             the requests module
         :return: Updated kwargs
@@ -56,11 +59,23 @@ class Token(Authentication):
         """
         return self._token
 
+    def __eq__(self, other):
+        return isinstance(other, Token) and self._token == other._token
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash((Token, self._token))
+
     def update_kwargs(self, kwargs):
-        if "params" in kwargs:
-            kwargs["params"]["token"] = self._token
-        else:
+        params = kwargs.get("params")
+        if params is None:
             kwargs["params"] = {"token": self._token}
+        elif isinstance(params, dict):
+            kwargs["params"] = dict(params, token=self._token)
+        else:
+            kwargs["params"] = list(params) + [("token", self._token)]
 
 
 class UsernamePassword(Authentication):
@@ -93,5 +108,15 @@ class UsernamePassword(Authentication):
         """
         return self._password
 
+    def __eq__(self, other):
+        return isinstance(other, UsernamePassword) and \
+            (self._username, self._password) == (other._username, other._password)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash((UsernamePassword, self._username, self._password))
+
     def update_kwargs(self, kwargs):
         kwargs["auth"] = (self._username, self._password)
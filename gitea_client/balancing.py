@@ -0,0 +1,46 @@
+"""
+A Gitea client that spreads reads over several frontend nodes of one Gitea server
+"""
+from gitea_client._implementation.http_utils import BalancingHttpRequestor, append_url
+from gitea_client.interface import GiteaApi
+
+
+class MultiEndpointGiteaApi(GiteaApi):
+    """
+    A :class:`~gitea_client.GiteaApi` for a Gitea server reachable through several
+    equivalent URLs, e.g. frontend nodes behind which the same server runs.
+
+    Reads (``get_repo``, ``get_branches``, ``search_users``, ``repo_exists``, ...) are
+    sent to the endpoint with the best latency and load, chosen between two random
+    endpoints; mutations are always sent to the primary. Endpoints that fail to
+    connect or answer with a 502, 503 or 504 are taken out of rotation for
+    ``cooldown`` seconds, and the read is retried elsewhere.
+    """
+
+    def __init__(self, base_url, replica_urls, cooldown=10.0, **kwargs):
+        """
+        :param str base_url: URL of the primary endpoint, which receives all mutations
+                             and also serves reads
+        :param List[str] replica_urls: URLs of further endpoints serving reads
+        :param float cooldown: seconds a failed endpoint stays out of rotation
+        :param kwargs: further arguments, as for :class:`~gitea_client.GiteaApi`, except
+                       ``session``
+        :raises TypeError: if ``session`` is given, as each endpoint needs its own
+        """
+        if "session" in kwargs:
+            raise TypeError("MultiEndpointGiteaApi does not accept a session")
+        GiteaApi.__init__(self, base_url, **kwargs)
+        self._config.update(replica_urls=list(replica_urls), cooldown=cooldown)
+        urls = [append_url(url, "/api/v1/") for url in [base_url] + list(replica_urls)]
+        self._requestor = BalancingHttpRequestor(urls, pool_size=self._config["pool_size"],
+                                                 max_retries=self._config["max_retries"],
+                                                 cooldown=cooldown,
+                                                 disk_cache=self._config["disk_cache"],
+                                                 adapter=self._config["adapter"])
+
+    def healthy_endpoints(self):
+        """
+        :return: API base URLs of the endpoints currently in rotation
+        :rtype: List[str]
+        """
+        return self._requestor.healthy_endpoints()
@@ -0,0 +1,319 @@
+"""
+Bulk operations that apply the same change across many repositories or users
+"""
+import base64
+import binascii
+import csv
+import hashlib
+import json
+
+import attr
+
+from gitea_client._implementation.concurrency import bounded_map
+from gitea_client._implementation.journal import Journal
+from gitea_client.interface import ApiFailure
+from gitea_client.updates import GiteaUserUpdate
+
+
+def key_fingerprint(key_content):
+    """
+    Returns the SHA256 fingerprint of an OpenSSH public key, in the format used by
+    ``ssh-keygen -l`` and by Gitea (``"SHA256:<unpadded base64>"``).
+
+    :param str key_content: the public key, e.g. ``"ssh-ed25519 AAAA... comment"``
+    :return: the key's fingerprint
+    :rtype: str
+    :raises ValueError: if ``key_content`` is not an OpenSSH public key
+    """
+    parts = key_content.split()
+    if len(parts) < 2:
+        raise ValueError("Not an OpenSSH public key")
+    try:
+        blob = base64.b64decode(parts[1].encode("ascii"), validate=True)
+    except (binascii.Error, UnicodeError):
+        raise ValueError("Not an OpenSSH public key")
+    digest = base64.b64encode(hashlib.sha256(blob).digest()).decode("ascii")
+    return "SHA256:" + digest.rstrip("=")
+
+
+class KeyRotationFailure(Exception):
+    """
+    Raised when a newly added deploy key does not show up in a repository's key set
+    """
+
+
+@attr.s(frozen=True)
+class DeployKeyRotation(object):
+    """
+    An immutable summary of a :func:`rotate_deploy_key` run
+    """
+
+    #: Repositories rotated during this run
+    #:
+    #: :type: List[Tuple[str, str]]
+    rotated = attr.ib()
+
+    #: Repositories skipped because the journal records them as already rotated
+    #:
+    #: :type: List[Tuple[str, str]]
+    resumed = attr.ib()
+
+    #: Repositories whose rotation failed, mapped to the exception that stopped it.
+    #: The old key is never deleted from these repositories.
+    #:
+    #: :type: Dict[Tuple[str, str], Exception]
+    failed = attr.ib()
+
+
+def rotate_deploy_key(api, auth, repos, old_fingerprint, new_key, title,
+                      journal_path=None, concurrency=16):
+    """
+    Replaces the deploy key with fingerprint ``old_fingerprint`` by ``new_key`` in
+    every repository of ``repos``, working on up to ``concurrency`` repositories at
+    a time.
+
+    For each repository the new key is added (unless already present), the
+    repository's key set is re-listed to check that it contains the new key, and
+    only then are keys with the old fingerprint deleted, so a repository is never
+    left without a working key.
+
+    If ``journal_path`` is given, progress is appended to that file, and repositories
+    that an earlier run with the same keys finished are skipped.
+
+    :param GiteaApi api: client to perform the rotation with
+    :param auth.Authentication auth: authentication object
+    :param repos: iterable of ``(owner username, repository name)`` tuples
+    :param str old_fingerprint: SHA256 fingerprint of the key to remove
+    :param str new_key: content of the public key to add
+    :param str title: title of the new deploy key
+    :param str journal_path: location of the journal file
+    :param int concurrency: maximum number of repositories rotated at once
+    :return: summary of the rotation
+    :rtype: DeployKeyRotation
+    """
+    new_fingerprint = key_fingerprint(new_key)
+    if new_fingerprint == old_fingerprint:
+        raise ValueError("The new key has the same fingerprint as the old key")
+
+    journal = Journal(journal_path) if journal_path is not None else None
+    finished = set()
+    if journal is not None:
+        for record in journal.replay():
+            if record["old"] == old_fingerprint and record["new"] == new_fingerprint \
+                    and record["state"] == "done":
+                finished.add(tuple(record["repo"]))
+
+    def record(repo, state):
+        if journal is not None:
+            journal.append({"repo": list(repo), "state": state,
+                            "old": old_fingerprint, "new": new_fingerprint})
+
+    def has_new_key(keys):
+        return any(_fingerprint_of(key) == new_fingerprint for key in keys)
+
+    def rotate(repo):
+        username, repo_name = repo
+        keys = api.list_deploy_keys(auth, username, repo_name)
+        if not has_new_key(keys):
+            api.add_deploy_key(auth, username, repo_name, title, new_key)
+            record(repo, "added")
+            keys = api.list_deploy_keys(auth, username, repo_name)
+            if not has_new_key(keys):
+                raise KeyRotationFailure("New key missing from {}/{} after being added"
+                                         .format(username, repo_name))
+        record(repo, "verified")
+        for key in keys:
+            if _fingerprint_of(key) == old_fingerprint:
+                api.delete_deploy_key(auth, username, repo_name, key.id)
+        record(repo, "done")
+
+    resumed = []
+
+    def pending():
+        for repo in repos:
+            repo = tuple(repo)
+            if repo in finished:
+                resumed.append(repo)
+            else:
+                yield repo
+
+    rotated = []
+    failed = {}
+    try:
+        for repo, _, exc in bounded_map(rotate, pending(), concurrency):
+            if exc is None:
+                rotated.append(repo)
+            else:
+                failed[repo] = exc
+                record(repo, "failed")
+    finally:
+        if journal is not None:
+            journal.close()
+    return DeployKeyRotation(rotated, resumed, failed)
+
+
+@attr.s(frozen=True)
+class BranchHeadChanges(object):
+    """
+    An immutable summary of the differences between two results of
+    :meth:`GiteaApi.branch_heads`. All keys are ``(owner, repository name, branch name)`` tuples.
+    """
+
+    #: New branches, mapped to their HEAD commit id
+    #:
+    #: :type: Dict[Tuple[str, str, str], str]
+    created = attr.ib()
+
+    #: Branches whose HEAD moved, mapped to ``(old commit id, new commit id)``
+    #:
+    #: :type: Dict[Tuple[str, str, str], Tuple[str, str]]
+    moved = attr.ib()
+
+    #: Deleted branches, mapped to their last known HEAD commit id
+    #:
+    #: :type: Dict[Tuple[str, str, str], str]
+    deleted = attr.ib()
+
+    def __bool__(self):
+        return bool(self.created or self.moved or self.deleted)
+
+    __nonzero__ = __bool__
+
+
+def diff_branch_heads(old, new):
+    """
+    Compares two results of :meth:`GiteaApi.branch_heads`.
+
+    :param dict old: earlier branch heads
+    :param dict new: later branch heads
+    :return: the branches created, moved and deleted between ``old`` and ``new``
+    :rtype: BranchHeadChanges
+    """
+    created = {key: commit_id for (key, commit_id) in new.items() if key not in old}
+    deleted = {key: commit_id for (key, commit_id) in old.items() if key not in new}
+    moved = {key: (commit_id, new[key]) for (key, commit_id) in old.items()
+             if key in new and new[key] != commit_id}
+    return BranchHeadChanges(created, moved, deleted)
+
+
+def read_user_records(source, format="csv"):
+    """
+    Lazily reads user records from a CSV file with a header row, or from a JSON Lines
+    file. In CSV files, ``true``/``false`` (in any case) are read as booleans in the
+    ``active``, ``admin``, ``allow_git_hook``, ``allow_import_local`` and
+    ``send_notify`` columns, and empty fields are ignored.
+
+    :param source: file object opened in text mode
+    :param str format: either ``"csv"`` or ``"jsonl"``
+    :return: iterator of records
+    :rtype: Iterator[dict]
+    """
+    if format == "jsonl":
+        return (json.loads(line) for line in source if line.strip())
+    elif format == "csv":
+        return ({k: _csv_value(k, v) for (k, v) in row.items() if v not in (None, "")}
+                for row in csv.DictReader(source))
+    raise ValueError("Unknown format: {}".format(format))
+
+
+_BOOLEAN_FIELDS = frozenset(["active", "admin", "allow_git_hook", "allow_import_local",
+                             "send_notify"])
+
+_USER_UPDATE_SETTERS = {
+    "source_id": GiteaUserUpdate.Builder.set_source_id,
+    "full_name": GiteaUserUpdate.Builder.set_full_name,
+    "website": GiteaUserUpdate.Builder.set_website,
+    "location": GiteaUserUpdate.Builder.set_location,
+    "active": GiteaUserUpdate.Builder.set_active,
+    "admin": GiteaUserUpdate.Builder.set_admin,
+    "allow_git_hook": GiteaUserUpdate.Builder.set_allow_git_hook,
+    "allow_import_local": GiteaUserUpdate.Builder.set_allow_import_local,
+}
+
+
+def import_users(api, auth, records, results, concurrency=8, probe=True):
+    """
+    Creates a user for every record of ``records``, working on up to ``concurrency``
+    records at a time, and writes one JSON line per record to ``results`` as soon as
+    the record is processed. Records are consumed lazily, so memory use does not
+    grow with the number of records.
+
+    Each record is a dict with keys ``username``, ``email`` and ``password``, and
+    optionally ``login_name`` (defaults to ``username``) and ``send_notify``. Any of
+    the keys ``source_id``, ``full_name``, ``website``, ``location``, ``active``,
+    ``admin``, ``allow_git_hook`` and ``allow_import_local`` are applied with
+    :meth:`GiteaApi.update_user` after the user is created.
+
+    Users that already exist, either according to an existence probe or because the
+    server rejects their creation with a 409 or 422 response, are not created again,
+    but any of those keys that differ from the user's current state are applied. So
+    rerunning an import completes records whose update failed after the user was
+    created.
+
+    Lines written to ``results`` have the form ``{"username": ..., "status": ...}``,
+    where the status is ``"created"``, ``"updated"`` (existing user that needed
+    updating), ``"exists"`` or ``"failed"``; failed records also have an ``"error"``
+    field.
+
+    :param GiteaApi api: client to create users with
+    :param auth.Authentication auth: authentication object, must be admin-level
+    :param records: iterable of user records, e.g. from :func:`read_user_records`
+    :param results: file object opened in text mode
+    :param int concurrency: maximum number of records processed at once
+    :param bool probe: whether to check whether each user exists before creating it
+    :return: number of records with each status
+    :rtype: Dict[str, int]
+    """
+    def provision(record):
+        username = record["username"]
+        login_name = record.get("login_name", username)
+        exists = probe and api.user_exists(username)
+        if not exists:
+            try:
+                api.create_user(auth, login_name, username, record["email"], record["password"],
+                                send_notify=record.get("send_notify", False))
+            except ApiFailure as exc:
+                if exc.status_code not in (409, 422):
+                    raise
+                exists = True
+        fields = [field for field in sorted(_USER_UPDATE_SETTERS) if field in record]
+        if not fields:
+            return "exists" if exists else "created"
+        builder = GiteaUserUpdate.Builder(login_name, record["email"])
+        for field in fields:
+            _USER_UPDATE_SETTERS[field](builder, record[field])
+        update = builder.build()
+        if exists:
+            update = update.changes_from(api.get_user(auth, username))
+            if update is None:
+                return "exists"
+        api.update_user(auth, username, update)
+        return "updated" if exists else "created"
+
+    counts = {"created": 0, "updated": 0, "exists": 0, "failed": 0}
+    for record, status, exc in bounded_map(provision, records, concurrency):
+        line = {"username": record.get("username")}
+        if exc is None:
+            line["status"] = status
+        else:
+            line["status"] = "failed"
+            line["error"] = str(exc)
+        counts[line["status"]] += 1
+        results.write(json.dumps(line, sort_keys=True) + "\n")
+        results.flush()
+    return counts
+
+
+def _csv_value(key, value):
+    if key in _BOOLEAN_FIELDS and value.lower() in ("true", "false"):
+        return value.lower() == "true"
+    return value
+
+
+def _fingerprint_of(deploy_key):
+    if deploy_key.fingerprint:
+        return deploy_key.fingerprint
+    try:
+        return key_fingerprint(deploy_key.key)
+    except ValueError:
+        return None
@@ -0,0 +1,284 @@
+"""
+A response cache on disk, shared between threads and processes
+"""
+import hashlib
+import hmac
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS responses (
+    url TEXT NOT NULL,
+    identity TEXT NOT NULL,
+    status INTEGER NOT NULL,
+    headers TEXT NOT NULL,
+    body BLOB NOT NULL,
+    etag TEXT,
+    expires REAL NOT NULL,
+    accessed REAL NOT NULL,
+    size INTEGER NOT NULL,
+    PRIMARY KEY (url, identity)
+);
+CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed);
+
+-- running total of the responses' sizes, so that writes need not sum them
+INSERT OR IGNORE INTO meta (key, value) SELECT 'total_size', COALESCE(SUM(size), 0) FROM responses;
+CREATE TRIGGER IF NOT EXISTS responses_inserted AFTER INSERT ON responses BEGIN
+    UPDATE meta SET value = CAST(value AS INTEGER) + NEW.size WHERE key = 'total_size';
+END;
+CREATE TRIGGER IF NOT EXISTS responses_deleted AFTER DELETE ON responses BEGIN
+    UPDATE meta SET value = CAST(value AS INTEGER) - OLD.size WHERE key = 'total_size';
+END;
+"""
+
+
+class CachedResponse(object):
+    """
+    A response stored in a :class:`~DiskCache`
+    """
+
+    def __init__(self, status, headers, body, etag, expires):
+        self.status = status
+        self.headers = headers
+        self.body = body
+        self.etag = etag
+        self.expires = expires
+
+    @property
+    def fresh(self):
+        """
+        Whether the response may be used without revalidating it with the server
+
+        :type: bool
+        """
+        return self.expires > time.time()
+
+
+class DiskCache(object):
+    """
+    A cache of successful GET responses in an SQLite database, which any number of
+    threads and processes may use at once.
+
+    Responses are kept for ``ttl`` seconds, regardless of the server's
+    ``Cache-Control`` headers, and are then revalidated with their ``ETag`` when they
+    have one. Once the stored responses exceed ``max_bytes``, the least recently used
+    are evicted.
+
+    Responses are stored per authentication identity: a salted hash of the
+    credentials that requested them. Credentials themselves are never stored.
+
+    Errors accessing the database are logged, and treated as cache misses.
+
+    Pass an instance as the ``disk_cache`` argument of :class:`~gitea_client.GiteaApi`.
+    Pickled instances refer to the same database.
+    """
+
+    def __init__(self, path, ttl=60.0, max_bytes=64 * 1024 * 1024):
+        """
+        :param str path: location of the database; created if it does not exist
+        :param float ttl: seconds a response is used without revalidation
+        :param int max_bytes: maximum total size of stored responses
+        """
+        self._path = path
+        self._ttl = ttl
+        self._max_bytes = max_bytes
+        self._reset()
+
+    def __getstate__(self):
+        return {"path": self._path, "ttl": self._ttl, "max_bytes": self._max_bytes}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    def __eq__(self, other):
+        return isinstance(other, DiskCache) and self.__getstate__() == other.__getstate__()
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash((self._path, self._ttl, self._max_bytes))
+
+    @property
+    def path(self):
+        return self._path
+
+    @property
+    def ttl(self):
+        return self._ttl
+
+    @property
+    def max_bytes(self):
+        return self._max_bytes
+
+    def identity(self, *credentials):
+        """
+        Returns an opaque identifier for ``credentials``, from which they cannot be
+        recovered, or ``None`` if the database cannot be read
+
+        :param credentials: strings or tuples of strings identifying a user, or ``None``
+        :rtype: str
+        """
+        try:
+            salt = self._salt()
+        except sqlite3.Error:
+            logger.warning("Could not read from response cache %s", self._path, exc_info=True)
+            return None
+        secret = json.dumps(credentials).encode("utf-8")
+        return hmac.new(salt.encode("ascii"), secret, hashlib.sha256).hexdigest()
+
+    def get(self, url, identity):
+        """
+        :param str url: URL of the response, including its query
+        :param str identity: result of :meth:`identity` for the requesting credentials
+        :return: the stored response, fresh or not, or ``None``
+        :rtype: CachedResponse
+        """
+        try:
+            connection = self._connection()
+            row = connection.execute(
+                "SELECT status, headers, body, etag, expires, accessed FROM responses "
+                "WHERE url = ? AND identity = ?", (url, identity)).fetchone()
+            if row is None:
+                return None
+            status, headers, body, etag, expires, accessed = row
+            now = time.time()
+            if now - accessed > 1.0:
+                # recency only matters for eviction; don't write on every hit
+                with connection:
+                    connection.execute("UPDATE responses SET accessed = ? WHERE url = ? AND identity = ?",
+                                       (now, url, identity))
+            return CachedResponse(status, json.loads(headers), bytes(body), etag, expires)
+        except sqlite3.Error:
+            logger.warning("Could not read from response cache %s", self._path, exc_info=True)
+            return None
+
+    def put(self, url, identity, status, headers, body, etag=None):
+        """
+        Stores a response, evicting least recently used responses if needed
+
+        :param str url: URL of the response, including its query
+        :param str identity: result of :meth:`identity` for the requesting credentials
+        :param int status: the response's status code
+        :param dict headers: the response's headers
+        :param bytes body: the response's (decoded) body
+        :param str etag: the response's ``ETag`` header, if any
+        """
+        now = time.time()
+        size = len(body) + len(url)
+        if size > self._max_bytes:
+            return
+        try:
+            connection = self._connection()
+            with connection:
+                # not INSERT OR REPLACE, whose deletions do not fire the size trigger
+                connection.execute("DELETE FROM responses WHERE url = ? AND identity = ?", (url, identity))
+                connection.execute(
+                    "INSERT INTO responses "
+                    "(url, identity, status, headers, body, etag, expires, accessed, size) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (url, identity, status, json.dumps(headers), sqlite3.Binary(body), etag,
+                     now + self._ttl, now, size))
+                self._evict(connection)
+        except sqlite3.Error:
+            logger.warning("Could not write to response cache %s", self._path, exc_info=True)
+
+    def refresh(self, url, identity):
+        """
+        Marks a stored response as fresh for another ``ttl`` seconds, e.g. after the
+        server confirmed it is unchanged
+        """
+        now = time.time()
+        try:
+            connection = self._connection()
+            with connection:
+                connection.execute(
+                    "UPDATE responses SET expires = ?, accessed = ? WHERE url = ? AND identity = ?",
+                    (now + self._ttl, now, url, identity))
+        except sqlite3.Error:
+            logger.warning("Could not write to response cache %s", self._path, exc_info=True)
+
+    def discard_prefix(self, url_prefix):
+        """
+        Removes the responses for ``url_prefix`` and for every URL below it, for all
+        identities. URLs are matched case-insensitively
+        """
+        escaped = url_prefix.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+        try:
+            connection = self._connection()
+            with connection:
+                connection.execute(
+                    "DELETE FROM responses WHERE url = ? COLLATE NOCASE"
+                    " OR url LIKE ? ESCAPE '\\' OR url LIKE ? ESCAPE '\\'",
+                    (url_prefix, escaped + "/%", escaped + "?%"))
+        except sqlite3.Error:
+            logger.warning("Could not write to response cache %s", self._path, exc_info=True)
+
+    def clear(self):
+        """
+        Removes every stored response
+        """
+        try:
+            connection = self._connection()
+            with connection:
+                connection.execute("DELETE FROM responses")
+        except sqlite3.Error:
+            logger.warning("Could not write to response cache %s", self._path, exc_info=True)
+
+    def __len__(self):
+        try:
+            return self._connection().execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+        except sqlite3.Error:
+            logger.warning("Could not read from response cache %s", self._path, exc_info=True)
+            return 0
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self._local = threading.local()
+        self._salt_value = None
+
+    def _connection(self):
+        if self._pid != os.getpid():
+            # forked: SQLite connections must not be shared with the parent process
+            self._reset()
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self._path, timeout=30)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.executescript(_SCHEMA)
+            self._local.connection = connection
+        return connection
+
+    def _salt(self):
+        if self._salt_value is None:
+            connection = self._connection()
+            with connection:
+                connection.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('salt', ?)",
+                                   (os.urandom(16).hex(),))
+            self._salt_value = connection.execute("SELECT value FROM meta WHERE key = 'salt'").fetchone()[0]
+        return self._salt_value
+
+    def _evict(self, connection):
+        total = int(connection.execute("SELECT value FROM meta WHERE key = 'total_size'").fetchone()[0])
+        if total <= self._max_bytes:
+            return
+        # evict down to 90% of the limit, so that eviction does not run on every write
+        excess = total - int(self._max_bytes * 0.9)
+        victims = []
+        for url, identity, size in connection.execute(
+                "SELECT url, identity, size FROM responses ORDER BY accessed"):
+            victims.append((url, identity))
+            excess -= size
+            if excess <= 0:
+                break
+        connection.executemany("DELETE FROM responses WHERE url = ? AND identity = ?", victims)
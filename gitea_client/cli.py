@@ -0,0 +1,144 @@
+"""
+The ``gitea-client`` command, which runs a :class:`~gitea_client.GiteaApi` operation
+for every target read as JSON Lines, and writes one JSON line per result.
+
+Example::
+
+    $ export GITEA_TOKEN=...
+    $ printf '{"username": "alice", "repo_name": "notes"}\\n' \\
+        | gitea-client --url https://git.example.com repo exists
+    {"input": {"repo_name": "notes", "username": "alice"}, "line": 1, "result": true, "status": "ok"}
+
+Each input line holds the keyword arguments of the operation's method; e.g. ``repo
+create`` takes the arguments of :meth:`GiteaApi.create_repo` (``name``,
+``description``, ``private``, ...). Results are written as soon as they are known,
+so they may be out of input order; ``line`` gives the input line number. The exit
+status is 1 if any target failed.
+"""
+import argparse
+import inspect
+import json
+import os
+import sys
+
+from gitea_client._implementation.concurrency import bounded_map
+from gitea_client.auth import Token, UsernamePassword
+from gitea_client.entities import GiteaEntity, strip_json
+from gitea_client.interface import GiteaApi
+
+#: Maps ``(command, subcommand)`` to the name of the :class:`~GiteaApi` method it runs
+COMMANDS = {
+    ("repo", "create"): "create_repo",
+    ("repo", "delete"): "delete_repo",
+    ("repo", "exists"): "repo_exists",
+    ("team", "add-member"): "add_team_membership",
+    ("team", "remove-member"): "remove_team_membership",
+    ("hook", "create"): "create_hook",
+    ("deploy-key", "add"): "add_deploy_key",
+}
+
+
+def build_parser():
+    """
+    :rtype: argparse.ArgumentParser
+    """
+    parser = argparse.ArgumentParser(
+        prog="gitea-client",
+        description="Run a Gitea API operation for every JSON line of the input.")
+    parser.add_argument("--url", default=os.environ.get("GITEA_URL"),
+                        help="URL of the Gitea server (default: $GITEA_URL)")
+    parser.add_argument("--token", default=os.environ.get("GITEA_TOKEN"),
+                        help="access token (default: $GITEA_TOKEN)")
+    parser.add_argument("--username", default=os.environ.get("GITEA_USERNAME"),
+                        help="username to authenticate with instead of a token, with the "
+                             "password taken from $GITEA_PASSWORD")
+    parser.add_argument("--input", "-i", type=argparse.FileType("r"), default=sys.stdin,
+                        help="JSON Lines file of targets (default: stdin)")
+    parser.add_argument("--concurrency", "-c", type=int, default=8,
+                        help="maximum number of operations in flight (default: 8)")
+    commands = parser.add_subparsers(dest="command")
+    commands.required = True
+    subparsers = {}
+    for command, subcommand in sorted(COMMANDS):
+        if command not in subparsers:
+            subparsers[command] = commands.add_parser(command).add_subparsers(dest="subcommand")
+            subparsers[command].required = True
+        method = getattr(GiteaApi, COMMANDS[(command, subcommand)])
+        subparsers[command].add_parser(subcommand, help=inspect.getdoc(method).splitlines()[0])
+    return parser
+
+
+def main(argv=None):
+    """
+    Runs the ``gitea-client`` command.
+
+    :param List[str] argv: command-line arguments; defaults to ``sys.argv[1:]``
+    :return: exit status
+    :rtype: int
+    """
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if not args.url:
+        parser.error("a server URL is required (--url or $GITEA_URL)")
+    if args.username:
+        auth = UsernamePassword(args.username, os.environ.get("GITEA_PASSWORD", ""))
+    elif args.token:
+        auth = Token(args.token)
+    else:
+        parser.error("authentication is required (--token, $GITEA_TOKEN or --username)")
+    if args.concurrency < 1:
+        parser.error("--concurrency must be at least 1")
+
+    api = GiteaApi(args.url, pool_size=args.concurrency)
+    method = getattr(api, COMMANDS[(args.command, args.subcommand)])
+
+    def run(target):
+        _, record = target
+        signature = inspect.signature(method)
+        try:
+            signature.bind(auth, **record)
+        except TypeError as exc:
+            raise ValueError("Invalid target: {}".format(exc))
+        return method(auth, **record)
+
+    failures = 0
+    out = sys.stdout
+    for (line_number, record), result, exc in bounded_map(run, _targets(args.input), args.concurrency):
+        line = {"line": line_number, "input": record}
+        if exc is None:
+            line["status"] = "ok"
+            line["result"] = _jsonable(result)
+        else:
+            failures += 1
+            line["status"] = "failed"
+            line["error"] = str(exc)
+        out.write(json.dumps(line, sort_keys=True) + "\n")
+        out.flush()
+    return 1 if failures else 0
+
+
+def _targets(source):
+    """
+    Yields ``(line number, record)`` for every non-blank line of ``source``. Lines that
+    are not JSON objects are passed on as strings, and fail when run.
+    """
+    for line_number, line in enumerate(source, 1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError:
+            record = line.rstrip("\n")
+        yield line_number, record
+
+
+def _jsonable(result):
+    if isinstance(result, GiteaEntity):
+        return strip_json(result.json)
+    if isinstance(result, list):
+        return [_jsonable(item) for item in result]
+    return result
+
+
+if __name__ == "__main__":
+    sys.exit(main())
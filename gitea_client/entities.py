@@ -17,6 +17,18 @@ def json_get(parsed_json, key):
     return parsed_json[key]
 
 
+def strip_json(value):
+    """
+    Returns a copy of parsed JSON without the ``"json"`` keys that
+    :meth:`GiteaEntity.from_json` adds to nested objects
+    """
+    if isinstance(value, dict):
+        return {k: strip_json(v) for (k, v) in value.items() if k != "json"}
+    if isinstance(value, list):
+        return [strip_json(v) for v in value]
+    return value
+
+
 @attr.s
 class GiteaEntity(object):
     json = attr.ib()
@@ -284,6 +296,11 @@ class GiteaRepo(GiteaEntity):
         #: :type: bool
         read_only = attr.ib()
 
+        #: SHA256 fingerprint of the key (e.g. ``"SHA256:..."``), if reported by the server
+        #:
+        #: :type: str
+        fingerprint = attr.ib(default=None)
+
 
 @attr.s(frozen=True)
 class GiteaBranch(GiteaEntity):
@@ -0,0 +1,75 @@
+"""
+Configuration and statistics of hedged requests
+"""
+import attr
+
+
+@attr.s(frozen=True)
+class HedgePolicy(object):
+    """
+    An immutable description of when a :class:`~gitea_client.GiteaApi` hedges a GET
+    request, i.e. sends a duplicate of a request that is slow to answer and uses
+    whichever response arrives first.
+    """
+
+    #: Percentile of recent response times after which a duplicate is sent
+    #:
+    #: :type: float
+    percentile = attr.ib(default=95.0)
+
+    #: Maximum number of duplicates, as a fraction of all GET requests
+    #:
+    #: :type: float
+    budget = attr.ib(default=0.05)
+
+    #: Delay (in seconds) used until enough response times are known
+    #:
+    #: :type: float
+    initial_delay = attr.ib(default=0.5)
+
+    #: Lower bound (in seconds) of the delay
+    #:
+    #: :type: float
+    min_delay = attr.ib(default=0.005)
+
+    #: Number of recent response times the delay is computed from
+    #:
+    #: :type: int
+    window = attr.ib(default=512)
+
+    #: Number of response times needed before the percentile is used
+    #:
+    #: :type: int
+    min_samples = attr.ib(default=20)
+
+
+@attr.s(frozen=True)
+class HedgeStats(object):
+    """
+    An immutable snapshot of a client's hedging statistics
+    """
+
+    #: Number of GET requests eligible for hedging
+    #:
+    #: :type: int
+    requests = attr.ib()
+
+    #: Number of duplicates sent
+    #:
+    #: :type: int
+    hedged = attr.ib()
+
+    #: Number of requests answered by their duplicate
+    #:
+    #: :type: int
+    hedge_wins = attr.ib()
+
+    #: Number of slow requests not duplicated because the budget was spent
+    #:
+    #: :type: int
+    over_budget = attr.ib()
+
+    #: Current delay (in seconds) before a duplicate is sent
+    #:
+    #: :type: float
+    delay = attr.ib()
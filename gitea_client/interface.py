@@ -1,23 +1,104 @@
+import functools
+import inspect
+import time
+
+import attr
 import requests
 
-from gitea_client._implementation.http_utils import RelativeHttpRequestor, append_url
+from gitea_client._implementation.cache import TtlCache
+from gitea_client._implementation.concurrency import bounded_map
+from gitea_client._implementation.hedging import Hedger
+from gitea_client._implementation.http_utils import NO_CACHE, RelativeHttpRequestor, append_url
 from gitea_client.auth import Token
 from gitea_client.entities import GiteaUser, GiteaRepo, GiteaBranch, GiteaOrg, GiteaTeam
+from gitea_client.metrics import endpoint_template
 
 
 class GiteaApi(object):
     """
     A Gitea client, serving as a wrapper around the Gitea HTTP API.
+
+    A single instance may be shared between threads. Unless a session is supplied,
+    every thread uses its own ``requests`` session, and all of them draw on one
+    connection pool of ``pool_size`` connections.
+
+    Instances can be pickled, e.g. to pass them to ``multiprocessing`` workers. Only
+    the configuration is pickled: the unpickled client starts with empty caches and
+    its own connections, and does not use any session supplied to the original.
+    Connections inherited through ``fork`` are likewise discarded automatically.
     """
 
-    def __init__(self, base_url, session=None):
+    def __init__(self, base_url, session=None, negative_cache_ttl=None, cache_ttl=None,
+                 pool_size=16, max_retries=0, hedging=None, disk_cache=None, metrics=None,
+                 tracer=None, adapter=None):
         """
         :param str base_url: the URL of the Gitea server to communicate with. Should be given
                              with the https protocol
-        :param requests.Session session: a ``requests`` session instance
-        """
+        :param requests.Session session: a ``requests`` session instance, used by every thread
+        :param float negative_cache_ttl: if given, :meth:`repo_exists` and :meth:`user_exists`
+                                         remember for this many seconds that a repository or
+                                         user does not exist
+        :param float cache_ttl: if given, the results of :meth:`get_repo`, :meth:`get_branch`,
+                                :meth:`get_branches` and :meth:`repo_exists` are cached for this
+                                many seconds. See :meth:`invalidate_for_event` for keeping
+                                long-lived cache entries fresh
+        :param int pool_size: maximum number of connections kept open to the server. Should
+                              be at least the number of threads sharing the client
+        :param int max_retries: number of times to retry requests that fail to connect
+        :param hedging.HedgePolicy hedging: if given, GET requests that are slow to answer
+                                            are duplicated according to this policy, and
+                                            whichever response arrives first is used
+        :param cache.DiskCache disk_cache: if given, GET responses are cached on disk, where
+                                           other clients and processes using the same
+                                           database find them
+        :param metrics.Metrics metrics: if given, every request and the decoding of every
+                                        response is recorded there
+        :param tracing.Tracer tracer: if given, spans are opened there for calls of public
+                                      methods, and within them for every request and the
+                                      decoding of every response
+        :param requests.adapters.BaseAdapter adapter: if given, requests are sent with this
+                                                      transport adapter instead of a pooling
+                                                      one, e.g. one of :mod:`~gitea_client.transports`
+        """
+        self._config = {"base_url": base_url, "negative_cache_ttl": negative_cache_ttl,
+                        "cache_ttl": cache_ttl, "pool_size": pool_size, "max_retries": max_retries,
+                        "hedging": hedging, "disk_cache": disk_cache, "metrics": metrics,
+                        "tracer": tracer, "adapter": adapter}
         api_base = append_url(base_url, "/api/v1/")
-        self._requestor = RelativeHttpRequestor(api_base, session=session)
+        self._requestor = RelativeHttpRequestor(api_base, session=session, pool_size=pool_size,
+                                                max_retries=max_retries, disk_cache=disk_cache,
+                                                adapter=adapter)
+        self._head_supported = True
+        self._negative_cache = None if negative_cache_ttl is None else TtlCache(negative_cache_ttl)
+        self._cache = None if cache_ttl is None else TtlCache(cache_ttl)
+        self._metrics = metrics
+        self._tracer = tracer
+        self._hedger = None if hedging is None else Hedger(hedging, workers=2 * pool_size,
+                                                           metrics=metrics)
+
+    def __getstate__(self):
+        return dict(self._config)
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    def warm_up(self, connections=None, timeout=5.0):
+        """
+        Checks that the server is reachable, and opens up to ``connections`` pooled
+        connections at once, so that subsequent (concurrent) calls do not pay for DNS
+        lookups and TCP and TLS handshakes. Uses the cheap ``/version`` endpoint.
+
+        :param int connections: number of connections to open; defaults to ``pool_size``
+        :param float timeout: seconds to wait for each response
+        :return: reachability of the server and measured round-trip times
+        :rtype: WarmUpReport
+        """
+        if connections is None:
+            connections = self._config["pool_size"]
+        results = self._requestor.warm_up(connections, "/version", timeout)
+        rtts = sorted(r for r in results if isinstance(r, float))
+        errors = [NetworkFailure(r) for r in results if not isinstance(r, float)]
+        return WarmUpReport(rtts, errors)
 
     def valid_authentication(self, auth):
         """
@@ -42,7 +123,7 @@ class GiteaApi(object):
         :raises ApiFailure: if the request cannot be serviced
         """
         response = self.get("/user", auth=auth)
-        return GiteaUser.from_json(response.json())
+        return self._decode(response, GiteaUser)
 
     def get_tokens(self, auth, username=None):
         """
@@ -62,7 +143,7 @@ class GiteaApi(object):
         if username is None:
             username = self.authenticated_user(auth).username
         response = self.get("/users/{u}/tokens".format(u=username), auth=auth)
-        return [Token.from_json(o) for o in response.json()]
+        return self._decode(response, Token, many=True)
 
     def create_token(self, auth, name, username=None):
         """
@@ -84,7 +165,8 @@ class GiteaApi(object):
             username = self.authenticated_user(auth).username
         data = {"name": name}
         response = self.post("/users/{u}/tokens".format(u=username), auth=auth, data=data)
-        return Token.from_json(response.json())
+        self._discard_cached("/users/{u}/tokens".format(u=username))
+        return self._decode(response, Token)
 
     def ensure_token(self, auth, name, username=None):
         """
@@ -144,7 +226,31 @@ class GiteaApi(object):
         data = {k: v for (k, v) in data.items() if v is not None}
         url = "/org/{0}/repos".format(organization) if organization else "/user/repos"
         response = self.post(url, auth=auth, data=data)
-        return GiteaRepo.from_json(response.json())
+        repo = self._decode(response, GiteaRepo)
+        self.invalidate_repo(repo.owner.username, repo.name)
+        return repo
+
+    def ensure_repo(self, auth, name, description=None, private=False, auto_init=False,
+                    gitignore_templates=None, license_template=None, readme_template=None,
+                    organization=None):
+        """
+        Creates a new repository unless it already exists, and returns the new or
+        existing repository. Safe to retry after a timed-out attempt. Arguments are as
+        for :meth:`create_repo`; they are not applied to an existing repository.
+
+        :return: a representation of the repository
+        :rtype: GiteaRepo
+        :raises NetworkFailure: if there is an error communicating with the server
+        :raises ApiFailure: if the request cannot be serviced
+        """
+        def fetch():
+            owner = organization or self.authenticated_user(auth).username
+            return self.get_repo(auth, owner, name)
+
+        return self._ensure(lambda: self.create_repo(
+            auth, name, description=description, private=private, auto_init=auto_init,
+            gitignore_templates=gitignore_templates, license_template=license_template,
+            readme_template=readme_template, organization=organization), fetch)
 
     def repo_exists(self, auth, username, repo_name):
         """
@@ -159,7 +265,28 @@ class GiteaApi(object):
         :raises ApiFailure: if the request cannot be serviced
         """
         path = "/repos/{u}/{r}".format(u=username, r=repo_name)
-        return self._get(path, auth=auth).ok
+        if self._cache is not None and self._cache.get((path, auth, "exists")):
+            return True
+        exists = self._exists(path, auth=auth)
+        if exists and self._cache is not None:
+            self._cache.put((path, auth, "exists"), True)
+        return exists
+
+    def repos_exist(self, auth, repos, concurrency=16):
+        """
+        Returns which of the repositories ``repos`` exist, checking up to ``concurrency``
+        repositories at a time.
+
+        :param auth.Authentication auth: authentication object
+        :param repos: iterable of ``(owner username, repository name)`` tuples
+        :param int concurrency: maximum number of concurrent requests
+        :return: whether each repository exists, keyed by ``(owner username, repository name)``
+        :rtype: Dict[Tuple[str, str], bool]
+        :raises NetworkFailure: if there is an error communicating with the server
+        :raises ApiFailure: if the request cannot be serviced
+        """
+        return self._map(lambda repo: self.repo_exists(auth, repo[0], repo[1]),
+                         (tuple(repo) for repo in repos), concurrency)
 
     def get_repo(self, auth, username, repo_name):
         """
@@ -175,8 +302,8 @@ class GiteaApi(object):
         :raises ApiFailure: if the request cannot be serviced
         """
         path = "/repos/{u}/{r}".format(u=username, r=repo_name)
-        response = self.get(path, auth=auth)
-        return GiteaRepo.from_json(response.json())
+        return self._cached(path, auth, "entity",
+                            lambda: self._decode(self.get(path, auth=auth), GiteaRepo))
 
     def get_user_repos(self, auth, username):
         """
@@ -192,7 +319,7 @@ class GiteaApi(object):
         """
         path = "/users/{u}/repos".format(u=username)
         response = self.get(path, auth=auth)
-        return [GiteaRepo.from_json(repo_json) for repo_json in response.json()]
+        return self._decode(response, GiteaRepo, many=True)
 
     def get_branch(self, auth, username, repo_name, branch_name):
         """
@@ -209,8 +336,8 @@ class GiteaApi(object):
         :raises ApiFailure: if the request cannot be serviced
         """
         path = "/repos/{u}/{r}/branches/{b}".format(u=username, r=repo_name, b=branch_name)
-        response = self.get(path, auth=auth)
-        return GiteaBranch.from_json(response.json())
+        return self._cached(path, auth, "entity",
+                            lambda: self._decode(self.get(path, auth=auth), GiteaBranch))
 
     def get_branches(self, auth, username, repo_name):
         """
@@ -226,8 +353,33 @@ class GiteaApi(object):
         :raises ApiFailure: if the request cannot be serviced
         """
         path = "/repos/{u}/{r}/branches".format(u=username, r=repo_name)
-        response = self.get(path, auth=auth)
-        return [GiteaBranch.from_json(branch_json) for branch_json in response.json()]
+        branches = self._cached(path, auth, "entity", lambda: tuple(
+            self._decode(self.get(path, auth=auth), GiteaBranch, many=True)))
+        return list(branches)
+
+    def branch_heads(self, auth, repos, concurrency=16):
+        """
+        Returns the HEAD commit id of every branch of the repositories ``repos``,
+        fetching the branches of up to ``concurrency`` repositories at a time.
+
+        :param auth.Authentication auth: authentication object
+        :param repos: iterable of ``(owner username, repository name)`` tuples
+        :param int concurrency: maximum number of concurrent requests
+        :return: commit ids, keyed by ``(owner username, repository name, branch name)``
+        :rtype: Dict[Tuple[str, str, str], str]
+        :raises NetworkFailure: if there is an error communicating with the server
+        :raises ApiFailure: if the request cannot be serviced
+        """
+        def heads(repo):
+            path = "/repos/{u}/{r}/branches".format(u=repo[0], r=repo[1])
+            return [(branch["name"], branch["commit"]["id"]) for branch in self.get(path, auth=auth).json()]
+
+        result = {}
+        all_heads = self._map(heads, (tuple(repo) for repo in repos), concurrency)
+        for (username, repo_name), branches in all_heads.items():
+            for branch_name, commit_id in branches:
+                result[(username, repo_name, branch_name)] = commit_id
+        return result
 
     def delete_repo(self, auth, username, repo_name):
         """
@@ -241,10 +393,11 @@ class GiteaApi(object):
         """
         path = "/repos/{u}/{r}".format(u=username, r=repo_name)
         self.delete(path, auth=auth)
+        self.invalidate_repo(username, repo_name)
 
     def migrate_repo(self, auth, clone_addr,
                      uid, repo_name, auth_username=None, auth_password=None,
-                     mirror=False, private=False, description=None):
+                     mirror=False, private=False, description=None, timeout=None):
         """
         Migrate a repository from another Git hosting source for the authenticated user.
 
@@ -255,6 +408,8 @@ class GiteaApi(object):
         :param bool mirror: Repository will be a mirror. Default is false
         :param bool private: Repository will be private. Default is false
         :param str description: Repository description
+        :param float timeout: seconds to wait for the server to finish the migration.
+                              Waits indefinitely by default
         :return: a representation of the migrated repository
         :rtype: GiteaRepo
         :raises NetworkFailure: if there is an error communicating with the server
@@ -273,8 +428,10 @@ class GiteaApi(object):
         }
         data = {k: v for (k, v) in data.items() if v is not None}
         url = "/repos/migrate"
-        response = self.post(url, auth=auth, data=data)
-        return GiteaRepo.from_json(response.json())
+        response = self.post(url, auth=auth, data=data, timeout=timeout)
+        repo = self._decode(response, GiteaRepo)
+        self.invalidate_repo(repo.owner.username, repo.name)
+        return repo
 
     def create_user(self, auth, login_name, username, email, password, send_notify=False):
         """
@@ -301,7 +458,27 @@ class GiteaApi(object):
             "send_notify": send_notify
         }
         response = self.post("/admin/users", auth=auth, data=data)
-        return GiteaUser.from_json(response.json())
+        self._discard_cached("/users/{u}".format(u=username), "/users/search")
+        self._forget_missing("/users/{u}".format(u=username))
+        return self._decode(response, GiteaUser)
+
+    def ensure_user(self, auth, login_name, username, email, password, send_notify=False):
+        """
+        Creates a new user unless one with username ``username`` already exists, and
+        returns the new or existing user. Safe to retry after a timed-out attempt.
+        Arguments are as for :meth:`create_user`; they are not applied to an existing user.
+
+        :return: a representation of the user
+        :rtype: GiteaUser
+        :raises NetworkFailure: if there is an error communicating with the server
+        :raises ApiFailure: if the request cannot be serviced
+        """
+        user = self._ensure(
+            lambda: self.create_user(auth, login_name, username, email, password,
+                                     send_notify=send_notify),
+            lambda: self.get_user(auth, username))
+        self._forget_missing("/users/{}".format(username))
+        return user
 
     def user_exists(self, username):
         """
@@ -314,7 +491,20 @@ class GiteaApi(object):
         :return:
         """
         path = "/users/{}".format(username)
-        return self._get(path).ok
+        return self._exists(path)
+
+    def users_exist(self, usernames, concurrency=16):
+        """
+        Returns which of the users with usernames ``usernames`` exist, checking up to
+        ``concurrency`` users at a time.
+
+        :param usernames: iterable of usernames
+        :param int concurrency: maximum number of concurrent requests
+        :return: whether each user exists, keyed by username
+        :rtype: Dict[str, bool]
+        :raises NetworkFailure: if there is an error communicating with the server
+        """
+        return self._map(self.user_exists, usernames, concurrency)
 
     def search_users(self, username_keyword, limit=10):
         """
@@ -330,7 +520,7 @@ class GiteaApi(object):
         """
         params = {"q": username_keyword, "limit": limit}
         response = self.get("/users/search", params=params)
-        return [GiteaUser.from_json(user_json) for user_json in response.json()["data"]]
+        return self._decode(response, GiteaUser, many=True, field="data")
 
     def get_user(self, auth, username):
         """
@@ -345,23 +535,37 @@ class GiteaApi(object):
         """
         path = "/users/{}".format(username)
         response = self.get(path, auth=auth)
-        return GiteaUser.from_json(response.json())
+        return self._decode(response, GiteaUser)
 
-    def update_user(self, auth, username, update):
+    def update_user(self, auth, username, update, only_changes=False, current=None):
         """
         Updates the user with username ``username`` according to ``update``.
 
+        With ``only_changes``, the update is first compared with the user's current
+        state: only fields that differ are sent, and no request is sent at all if
+        nothing would change.
+
         :param auth.Authentication auth: authentication object, must be admin-level
         :param str username: username of user to update
         :param GiteaUserUpdate update: a ``GiteaUserUpdate`` object describing the requested update
+        :param bool only_changes: whether to send only the fields that differ
+        :param GiteaUser current: the user's known current state, used with ``only_changes``
+                                  instead of fetching the user
         :return: the updated user
         :rtype: GiteaUser
         :raises NetworkFailure: if there is an error communicating with the server
         :raises ApiFailure: if the request cannot be serviced
         """
+        if only_changes:
+            if current is None:
+                current = self._fetch_fresh("/users/{}".format(username), auth, GiteaUser)
+            update = update.changes_from(current)
+            if update is None:
+                return current
         path = "/admin/users/{}".format(username)
         response = self.patch(path, auth=auth, data=update.as_dict())
-        return GiteaUser.from_json(response.json())
+        self._discard_cached("/users/{}".format(username), "/users/search")
+        return self._decode(response, GiteaUser)
 
     def delete_user(self, auth, username):
         """
@@ -373,6 +577,7 @@ class GiteaApi(object):
         """
         path = "/admin/users/{}".format(username)
         self.delete(path, auth=auth)
+        self._discard_cached("/users/{}".format(username), "/users/search")
 
     def get_repo_hooks(self, auth, username, repo_name):
         """
@@ -389,7 +594,7 @@ class GiteaApi(object):
         """
         path = "/repos/{u}/{r}/hooks".format(u=username, r=repo_name)
         response = self.get(path, auth=auth)
-        return [GiteaRepo.Hook.from_json(hook) for hook in response.json()]
+        return self._decode(response, GiteaRepo.Hook, many=True)
 
     def create_hook(self, auth, repo_name, hook_type, config, events=None, organization=None, active=False):
         """
@@ -421,28 +626,57 @@ class GiteaApi(object):
         url = "/repos/{o}/{r}/hooks".format(o=organization, r=repo_name) if organization is not None \
             else "/repos/{r}/hooks".format(r=repo_name)
         response = self.post(url, auth=auth, data=data)
-        return GiteaRepo.Hook.from_json(response.json())
+        self._discard_cached(url)
+        return self._decode(response, GiteaRepo.Hook)
 
-    def update_hook(self, auth, repo_name, hook_id, update, organization=None):
+    def get_hook(self, auth, repo_name, hook_id, organization=None):
+        """
+        Returns the hook with id ``hook_id``.
+
+        :param auth.Authentication auth: authentication object
+        :param str repo_name: repo of the hook
+        :param int hook_id: id of the hook
+        :param str organization: name of associated organization, if applicable
+        :return: the hook
+        :rtype: GiteaRepo.Hook
+        :raises NetworkFailure: if there is an error communicating with the server
+        :raises ApiFailure: if the request cannot be serviced
+        """
+        response = self.get(self._hook_path(repo_name, hook_id, organization), auth=auth)
+        return self._decode(response, GiteaRepo.Hook)
+
+    def update_hook(self, auth, repo_name, hook_id, update, organization=None,
+                    only_changes=False, current=None):
         """
         Updates hook with id ``hook_id`` according to ``update``.
 
+        With ``only_changes``, the update is first compared with the hook's current
+        state: only fields that differ are sent, and no request is sent at all if
+        nothing would change.
+
         :param auth.Authentication auth: authentication object
         :param str repo_name: repo of the hook to update
         :param int hook_id: id of the hook to update
         :param GiteaHookUpdate update: a ``GiteaHookUpdate`` object describing the requested update
         :param str organization: name of associated organization, if applicable
+        :param bool only_changes: whether to send only the fields that differ
+        :param GiteaRepo.Hook current: the hook's known current state, used with
+                                       ``only_changes`` instead of fetching the hook
         :return: the updated hook
         :rtype: GiteaRepo.Hook
         :raises NetworkFailure: if there is an error communicating with the server
         :raises ApiFailure: if the request cannot be serviced
         """
-        if organization is not None:
-            path = "/repos/{o}/{r}/hooks/{i}".format(o=organization, r=repo_name, i=hook_id)
-        else:
-            path = "/repos/{r}/hooks/{i}".format(r=repo_name, i=hook_id)
+        path = self._hook_path(repo_name, hook_id, organization)
+        if only_changes:
+            if current is None:
+                current = self._fetch_fresh(path, auth, GiteaRepo.Hook)
+            update = update.changes_from(current)
+            if update is None:
+                return current
         response = self._patch(path, auth=auth, data=update.as_dict())
-        return GiteaRepo.Hook.from_json(response.json())
+        self._discard_cached(path.rsplit("/", 1)[0])
+        return self._decode(response, GiteaRepo.Hook)
 
     def delete_hook(self, auth, username, repo_name, hook_id):
         """
@@ -458,6 +692,7 @@ class GiteaApi(object):
         """
         path = "/repos/{u}/{r}/hooks/{i}".format(u=username, r=repo_name, i=hook_id)
         self.delete(path, auth=auth)
+        self._discard_cached("/repos/{u}/{r}/hooks".format(u=username, r=repo_name))
 
     def create_organization(self, auth, owner_name, org_name, full_name=None, description=None,
                             website=None, location=None):
@@ -486,7 +721,45 @@ class GiteaApi(object):
 
         url = "/admin/users/{u}/orgs".format(u=owner_name)
         response = self.post(url, auth=auth, data=data)
-        return GiteaOrg.from_json(response.json())
+        self._discard_cached("/orgs/{}".format(org_name))
+        self._forget_missing("/orgs/{}".format(org_name), "/users/{}".format(org_name))
+        return self._decode(response, GiteaOrg)
+
+    def get_organization(self, auth, org_name):
+        """
+        Returns the organization with name ``org_name``.
+
+        :param auth.Authentication auth: authentication object, can be ``None``
+        :param str org_name: name of the organization
+        :return: the retrieved organization
+        :rtype: GiteaOrg
+        :raises NetworkFailure: if there is an error communicating with the server
+        :raises ApiFailure: if the request cannot be serviced
+        """
+        path = "/orgs/{}".format(org_name)
+        response = self.get(path, auth=auth)
+        return self._decode(response, GiteaOrg)
+
+    def ensure_org(self, auth, owner_name, org_name, full_name=None, description=None,
+                   website=None, location=None):
+        """
+        Creates a new organization unless it already exists, and returns the new or
+        existing organization. Safe to retry after a timed-out attempt. Arguments are
+        as for :meth:`create_organization`; they are not applied to an existing
+        organization.
+
+        :return: a representation of the organization
+        :rtype: GiteaOrg
+        :raises NetworkFailure: if there is an error communicating with the server
+        :raises ApiFailure: if the request cannot be serviced
+        """
+        org = self._ensure(
+            lambda: self.create_organization(auth, owner_name, org_name, full_name=full_name,
+                                             description=description, website=website,
+                                             location=location),
+            lambda: self.get_organization(auth, org_name))
+        self._forget_missing("/orgs/{}".format(org_name), "/users/{}".format(org_name))
+        return org
 
     def create_organization_team(self, auth, org_name, name, description=None, permission="read"):
         """
@@ -510,7 +783,44 @@ class GiteaApi(object):
 
         url = "/admin/orgs/{o}/teams".format(o=org_name)
         response = self.post(url, auth=auth, data=data)
-        return GiteaTeam.from_json(response.json())
+        self._discard_cached("/orgs/{}/teams".format(org_name))
+        return self._decode(response, GiteaTeam)
+
+    def get_organization_teams(self, auth, org_name):
+        """
+        Returns the teams of the organization with name ``org_name``.
+
+        :param auth.Authentication auth: authentication object
+        :param str org_name: name of the organization
+        :return: the organization's teams
+        :rtype: List[GiteaTeam]
+        :raises NetworkFailure: if there is an error communicating with the server
+        :raises ApiFailure: if the request cannot be serviced
+        """
+        path = "/orgs/{}/teams".format(org_name)
+        response = self.get(path, auth=auth)
+        return self._decode(response, GiteaTeam, many=True)
+
+    def ensure_team(self, auth, org_name, name, description=None, permission="read"):
+        """
+        Creates a new team of the organization unless one named ``name`` already
+        exists, and returns the new or existing team. Safe to retry after a timed-out
+        attempt. Arguments are as for :meth:`create_organization_team`; they are not
+        applied to an existing team.
+
+        :return: a representation of the team
+        :rtype: GiteaTeam
+        :raises NetworkFailure: if there is an error communicating with the server
+        :raises ApiFailure: if the request cannot be serviced
+        """
+        def fetch():
+            teams = [team for team in self.get_organization_teams(auth, org_name) if team.name == name]
+            return teams[0] if teams else None
+
+        return self._ensure(
+            lambda: self.create_organization_team(auth, org_name, name, description=description,
+                                                  permission=permission),
+            fetch)
 
     def add_team_membership(self, auth, team_id, username):
         """
@@ -524,6 +834,7 @@ class GiteaApi(object):
         """
         url = "/admin/teams/{t}/members/{u}".format(t=team_id, u=username)
         self.put(url, auth=auth)
+        self._discard_team(team_id)
 
     def remove_team_membership(self, auth, team_id, username):
         """
@@ -537,6 +848,7 @@ class GiteaApi(object):
         """
         url = "/admin/teams/{t}/members/{u}".format(t=team_id, u=username)
         self.delete(url, auth=auth)
+        self._discard_team(team_id)
 
     def add_repo_to_team(self, auth, team_id, repo_name):
         """
@@ -550,6 +862,7 @@ class GiteaApi(object):
         """
         url = "/admin/teams/{t}/repos/{r}".format(t=team_id, r=repo_name)
         self.put(url, auth=auth)
+        self._discard_team(team_id)
 
     def remove_repo_from_team(self, auth, team_id, repo_name):
         """
@@ -563,6 +876,7 @@ class GiteaApi(object):
         """
         url = "/admin/teams/{t}/repos/{r}".format(t=team_id, r=repo_name)
         self.delete(url, auth=auth)
+        self._discard_team(team_id)
 
     def list_deploy_keys(self, auth, username, repo_name):
         """
@@ -577,7 +891,7 @@ class GiteaApi(object):
         :raises ApiFailure: if the request cannot be serviced
         """
         response = self.get("/repos/{u}/{r}/keys".format(u=username, r=repo_name), auth=auth)
-        return [GiteaRepo.DeployKey.from_json(key_json) for key_json in response.json()]
+        return self._decode(response, GiteaRepo.DeployKey, many=True)
 
     def get_deploy_key(self, auth, username, repo_name, key_id):
         """
@@ -593,7 +907,7 @@ class GiteaApi(object):
         :raises ApiFailure: if the request cannot be serviced
         """
         response = self.get("/repos/{u}/{r}/keys/{k}".format(u=username, r=repo_name, k=key_id), auth=auth)
-        return GiteaRepo.DeployKey.from_json(response.json())
+        return self._decode(response, GiteaRepo.DeployKey)
 
     def add_deploy_key(self, auth, username, repo_name, title, key_content):
         """
@@ -614,7 +928,8 @@ class GiteaApi(object):
             "key": key_content
         }
         response = self.post("/repos/{u}/{r}/keys".format(u=username, r=repo_name), auth=auth, data=data)
-        return GiteaRepo.DeployKey.from_json(response.json())
+        self._discard_cached("/repos/{u}/{r}/keys".format(u=username, r=repo_name))
+        return self._decode(response, GiteaRepo.DeployKey)
 
     def delete_deploy_key(self, auth, username, repo_name, key_id):
         """
@@ -628,16 +943,243 @@ class GiteaApi(object):
         :raises ApiFailure: if the request cannot be serviced
         """
         self.delete("/repos/{u}/{r}/keys/{k}".format(u=username, r=repo_name, k=key_id), auth=auth)
+        self._discard_cached("/repos/{u}/{r}/keys".format(u=username, r=repo_name))
+
+    def invalidate_repo(self, username, repo_name):
+        """
+        Drops every cached result concerning the repository with name ``repo_name``
+        owned by the user with username ``username``, including its branches and
+        any cached knowledge that it does not exist. Names are matched
+        case-insensitively, as on the server.
+
+        :param str username: username of owner of repository
+        :param str repo_name: name of repository
+        """
+        prefix = "/repos/{u}/{r}".format(u=username, r=repo_name)
+        lowered = prefix.lower()
+
+        def concerns_repo(key):
+            path = key[0].lower()
+            return path == lowered or path.startswith(lowered + "/")
+
+        for cache in (self._cache, self._negative_cache):
+            if cache is not None:
+                cache.discard_matching(concerns_repo)
+        self._requestor.discard_cached(prefix)
+
+    def invalidate_all(self):
+        """
+        Drops every cached result, including the responses in a shared ``disk_cache``.
+        """
+        self._clear_memory_caches()
+        self._requestor.clear_cached()
+
+    def invalidate_for_event(self, event):
+        """
+        Drops the cached results made stale by a webhook event. Events concerning a
+        repository (pushes, branches or tags created or deleted, the repository being
+        created or deleted, collaborator changes, ...) invalidate that repository's
+        entries. Events without a repository, such as organization membership
+        changes, invalidate every in-memory entry, and the ``disk_cache`` entries of
+        the organization they name, if any; the rest of a shared ``disk_cache`` is kept.
+
+        Can be registered directly as a handler of a
+        :class:`~gitea_client.webhooks.WebhookReceiver`.
+
+        :param event: an event decoded by :mod:`gitea_client.webhooks`
+        """
+        repo = getattr(event, "repository", None)
+        if repo is not None:
+            self.invalidate_repo(repo.owner.username, repo.name)
+            return
+        self._clear_memory_caches()
+        org = event.json.get("organization") or {}
+        org_name = org.get("username") or org.get("login")
+        if org_name:
+            self._discard_cached("/orgs/{}".format(org_name), "/users/{}".format(org_name))
+
+    def hedge_stats(self):
+        """
+        Returns statistics about hedged GET requests, or ``None`` if hedging is disabled
+
+        :rtype: hedging.HedgeStats
+        """
+        if self._hedger is None:
+            return None
+        return self._hedger.stats()
 
     # Helper methods
 
-    def _delete(self, path, auth=None, **kwargs):
+    def _clear_memory_caches(self):
+        for cache in (self._cache, self._negative_cache):
+            if cache is not None:
+                cache.clear()
+
+    def _cached(self, path, auth, kind, load):
+        """
+        Returns the cached result of ``load`` for ``path``, ``auth`` and ``kind``,
+        calling ``load`` (and caching its result, unless ``None``) on a miss
+        """
+        if self._cache is None:
+            return load()
+        key = (path, auth, kind)
+        value = self._cache.get(key)
+        if value is None:
+            value = load()
+            if value is not None:
+                self._cache.put(key, value)
+        return value
+
+    @staticmethod
+    def _ensure(create, fetch):
+        """
+        Returns ``create()``, or ``fetch()`` if the server rejects the creation with a
+        409 or 422 response and ``fetch`` finds the entity. Otherwise re-raises the
+        creation's failure
+        """
+        try:
+            return create()
+        except ApiFailure as exc:
+            if exc.status_code not in (409, 422):
+                raise
+            failure = exc
+        try:
+            existing = fetch()
+        except ApiFailure as exc:
+            if exc.status_code != 404:
+                raise
+            existing = None
+        if existing is None:
+            # e.g. a 422 for invalid input, rather than for an existing entity
+            raise failure
+        return existing
+
+    def _exists(self, path, auth=None):
+        """
+        Returns whether the resource at ``path`` exists, without downloading it
+        """
+        cache_key = (path, auth)
+        if self._negative_cache is not None and self._negative_cache.get(cache_key):
+            return False
+        response = None
+        if self._head_supported:
+            response = self._head(path, auth=auth)
+            if response.status_code in (405, 501):
+                self._head_supported = False
+                response = None
+        if response is None:
+            response = self._get(path, auth=auth, stream=True)
+            response.close()
+        if response.status_code == 404 and self._negative_cache is not None:
+            self._negative_cache.put(cache_key, True)
+        return response.ok
+
+    def _forget_missing(self, *paths):
+        """
+        Drops the cached knowledge that the resources at ``paths`` do not exist, after
+        they were created
+        """
+        if self._negative_cache is None:
+            return
+        paths = set(path.lower() for path in paths)
+        self._negative_cache.discard_matching(lambda key: key[0].lower() in paths)
+
+    def _discard_cached(self, *prefixes):
+        """
+        Drops the disk cache entries for ``prefixes`` and every path below them, after
+        a mutation made them stale
+        """
+        for prefix in prefixes:
+            self._requestor.discard_cached(prefix)
+
+    def _discard_team(self, team_id):
+        # the team's members and repositories show up in user and repository listings
+        # that cannot be enumerated here
+        self._discard_cached("/admin/teams/{}".format(team_id), "/user", "/users", "/orgs")
+
+    def _fetch_fresh(self, path, auth, entity_class):
+        """
+        Fetches an entity from the server, bypassing the disk cache, e.g. to compare an
+        update with it
+        """
+        return self._decode(self.get(path, auth=auth, headers=NO_CACHE), entity_class)
+
+    @staticmethod
+    def _hook_path(repo_name, hook_id, organization):
+        if organization is not None:
+            return "/repos/{o}/{r}/hooks/{i}".format(o=organization, r=repo_name, i=hook_id)
+        return "/repos/{r}/hooks/{i}".format(r=repo_name, i=hook_id)
+
+    @staticmethod
+    def _map(func, items, concurrency):
+        """
+        Returns a dict mapping each item of ``items`` to ``func(item)``, computed
+        concurrently. Raises the first exception raised by ``func``
+        """
+        results = {}
+        for item, result, exc in bounded_map(func, items, concurrency):
+            if exc is not None:
+                raise exc
+            results[item] = result
+        return results
+
+    def _request(self, method, send, path, auth, kwargs):
+        """
+        Sends a ``method`` request with ``send``, one of the requestor's methods.
+        ``kwargs`` is private to this call, so authentication can be added to it in place
+        """
         if auth is not None:
             auth.update_kwargs(kwargs)
+        if self._tracer is None:
+            return self._send(method, send, path, kwargs)
+        attributes = {"http.method": method, "http.route": endpoint_template(path)}
+        with self._tracer.start_span("HTTP " + method, attributes) as span:
+            kwargs["headers"] = dict(kwargs.get("headers") or {})
+            self._tracer.inject(kwargs["headers"])
+            response = self._send(method, send, path, kwargs)
+            span.set_attribute("http.status_code", response.status_code)
+            return response
+
+    def _send(self, method, send, path, kwargs):
+        if self._metrics is None:
+            try:
+                return send(path, **kwargs)
+            except requests.RequestException as exc:
+                raise NetworkFailure(exc)
+        context = self._metrics.before_request(method, path)
         try:
-            return self._requestor.delete(path, **kwargs)
+            response = send(path, **kwargs)
         except requests.RequestException as exc:
+            self._metrics.after_request(context, None)
             raise NetworkFailure(exc)
+        self._metrics.after_request(context, response)
+        return response
+
+    def _decode(self, response, entity_class, many=False, field=None):
+        """
+        Converts the JSON body of ``response`` into an ``entity_class``, or a list of them
+        if ``many``. If ``field`` is given, the entities are found under that key.
+        """
+        if self._tracer is None:
+            return self._convert(response, entity_class, many, field)
+        with self._tracer.start_span("decode " + entity_class.__qualname__):
+            return self._convert(response, entity_class, many, field)
+
+    def _convert(self, response, entity_class, many, field):
+        start = time.perf_counter() if self._metrics is not None else None
+        parsed = response.json()
+        if field is not None:
+            parsed = parsed[field]
+        if many:
+            result = [entity_class.from_json(item) for item in parsed]
+        else:
+            result = entity_class.from_json(parsed)
+        if start is not None:
+            self._metrics.record_decode(entity_class.__qualname__, time.perf_counter() - start)
+        return result
+
+    def _delete(self, path, auth=None, **kwargs):
+        return self._request("DELETE", self._requestor.delete, path, auth, kwargs)
 
     def delete(self, path, auth=None, **kwargs):
         """
@@ -653,12 +1195,12 @@ class GiteaApi(object):
         return self._check_ok(self._delete(path, auth=auth, **kwargs))
 
     def _get(self, path, auth=None, **kwargs):
-        if auth is not None:
-            auth.update_kwargs(kwargs)
-        try:
-            return self._requestor.get(path, **kwargs)
-        except requests.RequestException as exc:
-            raise NetworkFailure(exc)
+        if self._hedger is not None and not kwargs.get("stream"):
+            return self._request("GET", self._hedged_get, path, auth, kwargs)
+        return self._request("GET", self._requestor.get, path, auth, kwargs)
+
+    def _hedged_get(self, path, **kwargs):
+        return self._hedger.call(lambda: self._requestor.get(path, **kwargs))
 
     def get(self, path, auth=None, **kwargs):
         """
@@ -673,13 +1215,11 @@ class GiteaApi(object):
         """
         return self._check_ok(self._get(path, auth=auth, **kwargs))
 
+    def _head(self, path, auth=None, **kwargs):
+        return self._request("HEAD", self._requestor.head, path, auth, kwargs)
+
     def _patch(self, path, auth=None, **kwargs):
-        if auth is not None:
-            auth.update_kwargs(kwargs)
-        try:
-            return self._requestor.patch(path, **kwargs)
-        except requests.RequestException as exc:
-            raise NetworkFailure(exc)
+        return self._request("PATCH", self._requestor.patch, path, auth, kwargs)
 
     def patch(self, path, auth=None, **kwargs):
         """
@@ -695,12 +1235,7 @@ class GiteaApi(object):
         return self._check_ok(self._patch(path, auth=auth, **kwargs))
 
     def _post(self, path, auth=None, **kwargs):
-        if auth is not None:
-            auth.update_kwargs(kwargs)
-        try:
-            return self._requestor.post(path, **kwargs)
-        except requests.RequestException as exc:
-            raise NetworkFailure(exc)
+        return self._request("POST", self._requestor.post, path, auth, kwargs)
 
     def post(self, path, auth=None, **kwargs):
         """
@@ -716,12 +1251,7 @@ class GiteaApi(object):
         return self._check_ok(self._post(path, auth=auth, **kwargs))
 
     def _put(self, path, auth=None, **kwargs):
-        if auth is not None:
-            auth.update_kwargs(kwargs)
-        try:
-            return self._requestor.put(path, **kwargs)
-        except requests.RequestException as exc:
-            raise NetworkFailure(exc)
+        return self._request("PUT", self._requestor.put, path, auth, kwargs)
 
     def put(self, path, auth=None, **kwargs):
         """
@@ -758,6 +1288,28 @@ class GiteaApi(object):
         raise ApiFailure(message, response.status_code)
 
 
+# public methods without I/O of their own; the request methods get HTTP spans instead
+_UNTRACED = frozenset(["hedge_stats", "invalidate_repo", "invalidate_all", "invalidate_for_event",
+                       "delete", "get", "head", "patch", "post", "put"])
+
+
+def _traced(name, method):
+    span_name = "GiteaApi." + name
+
+    @functools.wraps(method)
+    def traced(self, *args, **kwargs):
+        if self._tracer is None:
+            return method(self, *args, **kwargs)
+        with self._tracer.start_span(span_name):
+            return method(self, *args, **kwargs)
+    return traced
+
+
+for _name, _method in list(vars(GiteaApi).items()):
+    if not _name.startswith("_") and _name not in _UNTRACED and inspect.isfunction(_method):
+        setattr(GiteaApi, _name, _traced(_name, _method))
+
+
 class ApiFailure(Exception):
     """
     Raised to signal a failed request
@@ -809,3 +1361,41 @@ class NetworkFailure(Exception):
         :type: Exception
         """
         return self._cause
+
+
+@attr.s(frozen=True)
+class WarmUpReport(object):
+    """
+    An immutable summary of a :meth:`GiteaApi.warm_up` call
+    """
+
+    #: Round-trip times (in seconds) of the successful requests, in ascending order.
+    #: These include connection setup.
+    #:
+    #: :type: List[float]
+    rtts = attr.ib()
+
+    #: Failures of the unsuccessful requests
+    #:
+    #: :type: List[NetworkFailure]
+    errors = attr.ib()
+
+    @property
+    def reachable(self):
+        """
+        Whether the server answered at least one request
+
+        :type: bool
+        """
+        return len(self.rtts) > 0
+
+    @property
+    def rtt(self):
+        """
+        Median round-trip time in seconds, or ``None`` if the server was not reached
+
+        :type: float
+        """
+        if not self.rtts:
+            return None
+        return self.rtts[len(self.rtts) // 2]
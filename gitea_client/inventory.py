@@ -0,0 +1,645 @@
+"""
+Local SQLite snapshots of the users, organizations, repositories, branches and
+hooks on a Gitea server
+"""
+import json
+import sqlite3
+import threading
+import time
+
+import attr
+
+from gitea_client._implementation.concurrency import bounded_map
+from gitea_client._implementation.http_utils import NO_CACHE
+from gitea_client.entities import GiteaUser, GiteaOrg, GiteaRepo, GiteaBranch, strip_json
+
+# maximum number of entries per listing page; Gitea caps this at its MAX_RESPONSE_ITEMS setting
+_PAGE_SIZE = 50
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    id INTEGER PRIMARY KEY,
+    username TEXT NOT NULL,
+    json TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS users_username ON users (username);
+
+CREATE TABLE IF NOT EXISTS orgs (
+    id INTEGER PRIMARY KEY,
+    username TEXT NOT NULL,
+    json TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS orgs_username ON orgs (username);
+
+CREATE TABLE IF NOT EXISTS repos (
+    id INTEGER PRIMARY KEY,
+    owner TEXT NOT NULL,
+    name TEXT NOT NULL,
+    private INTEGER NOT NULL,
+    json TEXT NOT NULL,
+    last_seen REAL NOT NULL
+);
+CREATE UNIQUE INDEX IF NOT EXISTS repos_owner_name ON repos (owner, name);
+CREATE INDEX IF NOT EXISTS repos_name ON repos (name);
+
+CREATE TABLE IF NOT EXISTS branches (
+    owner TEXT NOT NULL,
+    repo TEXT NOT NULL,
+    name TEXT NOT NULL,
+    commit_id TEXT NOT NULL,
+    json TEXT NOT NULL,
+    last_seen REAL NOT NULL,
+    PRIMARY KEY (owner, repo, name)
+);
+
+CREATE TABLE IF NOT EXISTS hooks (
+    id INTEGER PRIMARY KEY,
+    owner TEXT NOT NULL,
+    repo TEXT NOT NULL,
+    active INTEGER NOT NULL,
+    json TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS hooks_owner_repo ON hooks (owner, repo);
+
+CREATE TABLE IF NOT EXISTS hook_events (
+    hook_id INTEGER NOT NULL,
+    event TEXT NOT NULL,
+    PRIMARY KEY (event, hook_id)
+);
+
+CREATE TABLE IF NOT EXISTS etags (
+    path TEXT PRIMARY KEY,  -- path of a listing page, as returned by _page_path
+    etag TEXT NOT NULL
+);
+"""
+
+
+class InventorySnapshot(object):
+    """
+    A local, indexed copy of (part of) a Gitea server's users, organizations,
+    repositories, branches and hooks, stored in an SQLite database.
+
+    Query methods return the same entity classes as :class:`~gitea_client.GiteaApi`.
+    """
+
+    def __init__(self, path):
+        """
+        :param str path: location of the SQLite database, or ``":memory:"``
+        """
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock, self._conn:
+            self._conn.executescript(_SCHEMA)
+
+    def close(self):
+        self._conn.close()
+
+    def replace(self, users=(), orgs=(), repos=(), branches=(), hooks=()):
+        """
+        Atomically replaces the snapshot's contents.
+
+        :param List[GiteaUser] users: users
+        :param List[GiteaOrg] orgs: organizations
+        :param List[GiteaRepo] repos: repositories
+        :param branches: iterable of ``(owner, repository name, GiteaBranch)`` tuples
+        :param hooks: iterable of ``(owner, repository name, GiteaRepo.Hook)`` tuples
+        """
+        now = time.time()
+        with self._lock, self._conn:
+            for table in ("users", "orgs", "repos", "branches", "hooks", "hook_events", "etags"):
+                self._conn.execute("DELETE FROM {}".format(table))
+            self._conn.executemany(
+                "INSERT INTO users (id, username, json) VALUES (?, ?, ?)",
+                ((u.id, u.username, _dumps(u)) for u in users))
+            self._conn.executemany(
+                "INSERT INTO orgs (id, username, json) VALUES (?, ?, ?)",
+                ((o.id, o.username, _dumps(o)) for o in orgs))
+            self._conn.executemany(
+                "INSERT INTO repos (id, owner, name, private, json, last_seen) VALUES (?, ?, ?, ?, ?, ?)",
+                ((r.id, r.owner.username, r.name, r.private, _dumps(r), now) for r in repos))
+            self._conn.executemany(
+                "INSERT INTO branches (owner, repo, name, commit_id, json, last_seen)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                ((o, r, b.name, b.commit.id, _dumps(b), now) for (o, r, b) in branches))
+            for owner, repo_name, hook in hooks:
+                self._conn.execute(
+                    "INSERT INTO hooks (id, owner, repo, active, json) VALUES (?, ?, ?, ?, ?)",
+                    (hook.id, owner, repo_name, hook.active, _dumps(hook)))
+                self._conn.executemany(
+                    "INSERT OR IGNORE INTO hook_events (hook_id, event) VALUES (?, ?)",
+                    ((hook.id, event) for event in hook.events))
+
+    def users(self):
+        """
+        :return: every user in the snapshot
+        :rtype: List[GiteaUser]
+        """
+        return self._select(GiteaUser, "SELECT json FROM users ORDER BY username")
+
+    def user(self, username):
+        """
+        :param str username: username of the user
+        :return: the user with username ``username``, or ``None`` if not in the snapshot
+        :rtype: GiteaUser
+        """
+        return _first(self._select(GiteaUser, "SELECT json FROM users WHERE username = ?", username))
+
+    def orgs(self):
+        """
+        :return: every organization in the snapshot
+        :rtype: List[GiteaOrg]
+        """
+        return self._select(GiteaOrg, "SELECT json FROM orgs ORDER BY username")
+
+    def org(self, org_name):
+        """
+        :param str org_name: name of the organization
+        :return: the organization named ``org_name``, or ``None`` if not in the snapshot
+        :rtype: GiteaOrg
+        """
+        return _first(self._select(GiteaOrg, "SELECT json FROM orgs WHERE username = ?", org_name))
+
+    def repos(self, owner=None, private=None):
+        """
+        :param str owner: if given, only return repositories owned by this user or organization
+        :param bool private: if given, only return repositories with this visibility
+        :return: matching repositories
+        :rtype: List[GiteaRepo]
+        """
+        where, params = _where(owner=owner, private=private)
+        return self._select(GiteaRepo, "SELECT json FROM repos" + where + " ORDER BY owner, name",
+                            *params)
+
+    def repo(self, owner, repo_name):
+        """
+        :param str owner: username of the owner of the repository
+        :param str repo_name: name of the repository
+        :return: the repository, or ``None`` if not in the snapshot
+        :rtype: GiteaRepo
+        """
+        return _first(self._select(GiteaRepo, "SELECT json FROM repos WHERE owner = ? AND name = ?",
+                                   owner, repo_name))
+
+    def repo_by_id(self, repo_id):
+        """
+        :param int repo_id: id of the repository
+        :return: the repository, or ``None`` if not in the snapshot
+        :rtype: GiteaRepo
+        """
+        return _first(self._select(GiteaRepo, "SELECT json FROM repos WHERE id = ?", repo_id))
+
+    def repos_without_hook(self, event, owner=None, private=None, include_inactive=False):
+        """
+        Returns the repositories that have no hook firing on ``event``.
+
+        :param str event: hook event, e.g. ``"push"``
+        :param str owner: if given, only consider repositories owned by this user or organization
+        :param bool private: if given, only consider repositories with this visibility
+        :param bool include_inactive: whether inactive hooks count
+        :return: matching repositories
+        :rtype: List[GiteaRepo]
+        """
+        where, params = _where(owner=owner, private=private)
+        where += " AND " if where else " WHERE "
+        where += ("NOT EXISTS (SELECT 1 FROM hooks JOIN hook_events ON hook_events.hook_id = hooks.id"
+                  " WHERE hooks.owner = repos.owner AND hooks.repo = repos.name"
+                  " AND hook_events.event = ?" + ("" if include_inactive else " AND hooks.active") + ")")
+        return self._select(GiteaRepo, "SELECT json FROM repos" + where + " ORDER BY owner, name",
+                            *(params + [event]))
+
+    def branches(self, owner, repo_name):
+        """
+        :param str owner: username of the owner of the repository
+        :param str repo_name: name of the repository
+        :return: branches of the repository
+        :rtype: List[GiteaBranch]
+        """
+        return self._select(GiteaBranch,
+                            "SELECT json FROM branches WHERE owner = ? AND repo = ? ORDER BY name",
+                            owner, repo_name)
+
+    def hooks(self, owner, repo_name):
+        """
+        :param str owner: username of the owner of the repository
+        :param str repo_name: name of the repository
+        :return: hooks of the repository
+        :rtype: List[GiteaRepo.Hook]
+        """
+        return self._select(GiteaRepo.Hook,
+                            "SELECT json FROM hooks WHERE owner = ? AND repo = ? ORDER BY id",
+                            owner, repo_name)
+
+    def last_seen(self, owner, repo_name, branch_name=None):
+        """
+        Returns when a repository, or one of its branches, was last confirmed to
+        exist by a crawl or refresh.
+
+        :param str owner: username of the owner of the repository
+        :param str repo_name: name of the repository
+        :param str branch_name: name of the branch, if asking about a branch
+        :return: seconds since the epoch, or ``None`` if not in the snapshot
+        :rtype: float
+        """
+        if branch_name is None:
+            query, params = "SELECT last_seen FROM repos WHERE owner = ? AND name = ?", (owner, repo_name)
+        else:
+            query = "SELECT last_seen FROM branches WHERE owner = ? AND repo = ? AND name = ?"
+            params = (owner, repo_name, branch_name)
+        with self._lock:
+            row = self._conn.execute(query, params).fetchone()
+        return row[0] if row else None
+
+    def _owners(self):
+        with self._lock:
+            rows = self._conn.execute("SELECT username FROM users UNION SELECT username FROM orgs"
+                                      " UNION SELECT owner FROM repos").fetchall()
+        return sorted(row[0] for row in rows)
+
+    def _etags(self, path):
+        prefix = _page_path(path, "")
+        with self._lock:
+            rows = self._conn.execute("SELECT path, etag FROM etags WHERE substr(path, 1, ?) = ?",
+                                      (len(prefix), prefix)).fetchall()
+        return {int(page_path[len(prefix):]): etag for (page_path, etag) in rows}
+
+    def _discard_etags(self, path):
+        prefix = _page_path(path, "")
+        self._conn.execute("DELETE FROM etags WHERE substr(path, 1, ?) = ?", (len(prefix), prefix))
+
+    def _repo_json(self, owner):
+        with self._lock:
+            rows = self._conn.execute("SELECT name, json FROM repos WHERE owner = ?", (owner,)).fetchall()
+        return {name: json.loads(data) for (name, data) in rows}
+
+    def _branch_json(self, owner, repo_name):
+        with self._lock:
+            rows = self._conn.execute("SELECT name, json FROM branches WHERE owner = ? AND repo = ?",
+                                      (owner, repo_name)).fetchall()
+        return {name: json.loads(data) for (name, data) in rows}
+
+    def _apply(self, refresh):
+        now = time.time()
+        with self._lock, self._conn:
+            execute = self._conn.execute
+            for path, etags in refresh.etags.items():
+                self._discard_etags(path)
+                self._conn.executemany(
+                    "INSERT INTO etags (path, etag) VALUES (?, ?)",
+                    ((_page_path(path, page), etag) for (page, etag) in etags.items()))
+            for owner in refresh.seen_owners:
+                execute("UPDATE repos SET last_seen = ? WHERE owner = ?", (now, owner))
+                execute("UPDATE branches SET last_seen = ? WHERE owner = ?", (now, owner))
+            for owner, repo_name in refresh.seen_repos:
+                execute("UPDATE branches SET last_seen = ? WHERE owner = ? AND repo = ?",
+                        (now, owner, repo_name))
+            for change in refresh.removed:
+                if change.kind == "repo":
+                    owner, repo_name = change.key
+                    execute("DELETE FROM repos WHERE owner = ? AND name = ?", change.key)
+                    execute("DELETE FROM branches WHERE owner = ? AND repo = ?", change.key)
+                    execute("DELETE FROM hook_events WHERE hook_id IN"
+                            " (SELECT id FROM hooks WHERE owner = ? AND repo = ?)", change.key)
+                    execute("DELETE FROM hooks WHERE owner = ? AND repo = ?", change.key)
+                    self._discard_etags("/repos/{}/{}/branches".format(owner, repo_name))
+                else:
+                    execute("DELETE FROM branches WHERE owner = ? AND repo = ? AND name = ?", change.key)
+            for change in refresh.added + refresh.modified:
+                entity = change.entity
+                if change.kind == "repo":
+                    execute("DELETE FROM repos WHERE id = ? OR (owner = ? AND name = ?)",
+                            (entity.id,) + change.key)
+                    execute("INSERT INTO repos (id, owner, name, private, json, last_seen)"
+                            " VALUES (?, ?, ?, ?, ?, ?)",
+                            (entity.id, entity.owner.username, entity.name, entity.private,
+                             _dumps(entity), now))
+                else:
+                    execute("INSERT OR REPLACE INTO branches (owner, repo, name, commit_id, json, last_seen)"
+                            " VALUES (?, ?, ?, ?, ?, ?)",
+                            change.key + (entity.commit.id, _dumps(entity), now))
+
+    def _select(self, entity_class, query, *params):
+        with self._lock:
+            rows = self._conn.execute(query, params).fetchall()
+        return [entity_class.from_json(json.loads(row[0])) for row in rows]
+
+
+class InventoryCrawler(object):
+    """
+    Walks users, organizations and their repositories, branches and hooks
+    concurrently, and stores them in an :class:`~InventorySnapshot`.
+    """
+
+    def __init__(self, api, auth, concurrency=16):
+        """
+        :param GiteaApi api: client to crawl with
+        :param auth.Authentication auth: authentication object. Private repositories
+                                         and hooks are only crawled if visible to it
+        :param int concurrency: maximum number of concurrent requests
+        """
+        self._api = api
+        self._auth = auth
+        self._concurrency = concurrency
+
+    def crawl(self, snapshot, usernames=(), org_names=()):
+        """
+        Crawls the given users and organizations, and replaces the contents of
+        ``snapshot`` with the results. Only the named users and organizations are
+        crawled; other users and organizations on the server are not discovered.
+
+        Every page of the repository, branch and hook listings is read. Entities that
+        could not be fetched (e.g. hooks of repositories the authenticated user does not
+        administer) are left out of the snapshot.
+
+        :param InventorySnapshot snapshot: snapshot to write to
+        :param List[str] usernames: usernames of users to crawl
+        :param List[str] org_names: names of organizations to crawl
+        :return: failed fetches, keyed by ``(kind, name)`` where ``kind`` is one of
+                 ``"user"``, ``"org"``, ``"repos"``, ``"branches"`` or ``"hooks"``
+        :rtype: Dict[Tuple[str, str], Exception]
+        """
+        errors = {}
+        etags = {}
+        api, auth = self._api, self._auth
+
+        def fetch_listing(path, entity_class):
+            listing, etags[path] = self._get_listing(path)
+            return [entity_class.from_json(entity_json) for entity_json in listing]
+
+        def fetch(task):
+            kind, name = task
+            if kind == "user":
+                return api.get_user(auth, name)
+            elif kind == "org":
+                return api.get_organization(auth, name)
+            elif kind == "repos":
+                return fetch_listing("/users/{}/repos".format(name), GiteaRepo)
+            owner, repo_name = name.split("/", 1)
+            if kind == "branches":
+                return fetch_listing("/repos/{}/{}/branches".format(owner, repo_name), GiteaBranch)
+            listing, _ = self._get_listing("/repos/{}/{}/hooks".format(owner, repo_name))
+            return [GiteaRepo.Hook.from_json(hook_json) for hook_json in listing]
+
+        def run(tasks):
+            results = {}
+            for task, result, exc in bounded_map(fetch, tasks, self._concurrency):
+                if exc is None:
+                    results[task] = result
+                else:
+                    errors[task] = exc
+            return results
+
+        owners = [("user", u) for u in usernames] + [("org", o) for o in org_names]
+        results = run(owners + [("repos", name) for _, name in owners])
+        users = [results[t] for t in owners if t[0] == "user" and t in results]
+        orgs = [results[t] for t in owners if t[0] == "org" and t in results]
+        repos = {}
+        for _, name in owners:
+            for repo in results.get(("repos", name), []):
+                repos[repo.id] = repo
+
+        full_names = ["{}/{}".format(r.owner.username, r.name) for r in repos.values()]
+        results = run([(kind, n) for n in full_names for kind in ("branches", "hooks")])
+        branches = []
+        hooks = []
+        for (kind, full_name), entities in results.items():
+            owner, repo_name = full_name.split("/", 1)
+            target = branches if kind == "branches" else hooks
+            target.extend((owner, repo_name, entity) for entity in entities)
+
+        snapshot.replace(users, orgs, list(repos.values()), branches, hooks)
+        # let the first refresh request these listings conditionally as well
+        refresh = _Refresh()
+        refresh.etags = etags
+        snapshot._apply(refresh)
+        return errors
+
+    def refresh(self, snapshot, owners=None):
+        """
+        Incrementally brings the repositories and branches in ``snapshot`` up to date,
+        and returns what changed.
+
+        Repository listings are requested conditionally, page by page, using ETags from
+        the previous crawl or refresh, and an owner's repositories are only examined
+        further if the listing changed. Branches are only re-fetched for repositories that
+        are new or whose listing entry changed, and are compared by HEAD commit id. Every
+        repository and branch confirmed to exist gets its last-seen time updated.
+
+        Users, organizations and hooks are not refreshed; use :meth:`crawl` for that.
+
+        :param InventorySnapshot snapshot: snapshot to update
+        :param List[str] owners: users and organizations whose repositories to refresh.
+                                 Defaults to every owner in the snapshot
+        :return: the changes applied to the snapshot
+        :rtype: ChangeSet
+        """
+        if owners is None:
+            owners = snapshot._owners()
+        refresh = _Refresh()
+
+        def refresh_owner(owner):
+            path = "/users/{}/repos".format(owner)
+            listing, etags = self._get_listing(path, snapshot._etags(path))
+            return path, listing, etags
+
+        changed_repos = []
+        for owner, result, exc in bounded_map(refresh_owner, owners, self._concurrency):
+            if exc is not None:
+                refresh.errors[("repos", owner)] = exc
+                continue
+            path, listing, refresh.etags[path] = result
+            if listing is None:
+                refresh.seen_owners.append(owner)
+                continue
+            old = snapshot._repo_json(owner)
+            new = {}
+            for repo_json in listing:
+                repo = GiteaRepo.from_json(repo_json)
+                new[repo.name] = repo
+                key = (owner, repo.name)
+                if repo.name not in old:
+                    refresh.added.append(Change("repo", key, repo))
+                elif old[repo.name] != strip_json(repo.json):
+                    refresh.modified.append(Change("repo", key, repo))
+                else:
+                    refresh.seen_repos.append(key)
+                    continue
+                changed_repos.append(key)
+            for name, repo_json in old.items():
+                if name not in new:
+                    refresh.removed.append(Change("repo", (owner, name), GiteaRepo.from_json(repo_json)))
+            refresh.seen_owners.append(owner)
+
+        def refresh_branches(key):
+            path = "/repos/{}/{}/branches".format(*key)
+            listing, etags = self._get_listing(path, snapshot._etags(path))
+            return path, listing, etags
+
+        failed = set()
+        for key, result, exc in bounded_map(refresh_branches, changed_repos, self._concurrency):
+            if exc is not None:
+                refresh.errors[("branches", "{}/{}".format(*key))] = exc
+                failed.add(key)
+                continue
+            path, listing, refresh.etags[path] = result
+            if listing is None:
+                continue
+            old = snapshot._branch_json(*key)
+            new = set()
+            for branch_json in listing:
+                branch = GiteaBranch.from_json(branch_json)
+                new.add(branch.name)
+                branch_key = key + (branch.name,)
+                if branch.name not in old:
+                    refresh.added.append(Change("branch", branch_key, branch))
+                elif old[branch.name]["commit"]["id"] != branch.commit.id:
+                    refresh.modified.append(Change("branch", branch_key, branch))
+            for name, branch_json in old.items():
+                if name not in new:
+                    refresh.removed.append(Change("branch", key + (name,),
+                                                  GiteaBranch.from_json(branch_json)))
+
+        if failed:
+            # keep the old state of these repositories and their owners' listings, so
+            # that the next refresh sees them as changed and fetches their branches again
+            for owner in set(owner for (owner, _) in failed):
+                refresh.etags.pop("/users/{}/repos".format(owner), None)
+            refresh.added = [c for c in refresh.added if not (c.kind == "repo" and c.key in failed)]
+            refresh.modified = [c for c in refresh.modified
+                                if not (c.kind == "repo" and c.key in failed)]
+
+        snapshot._apply(refresh)
+        return ChangeSet(refresh.added, refresh.removed, refresh.modified, refresh.errors)
+
+    def _get_listing(self, path, etags=None):
+        """
+        Fetches every page of the JSON listing at ``path``, bypassing any response
+        caches. Pages are requested until an empty one is returned.
+
+        If ``etags`` holds the ETags of the pages from an earlier fetch, the pages are
+        requested conditionally, and ``None`` is returned if none of them changed.
+
+        :param Dict[int, str] etags: ETags of previously fetched pages, by page number
+        :return: the listing or ``None``, and the ETags of its pages
+        :rtype: Tuple[list, Dict[int, str]]
+        """
+        listing = []
+        new_etags = {}
+        previous = None
+        page = 1
+        while True:
+            etag = etags.get(page) if etags else None
+            headers = dict(NO_CACHE)
+            if etag is not None:
+                headers["If-None-Match"] = etag
+            response = self._api.get(path, auth=self._auth, headers=headers,
+                                     params={"page": page, "limit": _PAGE_SIZE})
+            if response.status_code == 304:
+                new_etags[page] = etag
+                if page + 1 not in (etags or {}):
+                    # an unchanged page is still the last one
+                    listing = None
+                    break
+            elif etags and page > 1:
+                # the earlier pages did not change, but their contents are needed now
+                return self._get_listing(path)
+            else:
+                etags = None
+                entries = response.json()
+                new_etags[page] = response.headers.get("ETag")
+                # servers that do not paginate this listing return all of it for every page
+                if not entries or entries == previous:
+                    break
+                listing.extend(entries)
+                previous = entries
+            page += 1
+        if None in new_etags.values():
+            new_etags = {}
+        return listing, new_etags
+
+
+@attr.s(frozen=True)
+class Change(object):
+    """
+    An immutable representation of a single change found by :meth:`InventoryCrawler.refresh`
+    """
+
+    #: Kind of entity that changed, either ``"repo"`` or ``"branch"``
+    #:
+    #: :type: str
+    kind = attr.ib()
+
+    #: ``(owner, repository name)`` for repositories, ``(owner, repository name, branch name)``
+    #: for branches
+    #:
+    #: :type: tuple
+    key = attr.ib()
+
+    #: The entity after the change, or before it for removals
+    #:
+    #: :type: GiteaRepo or GiteaBranch
+    entity = attr.ib()
+
+
+@attr.s(frozen=True)
+class ChangeSet(object):
+    """
+    An immutable summary of the changes found by :meth:`InventoryCrawler.refresh`
+    """
+
+    #: Repositories and branches that were added
+    #:
+    #: :type: List[Change]
+    added = attr.ib()
+
+    #: Repositories and branches that were removed. Branches of removed repositories
+    #: are not listed separately
+    #:
+    #: :type: List[Change]
+    removed = attr.ib()
+
+    #: Repositories whose listing entry changed, and branches whose HEAD commit moved
+    #:
+    #: :type: List[Change]
+    modified = attr.ib()
+
+    #: Failed fetches, keyed by ``(kind, name)`` as for :meth:`InventoryCrawler.crawl`
+    #:
+    #: :type: Dict[Tuple[str, str], Exception]
+    errors = attr.ib()
+
+
+class _Refresh(object):
+    """
+    Changes accumulated during a refresh, before being applied to a snapshot
+    """
+
+    def __init__(self):
+        self.added = []
+        self.removed = []
+        self.modified = []
+        self.errors = {}
+        self.etags = {}
+        self.seen_owners = []
+        self.seen_repos = []
+
+
+def _page_path(path, page):
+    return "{}?page={}".format(path, page)
+
+
+def _dumps(entity):
+    return json.dumps(strip_json(entity.json))
+
+
+def _where(**conditions):
+    clauses = []
+    params = []
+    for column, value in sorted(conditions.items()):
+        if value is not None:
+            clauses.append("{} = ?".format(column))
+            params.append(value)
+    return (" WHERE " + " AND ".join(clauses)) if clauses else "", params
+
+
+def _first(entities):
+    return entities[0] if entities else None
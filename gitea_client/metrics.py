@@ -0,0 +1,578 @@
+"""
+Request metrics and instrumentation hooks for :class:`~gitea_client.GiteaApi`
+"""
+import atexit
+import bisect
+import logging
+import re
+import sys
+import threading
+import time
+from collections import Counter, namedtuple
+from functools import lru_cache
+
+import attr
+
+from gitea_client._implementation.sketch import LogSketch
+
+logger = logging.getLogger(__name__)
+slow_logger = logging.getLogger("gitea_client.slow")
+
+#: Upper bounds (in seconds) of the buckets of latency histograms
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, float("inf"))
+
+#: Upper bounds (in seconds) of the buckets of JSON decoding histograms
+DECODE_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, float("inf"))
+
+# API paths requested by GiteaApi; a final {b} (branch name) may span several segments
+_ENDPOINT_TEMPLATES = (
+    "/admin/orgs/{o}/teams",
+    "/admin/teams/{t}/members/{u}",
+    "/admin/teams/{t}/repos/{r}",
+    "/admin/users",
+    "/admin/users/{u}",
+    "/admin/users/{u}/orgs",
+    "/org/{o}/repos",
+    "/orgs/{o}",
+    "/orgs/{o}/teams",
+    "/repos/migrate",
+    "/repos/{r}/hooks",
+    "/repos/{r}/hooks/{i}",
+    "/repos/{u}/{r}",
+    "/repos/{u}/{r}/branches",
+    "/repos/{u}/{r}/branches/{b}",
+    "/repos/{u}/{r}/hooks",
+    "/repos/{u}/{r}/hooks/{i}",
+    "/repos/{u}/{r}/keys",
+    "/repos/{u}/{r}/keys/{k}",
+    "/user",
+    "/user/repos",
+    "/users/search",
+    "/users/{u}",
+    "/users/{u}/repos",
+    "/users/{u}/tokens",
+    "/version",
+)
+
+_PLACEHOLDER = re.compile(r"^\{\w+\}$")
+
+# placeholders that may stand for several path segments
+_MULTI_SEGMENT = "{b}"
+
+
+@lru_cache(maxsize=4096)
+def endpoint_template(path):
+    """
+    Returns the template of an API path, e.g. ``"/repos/{u}/{r}/branches"`` for
+    ``"/repos/alice/notes/branches"``. Paths not requested by
+    :class:`~gitea_client.GiteaApi` are reduced to their first segment, e.g. ``"/foo/*"``.
+
+    :param str path: path relative to the API's base URL, without a query
+    :rtype: str
+    """
+    segments = [segment for segment in path.split("?")[0].split("/") if segment]
+    best = None
+    for template in _ENDPOINT_TEMPLATES:
+        score = _match(template, segments)
+        if score is not None and (best is None or score > best[0]):
+            best = (score, template)
+    if best is not None:
+        return best[1]
+    if not segments:
+        return "/"
+    return "/{}/*".format(segments[0]) if len(segments) > 1 else "/" + segments[0]
+
+
+def _match(template, segments):
+    """
+    Returns the number of literal segments of ``template`` matching ``segments``, or
+    ``None`` if the template does not match
+    """
+    parts = template.strip("/").split("/")
+    if len(segments) < len(parts):
+        return None
+    if len(segments) > len(parts) and parts[-1] != _MULTI_SEGMENT:
+        return None
+    literals = 0
+    for part, segment in zip(parts, segments):
+        if _PLACEHOLDER.match(part):
+            continue
+        if part != segment:
+            return None
+        literals += 1
+    return literals
+
+
+def status_class(status_code):
+    """
+    :return: e.g. ``"2xx"`` for a status code of 200, or ``"error"`` for ``None``
+    :rtype: str
+    """
+    if status_code is None:
+        return "error"
+    return "{}xx".format(status_code // 100)
+
+
+@attr.s(frozen=True)
+class RequestRecord(object):
+    """
+    An immutable description of a finished request, passed to after-request callbacks
+    """
+
+    #: HTTP method, e.g. ``"GET"``
+    #:
+    #: :type: str
+    method = attr.ib()
+
+    #: Template of the requested path, e.g. ``"/repos/{u}/{r}"``
+    #:
+    #: :type: str
+    endpoint = attr.ib()
+
+    #: The requested path, e.g. ``"/repos/alice/notes"``
+    #:
+    #: :type: str
+    path = attr.ib()
+
+    #: Status code of the response, or ``None`` if there was no response
+    #:
+    #: :type: int
+    status_code = attr.ib()
+
+    #: ``"ok"`` for a successful response, ``"ApiFailure"`` for an unsuccessful response,
+    #: or ``"NetworkFailure"`` if no response was received
+    #:
+    #: :type: str
+    outcome = attr.ib()
+
+    #: Seconds from sending the request until the response was received
+    #:
+    #: :type: float
+    duration = attr.ib()
+
+    #: Size of the request body in bytes
+    #:
+    #: :type: int
+    bytes_sent = attr.ib()
+
+    #: Size of the response body in bytes
+    #:
+    #: :type: int
+    bytes_received = attr.ib()
+
+    #: Number of times the request was retried after failing to connect (see the
+    #: ``max_retries`` argument of :class:`~gitea_client.GiteaApi`)
+    #:
+    #: :type: int
+    retries = attr.ib(default=0)
+
+
+@attr.s(frozen=True)
+class HistogramSnapshot(object):
+    """
+    An immutable copy of a histogram
+    """
+
+    #: Upper bounds of the buckets
+    #:
+    #: :type: Tuple[float]
+    bounds = attr.ib()
+
+    #: Number of observations in each bucket (not cumulative)
+    #:
+    #: :type: Tuple[int]
+    counts = attr.ib()
+
+    #: Total number of observations
+    #:
+    #: :type: int
+    count = attr.ib()
+
+    #: Sum of all observations
+    #:
+    #: :type: float
+    sum = attr.ib()
+
+    @property
+    def mean(self):
+        """
+        Mean of all observations, or ``None`` if there are none
+
+        :type: float
+        """
+        return self.sum / self.count if self.count else None
+
+
+class _Histogram(object):
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * len(bounds)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def snapshot(self):
+        return HistogramSnapshot(self.bounds, tuple(self.counts), self.count, self.sum)
+
+
+@attr.s(frozen=True)
+class MetricsSnapshot(object):
+    """
+    An immutable copy of the values collected by a :class:`~Metrics`. Request metrics
+    are keyed by ``(method, endpoint, status class, outcome)``, byte counts by
+    ``(method, endpoint)``, and decoding times by entity class name.
+    """
+
+    #: Number of requests
+    #:
+    #: :type: Dict[Tuple[str, str, str, str], int]
+    requests = attr.ib()
+
+    #: Request latencies in seconds
+    #:
+    #: :type: Dict[Tuple[str, str, str, str], HistogramSnapshot]
+    latency = attr.ib()
+
+    #: Bytes of request bodies sent
+    #:
+    #: :type: Dict[Tuple[str, str], int]
+    bytes_sent = attr.ib()
+
+    #: Bytes of response bodies received
+    #:
+    #: :type: Dict[Tuple[str, str], int]
+    bytes_received = attr.ib()
+
+    #: Seconds spent decoding JSON responses into entities
+    #:
+    #: :type: Dict[str, HistogramSnapshot]
+    decode = attr.ib()
+
+    #: Counts of other events, e.g. ``"disk_cache_hit"`` or ``"hedge_sent"``
+    #:
+    #: :type: Dict[str, int]
+    events = attr.ib()
+
+
+_Context = namedtuple("_Context", ["method", "endpoint", "path", "start"])
+
+
+class Metrics(object):
+    """
+    Collects counts, latencies and sizes of the requests of the clients it is passed
+    to (as ``GiteaApi(..., metrics=...)``), and calls registered callbacks before and
+    after every request. Safe to share between clients and threads.
+
+    Clients without metrics skip all of this, at the cost of a single check per request.
+
+    Pickling (e.g. along with a client passed to ``multiprocessing`` workers) keeps the
+    registered callbacks, which must then be picklable, but not the collected values.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._before = []
+        self._after = []
+        self._requests = Counter()
+        self._latency = {}
+        self._bytes_sent = Counter()
+        self._bytes_received = Counter()
+        self._decode = {}
+        self._events = Counter()
+
+    def __getstate__(self):
+        return {"before": list(self._before), "after": list(self._after)}
+
+    def __setstate__(self, state):
+        self.__init__()
+        self._before.extend(state["before"])
+        self._after.extend(state["after"])
+
+    def add_before_request(self, callback):
+        """
+        Registers ``callback`` to be called with ``(method, endpoint, path)`` before
+        every request. Exceptions raised by callbacks are logged and ignored.
+        """
+        self._before.append(callback)
+
+    def add_after_request(self, callback):
+        """
+        Registers ``callback`` to be called with a :class:`~RequestRecord` after every
+        request. Exceptions raised by callbacks are logged and ignored.
+        """
+        self._after.append(callback)
+
+    def snapshot(self):
+        """
+        :return: a copy of the values collected so far
+        :rtype: MetricsSnapshot
+        """
+        with self._lock:
+            return MetricsSnapshot(
+                requests=dict(self._requests),
+                latency={key: h.snapshot() for (key, h) in self._latency.items()},
+                bytes_sent=dict(self._bytes_sent),
+                bytes_received=dict(self._bytes_received),
+                decode={key: h.snapshot() for (key, h) in self._decode.items()},
+                events=dict(self._events))
+
+    def reset(self):
+        """
+        Discards the values collected so far. Callbacks stay registered.
+        """
+        with self._lock:
+            self._requests.clear()
+            self._latency.clear()
+            self._bytes_sent.clear()
+            self._bytes_received.clear()
+            self._decode.clear()
+            self._events.clear()
+
+    def count(self, event, amount=1):
+        """
+        Adds ``amount`` to the count of ``event``
+        """
+        with self._lock:
+            self._events[event] += amount
+
+    def record_decode(self, entity, duration):
+        """
+        Records ``duration`` seconds spent decoding a response into ``entity`` entities
+        """
+        with self._lock:
+            histogram = self._decode.get(entity)
+            if histogram is None:
+                histogram = self._decode[entity] = _Histogram(DECODE_BUCKETS)
+            histogram.observe(duration)
+
+    def before_request(self, method, path):
+        """
+        Called by clients before sending a request
+
+        :return: context to pass to :meth:`after_request`
+        """
+        context = _Context(method, endpoint_template(path), path, time.perf_counter())
+        for callback in self._before:
+            try:
+                callback(method, context.endpoint, path)
+            except Exception:
+                logger.exception("Before-request callback %r failed", callback)
+        return context
+
+    def after_request(self, context, response):
+        """
+        Called by clients once a request has finished
+
+        :param context: the return value of :meth:`before_request`
+        :param requests.Response response: the response, or ``None`` if there was none
+        """
+        duration = time.perf_counter() - context.start
+        retries = 0
+        if response is None:
+            status_code, outcome, sent, received = None, "NetworkFailure", 0, 0
+        else:
+            status_code = response.status_code
+            outcome = "ok" if response.ok else "ApiFailure"
+            sent = _body_size(response.request.body if response.request is not None else None)
+            received = _content_size(response)
+            retries = _retry_count(response)
+        key = (context.method, context.endpoint, status_class(status_code), outcome)
+        with self._lock:
+            self._requests[key] += 1
+            histogram = self._latency.get(key)
+            if histogram is None:
+                histogram = self._latency[key] = _Histogram(LATENCY_BUCKETS)
+            histogram.observe(duration)
+            self._bytes_sent[key[:2]] += sent
+            self._bytes_received[key[:2]] += received
+            if getattr(response, "from_cache", False):
+                self._events["disk_cache_hit"] += 1
+        if self._after:
+            record = RequestRecord(context.method, context.endpoint, context.path, status_code,
+                                   outcome, duration, sent, received, retries)
+            for callback in self._after:
+                try:
+                    callback(record)
+                except Exception:
+                    logger.exception("After-request callback %r failed", callback)
+
+
+def _retry_count(response):
+    history = getattr(getattr(response.raw, "retries", None), "history", None)
+    return len(history) if history else 0
+
+
+def _body_size(body):
+    if body is None:
+        return 0
+    if isinstance(body, (bytes, str)):
+        return len(body)
+    return 0  # streamed bodies are not measured
+
+
+def _content_size(response):
+    if response.raw is not None and not response._content_consumed:
+        # streamed: don't read the body just to measure it
+        return int(response.headers.get("Content-Length") or 0)
+    return len(response.content or b"")
+
+
+_QUANTILES = (0.5, 0.9, 0.99, 0.999)
+
+
+@attr.s(frozen=True)
+class LatencyPercentiles(object):
+    """
+    Approximate latency percentiles (in seconds) of the requests to one endpoint
+    """
+
+    #: Number of requests the percentiles are computed from
+    #:
+    #: :type: int
+    count = attr.ib()
+
+    #: :type: float
+    p50 = attr.ib()
+
+    #: :type: float
+    p90 = attr.ib()
+
+    #: :type: float
+    p99 = attr.ib()
+
+    #: :type: float
+    p999 = attr.ib()
+
+
+class LatencyRecorder(object):
+    """
+    Keeps approximate latency percentiles per ``(method, endpoint)`` over roughly the
+    last one or two ``window`` seconds, in memory bounded by the number of endpoints,
+    and logs every request taking longer than ``slow_threshold`` seconds. Record the
+    requests of a client by attaching the recorder to its metrics::
+
+        metrics = Metrics()
+        LatencyRecorder(slow_threshold=2.0, report_at_exit=True).attach(metrics)
+        api = GiteaApi("https://gitea.example.com", metrics=metrics)
+
+    Slow requests are logged as warnings to the ``gitea_client.slow`` logger. The
+    fields of the request are also attached to the log record as ``method``,
+    ``endpoint``, ``status``, ``bytes_sent``, ``bytes_received``, ``duration`` and
+    ``retries`` attributes, for structured log handlers.
+
+    Pickled recorders, e.g. attached to the metrics of a client passed to
+    ``multiprocessing`` workers, carry over the latencies recorded so far.
+    """
+
+    def __init__(self, slow_threshold=1.0, window=300.0, relative_accuracy=0.01,
+                 max_buckets=1024, report_at_exit=False):
+        """
+        :param float slow_threshold: seconds after which a request is logged as slow, or
+                                     ``None`` to log none
+        :param float window: seconds after which old latencies start being discarded
+        :param float relative_accuracy: maximum relative error of the percentiles
+        :param int max_buckets: maximum number of buckets per endpoint
+        :param bool report_at_exit: whether to write :meth:`summary` to ``stderr`` when
+                                    the process exits
+        """
+        self._slow_threshold = slow_threshold
+        self._window = window
+        self._relative_accuracy = relative_accuracy
+        self._max_buckets = max_buckets
+        self._lock = threading.Lock()
+        self._sketches = {}  # (method, endpoint) -> [current, previous, started]
+        self._report_at_exit = report_at_exit
+        if report_at_exit:
+            atexit.register(self.report)
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        del state["_lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+        if self._report_at_exit:
+            atexit.register(self.report)
+
+    def attach(self, metrics):
+        """
+        Records the requests measured by ``metrics``
+
+        :param Metrics metrics: metrics of one or more clients
+        :return: this recorder
+        """
+        metrics.add_after_request(self.record)
+        return self
+
+    def record(self, record):
+        """
+        Records a finished request
+
+        :param RequestRecord record: the request
+        """
+        key = (record.method, record.endpoint)
+        now = time.time()
+        with self._lock:
+            entry = self._sketches.get(key)
+            if entry is None:
+                entry = self._sketches[key] = [self._new_sketch(), self._new_sketch(), now]
+            elif now - entry[2] >= self._window:
+                expired = now - entry[2] >= 2 * self._window
+                entry[:] = [self._new_sketch(), self._new_sketch() if expired else entry[0], now]
+            entry[0].add(record.duration)
+        if self._slow_threshold is not None and record.duration > self._slow_threshold:
+            slow_logger.warning(
+                "Slow request: %s %s %s %.3fs sent=%d received=%d retries=%d",
+                record.method, record.endpoint, record.status_code, record.duration,
+                record.bytes_sent, record.bytes_received, record.retries,
+                extra={"method": record.method, "endpoint": record.endpoint,
+                       "status": record.status_code, "bytes_sent": record.bytes_sent,
+                       "bytes_received": record.bytes_received, "duration": record.duration,
+                       "retries": record.retries})
+
+    def percentiles(self):
+        """
+        :return: the latency percentiles of each ``(method, endpoint)`` requested
+        :rtype: Dict[Tuple[str, str], LatencyPercentiles]
+        """
+        with self._lock:
+            merged = {}
+            for key, (current, previous, _) in self._sketches.items():
+                sketch = self._new_sketch()
+                sketch.merge(current)
+                sketch.merge(previous)
+                merged[key] = sketch
+        return {key: LatencyPercentiles(sketch.count, *[sketch.quantile(q) for q in _QUANTILES])
+                for (key, sketch) in merged.items() if sketch.count > 0}
+
+    def summary(self):
+        """
+        :return: a table of the latency percentiles of each endpoint, slowest first
+        :rtype: str
+        """
+        rows = sorted(self.percentiles().items(), key=lambda item: -item[1].p99)
+        lines = ["{:<7} {:<32} {:>8} {:>9} {:>9} {:>9} {:>9}".format(
+            "method", "endpoint", "count", "p50", "p90", "p99", "p99.9")]
+        for (method, endpoint), p in rows:
+            lines.append("{:<7} {:<32} {:>8} {:>8.3f}s {:>8.3f}s {:>8.3f}s {:>8.3f}s".format(
+                method, endpoint, p.count, p.p50, p.p90, p.p99, p.p999))
+        return "\n".join(lines)
+
+    def report(self, stream=None):
+        """
+        Writes :meth:`summary` to ``stream`` (by default ``stderr``), unless no requests
+        were recorded
+        """
+        if not self.percentiles():
+            return
+        stream = sys.stderr if stream is None else stream
+        stream.write(self.summary() + "\n")
+
+    def _new_sketch(self):
+        return LogSketch(self._relative_accuracy, self._max_buckets)
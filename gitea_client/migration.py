@@ -0,0 +1,272 @@
+"""
+Scheduling of many repository migrations against a Gitea server
+"""
+import threading
+import time
+
+import attr
+
+from gitea_client._implementation.concurrency import bounded_map
+from gitea_client._implementation.http_utils import NO_CACHE
+from gitea_client._implementation.journal import Journal
+from gitea_client._implementation.retry import call_with_retries
+from gitea_client.entities import GiteaRepo
+
+
+@attr.s(frozen=True)
+class MigrationJob(object):
+    """
+    An immutable description of a single call to :meth:`GiteaApi.migrate_repo`
+    """
+
+    #: Remote Git address to migrate from
+    #:
+    #: :type: str
+    clone_addr = attr.ib()
+
+    #: User ID of the owner of the migrated repository
+    #:
+    #: :type: int
+    uid = attr.ib()
+
+    #: Name of the migrated repository
+    #:
+    #: :type: str
+    repo_name = attr.ib()
+
+    #: Whether the migrated repository is a mirror
+    #:
+    #: :type: bool
+    mirror = attr.ib(default=False)
+
+    #: Whether the migrated repository is private
+    #:
+    #: :type: bool
+    private = attr.ib(default=False)
+
+    #: Description of the migrated repository
+    #:
+    #: :type: str
+    description = attr.ib(default=None)
+
+    #: Username of the owner of the migrated repository, if known. A retried job first
+    #: checks whether an earlier, timed-out attempt already created the repository,
+    #: looking it up by ``uid`` when the owner's username is not known.
+    #:
+    #: :type: str
+    owner = attr.ib(default=None)
+
+    @property
+    def key(self):
+        """
+        Identifies the job in the scheduler's journal
+
+        :type: str
+        """
+        return "{}/{}".format(self.uid, self.repo_name)
+
+
+@attr.s(frozen=True)
+class MigrationProgress(object):
+    """
+    An immutable snapshot of a :class:`~MigrationScheduler` run's progress
+    """
+
+    #: Number of jobs in the run, excluding jobs finished by an earlier run
+    #:
+    #: :type: int
+    total = attr.ib()
+
+    #: Number of jobs that succeeded
+    #:
+    #: :type: int
+    migrated = attr.ib()
+
+    #: Number of jobs that failed after exhausting their retries
+    #:
+    #: :type: int
+    failed = attr.ib()
+
+    #: Seconds since the run started
+    #:
+    #: :type: float
+    elapsed = attr.ib()
+
+    @property
+    def throughput(self):
+        """
+        Finished jobs per minute
+
+        :type: float
+        """
+        if self.elapsed <= 0:
+            return 0.0
+        return 60.0 * (self.migrated + self.failed) / self.elapsed
+
+    @property
+    def eta(self):
+        """
+        Estimated seconds until all jobs are finished, or ``None`` if no job has finished yet
+
+        :type: float
+        """
+        finished = self.migrated + self.failed
+        if finished == 0:
+            return None
+        return (self.total - finished) * self.elapsed / finished
+
+
+@attr.s(frozen=True)
+class MigrationResult(object):
+    """
+    An immutable summary of a :class:`~MigrationScheduler` run
+    """
+
+    #: Migrated repositories, keyed by job
+    #:
+    #: :type: Dict[MigrationJob, GiteaRepo]
+    migrated = attr.ib()
+
+    #: Jobs skipped because the journal records them as finished by an earlier run
+    #:
+    #: :type: List[MigrationJob]
+    resumed = attr.ib()
+
+    #: Failed jobs, mapped to the exception raised by their last attempt
+    #:
+    #: :type: Dict[MigrationJob, Exception]
+    failed = attr.ib()
+
+
+class MigrationScheduler(object):
+    """
+    A queue of repository migrations that are run with a bounded number of
+    concurrent clones on the server, retrying transient failures.
+    """
+
+    def __init__(self, api, auth, concurrency=4, timeout=None, retries=3, backoff=5.0,
+                 journal_path=None, progress=None):
+        """
+        :param GiteaApi api: client to migrate with
+        :param auth.Authentication auth: authentication object
+        :param int concurrency: maximum number of migrations running on the server at once
+        :param float timeout: seconds to wait for each migration attempt
+        :param int retries: maximum number of retries per job after a transient failure
+        :param float backoff: seconds to wait before a job's first retry; doubles with every retry
+        :param str journal_path: location of a journal recording finished jobs. Jobs
+                                 recorded there by an earlier run are not migrated again
+        :param progress: optional callable, invoked with a :class:`~MigrationProgress`
+                         every time a job finishes
+        """
+        self._api = api
+        self._auth = auth
+        self._concurrency = concurrency
+        self._timeout = timeout
+        self._retries = retries
+        self._backoff = backoff
+        self._journal_path = journal_path
+        self._progress = progress
+        self._jobs = []
+        self._lock = threading.Lock()
+        self._started = None
+        self._total = 0
+        self._migrated = 0
+        self._failed = 0
+
+    def submit(self, clone_addr, uid, repo_name, mirror=False, private=False,
+               description=None, owner=None):
+        """
+        Adds a migration to the queue. Arguments are as for :meth:`GiteaApi.migrate_repo`.
+
+        :param str owner: username of the owner with id ``uid``, if known
+        :return: the queued job
+        :rtype: MigrationJob
+        """
+        job = MigrationJob(clone_addr, uid, repo_name, mirror=mirror, private=private,
+                           description=description, owner=owner)
+        self._jobs.append(job)
+        return job
+
+    def progress(self):
+        """
+        Returns the progress of the current (or last) run
+
+        :rtype: MigrationProgress
+        """
+        with self._lock:
+            elapsed = 0.0 if self._started is None else time.time() - self._started
+            return MigrationProgress(self._total, self._migrated, self._failed, elapsed)
+
+    def run(self):
+        """
+        Runs every queued job, and returns once all have finished
+
+        :return: summary of the run
+        :rtype: MigrationResult
+        """
+        journal = Journal(self._journal_path) if self._journal_path is not None else None
+        finished = set()
+        if journal is not None:
+            finished = {record["job"] for record in journal.replay() if record["state"] == "done"}
+        resumed = [job for job in self._jobs if job.key in finished]
+        jobs = [job for job in self._jobs if job.key not in finished]
+        with self._lock:
+            self._started = time.time()
+            self._total = len(jobs)
+            self._migrated = 0
+            self._failed = 0
+
+        migrated = {}
+        failed = {}
+        try:
+            for job, repo, exc in bounded_map(self._migrate, jobs, self._concurrency):
+                with self._lock:
+                    if exc is None:
+                        self._migrated += 1
+                    else:
+                        self._failed += 1
+                if exc is None:
+                    migrated[job] = repo
+                    if journal is not None:
+                        journal.append({"job": job.key, "state": "done", "repo": repo.full_name})
+                else:
+                    failed[job] = exc
+                    if journal is not None:
+                        journal.append({"job": job.key, "state": "failed", "error": str(exc)})
+                if self._progress is not None:
+                    self._progress(self.progress())
+        finally:
+            if journal is not None:
+                journal.close()
+        return MigrationResult(migrated, resumed, failed)
+
+    def _migrate(self, job):
+        def attempt():
+            return self._api.migrate_repo(self._auth, job.clone_addr, job.uid, job.repo_name,
+                                          mirror=job.mirror, private=job.private,
+                                          description=job.description, timeout=self._timeout)
+
+        def already_migrated(_):
+            # a timed-out attempt may still have completed on the server
+            if job.owner is None:
+                return self._find_repo(job)
+            if self._api.repo_exists(self._auth, job.owner, job.repo_name):
+                return self._api.get_repo(self._auth, job.owner, job.repo_name)
+            return None
+
+        return call_with_retries(attempt, self._retries, backoff=self._backoff,
+                                 before_retry=already_migrated)
+
+    def _find_repo(self, job):
+        """
+        Returns the repository named ``job.repo_name`` owned by the user with id
+        ``job.uid``, or ``None`` if there is none
+        """
+        response = self._api.get("/repos/search", auth=self._auth,
+                                 params={"q": job.repo_name, "uid": job.uid, "limit": 50},
+                                 headers=NO_CACHE)
+        for repo_json in response.json().get("data") or []:
+            repo = GiteaRepo.from_json(repo_json)
+            if repo.owner.id == job.uid and repo.name.lower() == job.repo_name.lower():
+                return repo
+        return None
@@ -0,0 +1,74 @@
+"""
+Tracing of :class:`~gitea_client.GiteaApi` operations
+"""
+
+
+class Span(object):
+    """
+    A span of a trace, used as a context manager. This implementation does nothing;
+    :class:`~Tracer` subclasses return spans of their tracing system.
+    """
+
+    def set_attribute(self, key, value):
+        """
+        Attaches ``key=value`` to this span
+        """
+        pass
+
+    def record_exception(self, exception):
+        """
+        Marks this span as failed with ``exception``
+        """
+        pass
+
+    def end(self):
+        """
+        Ends this span
+        """
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_value is not None:
+            self.record_exception(exc_value)
+        self.end()
+        return False
+
+
+_NOOP_SPAN = Span()
+
+
+class Tracer(object):
+    """
+    The interface between clients and a tracing system, passed to a client as
+    ``GiteaApi(..., tracer=...)``. This implementation does nothing; subclasses
+    adapt e.g. OpenTelemetry (see :doc:`tracing`).
+
+    Clients open a span named after each public method called (e.g.
+    ``"GiteaApi.ensure_token"``), within it a span per HTTP request (e.g.
+    ``"HTTP GET"``), and a span per decoding of a response into entities (e.g.
+    ``"decode GiteaUser"``). Spans opened while another span is active should be its
+    children.
+    """
+
+    def start_span(self, name, attributes=None):
+        """
+        Opens a span, as a child of the active span if any, and makes it the active
+        span until it ends
+
+        :param str name: name of the span
+        :param dict attributes: initial attributes of the span
+        :rtype: Span
+        """
+        return _NOOP_SPAN
+
+    def inject(self, headers):
+        """
+        Adds headers propagating the active span's trace context (e.g. ``traceparent``)
+        to the outgoing request headers ``headers``
+
+        :param dict headers: headers of a request about to be sent
+        """
+        pass
@@ -0,0 +1,194 @@
+"""
+Transport adapters recording responses to, and replaying them from, cassette files
+"""
+import base64
+import io
+import json
+import threading
+import time
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+import requests
+from requests.adapters import BaseAdapter, HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+
+from gitea_client._implementation.http_utils import TRANSFER_HEADERS
+
+
+class UnrecordedRequest(requests.ConnectionError):
+    """
+    Raised by a :class:`~ReplayAdapter` for a request that its cassette has no response for
+    """
+
+
+class RecordingAdapter(BaseAdapter):
+    """
+    A transport adapter that sends requests with another adapter, and appends each
+    request and its response, with the time taken to receive it, to a cassette file
+    of JSON lines. Pass it to a client as ``GiteaApi(..., adapter=...)``.
+
+    Access tokens in query strings and request headers are not recorded. Request
+    bodies are recorded as sent, including any passwords in them.
+
+    Responses are read completely before they are returned, even if streamed.
+    """
+
+    def __init__(self, path, adapter=None):
+        """
+        :param str path: cassette file to append to
+        :param requests.adapters.BaseAdapter adapter: adapter sending the requests; by
+                                                      default a new ``HTTPAdapter``
+        """
+        BaseAdapter.__init__(self)
+        self._path = path
+        self._adapter = HTTPAdapter() if adapter is None else adapter
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        return {"path": self._path, "adapter": self._adapter}
+
+    def __setstate__(self, state):
+        self.__init__(state["path"], state["adapter"])
+
+    @property
+    def path(self):
+        return self._path
+
+    def send(self, request, **kwargs):
+        start = time.perf_counter()
+        response = self._adapter.send(request, **kwargs)
+        content = response.content
+        elapsed = time.perf_counter() - start
+        entry = {
+            "method": request.method,
+            "url": _without_token(request.url),
+            "request_body": _encode_body(request.body),
+            "status": response.status_code,
+            "reason": response.reason,
+            "headers": {name: value for (name, value) in response.headers.items()
+                        if name.lower() not in TRANSFER_HEADERS and name.lower() != "set-cookie"},
+            "body": _encode_body(content),
+            "elapsed": elapsed,
+        }
+        line = json.dumps(entry, sort_keys=True) + "\n"
+        with self._lock:
+            with open(self._path, "a") as cassette:
+                cassette.write(line)
+        return response
+
+    def close(self):
+        self._adapter.close()
+
+
+class ReplayAdapter(BaseAdapter):
+    """
+    A transport adapter answering requests with the responses recorded in a cassette
+    file by a :class:`~RecordingAdapter`, without any network access. Pass it to a
+    client as ``GiteaApi(..., adapter=...)``.
+
+    Requests are matched by method, URL (ignoring any access token) and, unless
+    ``match_body`` is false, body. The responses recorded for the same request are
+    served in the order recorded, starting over once all have been served. Requests
+    without a recorded response raise :class:`~UnrecordedRequest`.
+
+    Each response is delayed by its recorded time multiplied by ``time_scale``, so
+    that ``1.0`` replays the recorded latencies, ``0.5`` halves them and ``0.0``
+    serves responses immediately.
+    """
+
+    def __init__(self, path, time_scale=1.0, match_body=True):
+        """
+        :param str path: cassette file to read
+        :param float time_scale: factor applied to the recorded response times
+        :param bool match_body: whether requests must have the recorded body to match
+        """
+        BaseAdapter.__init__(self)
+        self._path = path
+        self._time_scale = time_scale
+        self._match_body = match_body
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._served = {}
+        with open(path) as cassette:
+            for line in cassette:
+                if line.strip():
+                    entry = json.loads(line)
+                    self._entries.setdefault(self._key(entry["method"], entry["url"],
+                                                       entry["request_body"]), []).append(entry)
+
+    def __getstate__(self):
+        return {"path": self._path, "time_scale": self._time_scale,
+                "match_body": self._match_body}
+
+    def __setstate__(self, state):
+        self.__init__(state["path"], state["time_scale"], state["match_body"])
+
+    @property
+    def path(self):
+        return self._path
+
+    @property
+    def time_scale(self):
+        return self._time_scale
+
+    def send(self, request, stream=False, **kwargs):
+        url = _without_token(request.url)
+        key = self._key(request.method, url, _encode_body(request.body))
+        entries = self._entries.get(key)
+        if not entries:
+            raise UnrecordedRequest("No recorded response for {} {}".format(request.method, url),
+                                    request=request)
+        with self._lock:
+            served = self._served.get(key, 0)
+            self._served[key] = served + 1
+        entry = entries[served % len(entries)]
+        delay = entry["elapsed"] * self._time_scale
+        if delay > 0:
+            time.sleep(delay)
+        body = _decode_body(entry["body"]) or b""
+        response = requests.Response()
+        response.status_code = entry["status"]
+        response.reason = entry["reason"]
+        response.headers = CaseInsensitiveDict(entry["headers"])
+        response.headers["Content-Length"] = str(len(body))
+        response.encoding = get_encoding_from_headers(response.headers)
+        response.raw = io.BytesIO(body)
+        response.url = request.url
+        response.request = request
+        response.connection = self
+        return response
+
+    def close(self):
+        pass
+
+    def _key(self, method, url, body):
+        return (method, url, json.dumps(body, sort_keys=True) if self._match_body else None)
+
+
+def _without_token(url):
+    parts = urlsplit(url)
+    query = [(name, value) for (name, value) in parse_qsl(parts.query, keep_blank_values=True)
+             if name != "token"]
+    return urlunsplit(parts._replace(query=urlencode(query)))
+
+
+def _encode_body(body):
+    if body is None:
+        return None
+    if isinstance(body, str):
+        return {"text": body}
+    if not isinstance(body, bytes):
+        return None  # streamed request bodies are not recorded
+    try:
+        return {"text": body.decode("utf-8")}
+    except UnicodeDecodeError:
+        return {"base64": base64.b64encode(body).decode("ascii")}
+
+
+def _decode_body(encoded):
+    if encoded is None:
+        return None
+    if "text" in encoded:
+        return encoded["text"].encode("utf-8")
+    return base64.b64decode(encoded["base64"])
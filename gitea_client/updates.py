@@ -40,6 +40,50 @@ class GiteaUserUpdate(object):
         }
         return {k: v for (k, v) in fields.items() if v is not None}
 
+    def changes_from(self, user):
+        """
+        Returns the part of this update that would change ``user``, or ``None`` if the
+        update would change nothing. The login name and email are always kept, since
+        the server requires them, but are only compared if the server reports them.
+        Other fields whose current value is not reported by the server, such as the
+        password, are always considered changed.
+
+        :param GiteaUser user: current state of the user to update
+        :rtype: GiteaUserUpdate
+        """
+        current = user.json
+        changed = {}
+        for field, value in self.as_dict().items():
+            json_field = self._JSON_FIELDS.get(field, field)
+            if json_field not in current:
+                if field not in ("login_name", "email"):
+                    changed[field] = value
+            elif current[json_field] != value:
+                changed[field] = value
+        if not changed:
+            return None
+        changed["login_name"] = self._login_name
+        changed["email"] = self._email
+        return GiteaUserUpdate(**{field: changed.get(field) for field in self._FIELDS})
+
+    def merge(self, later):
+        """
+        Returns an update combining this update with ``later``, with the fields set in
+        ``later`` taking precedence
+
+        :param GiteaUserUpdate later: an update applied after this one
+        :rtype: GiteaUserUpdate
+        """
+        fields = self.as_dict()
+        fields.update(later.as_dict())
+        return GiteaUserUpdate(**{field: fields.get(field) for field in self._FIELDS})
+
+    # names of fields in user JSON that differ from the names of update fields
+    _JSON_FIELDS = {"admin": "is_admin"}
+
+    _FIELDS = ("source_id", "login_name", "full_name", "email", "password", "website",
+               "location", "active", "admin", "allow_git_hook", "allow_import_local")
+
     class Builder(object):
         def __init__(self, login_name, email):
             """
@@ -190,6 +234,46 @@ class GiteaHookUpdate(object):
         }
         return {k: v for (k, v) in fields.items() if v is not None}
 
+    def merge(self, later):
+        """
+        Returns an update combining this update with ``later``, with the fields set in
+        ``later`` taking precedence. Configs are merged entry by entry.
+
+        :param GiteaHookUpdate later: an update applied after this one
+        :rtype: GiteaHookUpdate
+        """
+        config = self._config
+        if later._config is not None:
+            config = dict(config or {}, **later._config)
+        return GiteaHookUpdate(
+            events=self._events if later._events is None else later._events,
+            config=config,
+            active=self._active if later._active is None else later._active)
+
+    def changes_from(self, hook):
+        """
+        Returns the part of this update that would change ``hook``, or ``None`` if the
+        update would change nothing. Events are compared regardless of order. The
+        config is kept whole if any of its entries differs, or is not reported by the
+        server (like the secret).
+
+        :param GiteaRepo.Hook hook: current state of the hook to update
+        :rtype: GiteaHookUpdate
+        """
+        events = self._events
+        if events is not None and set(events) == set(hook.events):
+            events = None
+        config = self._config
+        if config is not None and all(k in hook.config and hook.config[k] == v
+                                      for (k, v) in config.items()):
+            config = None
+        active = self._active
+        if active is not None and active == hook.active:
+            active = None
+        if events is None and config is None and active is None:
+            return None
+        return GiteaHookUpdate(events=events, config=config, active=active)
+
     class Builder(object):
         def __init__(self):
             self._events = None
@@ -0,0 +1,381 @@
+"""
+Receiving side of Gitea webhooks: signature verification, decoding of payloads
+into entities, and dispatch to handlers
+"""
+import hashlib
+import hmac
+import json
+import logging
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from queue import Queue, Full
+from socketserver import ThreadingMixIn
+
+import attr
+
+from gitea_client.entities import GiteaEntity, GiteaUser, GiteaRepo, GiteaCommit
+
+logger = logging.getLogger(__name__)
+
+
+def _normalize_user(parsed_json):
+    # webhook payloads identify users by "login", which older servers don't mirror as "username"
+    if "username" not in parsed_json:
+        parsed_json["username"] = parsed_json.get("login")
+    parsed_json.setdefault("full_name", "")
+    return parsed_json
+
+
+def _user(parsed_json):
+    if parsed_json is None or isinstance(parsed_json, GiteaUser):
+        return parsed_json
+    return GiteaUser.from_json(_normalize_user(parsed_json))
+
+
+def _repo(parsed_json):
+    if parsed_json is None or isinstance(parsed_json, GiteaRepo):
+        return parsed_json
+    if parsed_json.get("permissions") is None:
+        parsed_json["permissions"] = {}
+    _normalize_user(parsed_json["owner"])
+    return GiteaRepo.from_json(parsed_json)
+
+
+@attr.s(frozen=True)
+class GiteaPushEvent(GiteaEntity):
+    """
+    An immutable representation of a ``push`` webhook delivery
+    """
+
+    #: The pushed ref, e.g. ``"refs/heads/master"``
+    #:
+    #: :type: str
+    ref = attr.ib()
+
+    #: Commit id the ref pointed to before the push
+    #:
+    #: :type: str
+    before = attr.ib()
+
+    #: Commit id the ref points to after the push
+    #:
+    #: :type: str
+    after = attr.ib()
+
+    #: The pushed commits
+    #:
+    #: :type: List[GiteaCommit]
+    commits = attr.ib(converter=lambda commits: [GiteaCommit.from_json(c) for c in commits or []],
+                      default=None)
+
+    #: The repository pushed to
+    #:
+    #: :type: GiteaRepo
+    repository = attr.ib(converter=_repo, default=None)
+
+    #: The user who pushed
+    #:
+    #: :type: GiteaUser
+    pusher = attr.ib(converter=_user, default=None)
+
+    #: The user who triggered the delivery
+    #:
+    #: :type: GiteaUser
+    sender = attr.ib(converter=_user, default=None)
+
+    #: Always ``"push"``
+    #:
+    #: :type: str
+    event_type = "push"
+
+
+@attr.s(frozen=True)
+class GiteaCreateEvent(GiteaEntity):
+    """
+    An immutable representation of a ``create`` (branch or tag created) webhook delivery
+    """
+
+    #: Name of the created branch or tag
+    #:
+    #: :type: str
+    ref = attr.ib()
+
+    #: Either ``"branch"`` or ``"tag"``
+    #:
+    #: :type: str
+    ref_type = attr.ib()
+
+    #: Commit id the created ref points to
+    #:
+    #: :type: str
+    sha = attr.ib(default=None)
+
+    #: The repository containing the ref
+    #:
+    #: :type: GiteaRepo
+    repository = attr.ib(converter=_repo, default=None)
+
+    #: The user who triggered the delivery
+    #:
+    #: :type: GiteaUser
+    sender = attr.ib(converter=_user, default=None)
+
+    #: Always ``"create"``
+    #:
+    #: :type: str
+    event_type = "create"
+
+
+@attr.s(frozen=True)
+class GiteaDeleteEvent(GiteaEntity):
+    """
+    An immutable representation of a ``delete`` (branch or tag deleted) webhook delivery
+    """
+
+    #: Name of the deleted branch or tag
+    #:
+    #: :type: str
+    ref = attr.ib()
+
+    #: Either ``"branch"`` or ``"tag"``
+    #:
+    #: :type: str
+    ref_type = attr.ib()
+
+    #: The repository that contained the ref
+    #:
+    #: :type: GiteaRepo
+    repository = attr.ib(converter=_repo, default=None)
+
+    #: The user who triggered the delivery
+    #:
+    #: :type: GiteaUser
+    sender = attr.ib(converter=_user, default=None)
+
+    #: Always ``"delete"``
+    #:
+    #: :type: str
+    event_type = "delete"
+
+
+@attr.s(frozen=True)
+class GiteaWebhookEvent(GiteaEntity):
+    """
+    An immutable representation of any other webhook delivery. The full payload is
+    available as :data:`json`.
+    """
+
+    #: The action that triggered the delivery, e.g. ``"created"``, if any
+    #:
+    #: :type: str
+    action = attr.ib(default=None)
+
+    #: The repository concerned, if any
+    #:
+    #: :type: GiteaRepo
+    repository = attr.ib(converter=_repo, default=None)
+
+    #: The user who triggered the delivery
+    #:
+    #: :type: GiteaUser
+    sender = attr.ib(converter=_user, default=None)
+
+    #: The value of the ``X-Gitea-Event`` header, e.g. ``"repository"``
+    #:
+    #: :type: str
+    event_type = attr.ib(default=None)
+
+
+_EVENT_CLASSES = {
+    "push": GiteaPushEvent,
+    "create": GiteaCreateEvent,
+    "delete": GiteaDeleteEvent,
+}
+
+
+def parse_event(event_type, payload):
+    """
+    Decodes a webhook payload into an event entity.
+
+    :param str event_type: the value of the delivery's ``X-Gitea-Event`` header
+    :param dict payload: the parsed JSON body of the delivery
+    :return: the decoded event
+    :rtype: GiteaPushEvent or GiteaCreateEvent or GiteaDeleteEvent or GiteaWebhookEvent
+    :raises ValueError: if the payload is missing required fields
+    """
+    event_class = _EVENT_CLASSES.get(event_type)
+    if event_class is None:
+        return attr.evolve(GiteaWebhookEvent.from_json(payload), event_type=event_type)
+    return event_class.from_json(payload)
+
+
+def verify_signature(secret, body, signature):
+    """
+    Returns whether ``signature`` is the HMAC-SHA256 signature of ``body`` under
+    ``secret``, as sent by Gitea in the ``X-Gitea-Signature`` header. The comparison
+    takes constant time.
+
+    :param str secret: the hook's secret
+    :param bytes body: the raw body of the delivery
+    :param str signature: hex-encoded signature
+    :rtype: bool
+    """
+    if not signature:
+        return False
+    try:
+        signature = signature.strip().lower().encode("ascii")
+    except UnicodeError:
+        return False
+    expected = hmac.new(secret.encode("utf-8"), body, hashlib.sha256).hexdigest()
+    return hmac.compare_digest(expected.encode("ascii"), signature)
+
+
+class WebhookReceiver(object):
+    """
+    Verifies and decodes webhook deliveries, and passes the resulting events to
+    registered handlers on a pool of worker threads.
+
+    Deliveries are queued for the workers in a bounded queue. When the queue is
+    full, :meth:`receive` waits up to ``enqueue_timeout`` seconds for space before
+    rejecting the delivery, which pushes back on the sender instead of buffering
+    without bound.
+    """
+
+    def __init__(self, secret=None, workers=4, queue_size=1024, enqueue_timeout=1.0):
+        """
+        :param str secret: the hooks' secret. If ``None``, signatures are not checked
+        :param int workers: number of threads running handlers
+        :param int queue_size: maximum number of events waiting for a worker
+        :param float enqueue_timeout: seconds to wait for space in a full queue
+        """
+        self._secret = secret
+        self._queue = Queue(queue_size)
+        self._enqueue_timeout = enqueue_timeout
+        self._handlers = []
+        self._workers = [threading.Thread(target=self._work, name="gitea-webhook-{}".format(i))
+                         for i in range(workers)]
+        for worker in self._workers:
+            worker.daemon = True
+        self._started = False
+        self._start_lock = threading.Lock()
+        self._stopped = False
+        self._enqueuing = 0
+        self._enqueue_condition = threading.Condition()
+
+    def add_handler(self, handler, events=None):
+        """
+        Registers ``handler`` to be called with every decoded event of the given types.
+
+        :param handler: callable taking a single event
+        :param events: event types (e.g. ``["push", "create"]``) to pass to ``handler``.
+                       Defaults to all events
+        """
+        self._handlers.append((handler, None if events is None else frozenset(events)))
+
+    def start(self):
+        """
+        Starts the worker threads. Called automatically by the first :meth:`receive`.
+        """
+        with self._start_lock:
+            if not self._started:
+                self._started = True
+                for worker in self._workers:
+                    worker.start()
+
+    def stop(self):
+        """
+        Waits for queued events to be handled, then stops the worker threads. A
+        stopped receiver cannot be restarted, and rejects further deliveries. Calling
+        this more than once has no further effect.
+        """
+        with self._enqueue_condition:
+            if self._stopped:
+                return
+            self._stopped = True
+            while self._enqueuing:
+                self._enqueue_condition.wait()
+        if self._started:
+            for _ in self._workers:
+                self._queue.put(None)
+            for worker in self._workers:
+                worker.join()
+
+    def receive(self, headers, body):
+        """
+        Verifies, decodes and queues a single delivery.
+
+        :param headers: the delivery's HTTP headers (a case-insensitive mapping, or a
+                        dict with canonically capitalized names)
+        :param bytes body: the raw body of the delivery
+        :return: the HTTP status code to respond with: 202 if the event was queued,
+                 401 for a bad signature, 400 for a malformed payload, and 503 if the
+                 queue stayed full or the receiver was stopped
+        :rtype: int
+        """
+        if self._secret is not None:
+            if not verify_signature(self._secret, body, headers.get("X-Gitea-Signature")):
+                return 401
+        event_type = headers.get("X-Gitea-Event") or headers.get("X-Gogs-Event")
+        try:
+            event = parse_event(event_type, json.loads(body.decode("utf-8")))
+        except (ValueError, KeyError, TypeError, AttributeError):
+            return 400
+        with self._enqueue_condition:
+            if self._stopped:
+                return 503
+            self._enqueuing += 1
+        try:
+            self.start()
+            self._queue.put(event, timeout=self._enqueue_timeout)
+        except Full:
+            return 503
+        finally:
+            with self._enqueue_condition:
+                self._enqueuing -= 1
+                self._enqueue_condition.notify_all()
+        return 202
+
+    def _work(self):
+        while True:
+            event = self._queue.get()
+            if event is None:
+                return
+            for handler, events in self._handlers:
+                if events is None or event.event_type in events:
+                    try:
+                        handler(event)
+                    except Exception:
+                        logger.exception("Webhook handler %r failed", handler)
+
+
+class _WebhookRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length)
+        status = self.server.receiver.receive(self.headers, body)
+        self.send_response(status)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        logger.debug(format, *args)
+
+
+class WebhookServer(ThreadingMixIn, HTTPServer):
+    """
+    A standalone HTTP server passing every POSTed delivery to a :class:`~WebhookReceiver`.
+    Connections are kept alive between deliveries.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, receiver, host="", port=8080):
+        """
+        :param WebhookReceiver receiver: receiver to pass deliveries to
+        :param str host: interface to listen on; all interfaces by default
+        :param int port: port to listen on; ``0`` picks a free port
+        """
+        HTTPServer.__init__(self, (host, port), _WebhookRequestHandler)
+        self.receiver = receiver
@@ -0,0 +1,507 @@
+"""
+Queues that take writes to Gitea off the caller's path
+"""
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+from concurrent.futures import Future, wait
+from queue import Queue
+
+from gitea_client._implementation.concurrency import bounded_map
+from gitea_client._implementation.journal import Journal
+from gitea_client._implementation.retry import call_with_retries
+from gitea_client.interface import ApiFailure
+
+
+class CoalescingWriteQueue(object):
+    """
+    Delays user and hook updates briefly, merging updates to the same user or hook
+    into a single request (fields set by later updates win).
+
+    Pending updates are sent ``flush_interval`` seconds after the oldest of them was
+    queued, as soon as ``max_pending`` users and hooks have pending updates, or on
+    :meth:`flush`. Updates to the same target are sent in the order they were queued.
+    Every queued update returns a ``concurrent.futures.Future`` that resolves to the
+    updated entity once the merged request has been sent, or to its exception.
+    """
+
+    def __init__(self, api, auth, flush_interval=1.0, max_pending=100, concurrency=4,
+                 only_changes=False):
+        """
+        :param GiteaApi api: client to send updates with
+        :param auth.Authentication auth: authentication object, must be admin-level for
+                                         user updates
+        :param float flush_interval: maximum number of seconds an update is held back
+        :param int max_pending: number of targets with pending updates that triggers a flush
+        :param int concurrency: maximum number of requests in flight during a flush
+        :param bool only_changes: whether to send only fields that differ from the
+                                  target's current state (see :meth:`GiteaApi.update_user`)
+        """
+        self._api = api
+        self._auth = auth
+        self._flush_interval = flush_interval
+        self._max_pending = max_pending
+        self._concurrency = concurrency
+        self._only_changes = only_changes
+        self._pending = OrderedDict()
+        self._oldest = None
+        self._flush_requested = False
+        self._sending = []
+        self._closed = False
+        self._condition = threading.Condition()
+        self._thread = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def update_user(self, username, update):
+        """
+        Queues an update of the user with username ``username``.
+
+        :param str username: username of user to update
+        :param GiteaUserUpdate update: the requested update
+        :return: future resolving to the updated user
+        :rtype: concurrent.futures.Future
+        """
+        return self._enqueue(("user", username), update)
+
+    def update_hook(self, repo_name, hook_id, update, organization=None):
+        """
+        Queues an update of a hook. Arguments are as for :meth:`GiteaApi.update_hook`.
+
+        :return: future resolving to the updated hook
+        :rtype: concurrent.futures.Future
+        """
+        return self._enqueue(("hook", repo_name, hook_id, organization), update)
+
+    def flush(self, timeout=None):
+        """
+        Sends every pending update, and waits until they have been sent.
+
+        :param float timeout: maximum number of seconds to wait
+        :return: whether every pending update was sent within ``timeout``
+        :rtype: bool
+        """
+        with self._condition:
+            futures = [f for (_, waiting) in self._pending.values() for f in waiting]
+            futures.extend(self._sending)
+            if self._pending:
+                self._flush_requested = True
+                self._condition.notify_all()
+        _, not_done = wait(futures, timeout=timeout)
+        return not not_done
+
+    def close(self):
+        """
+        Sends every pending update and stops the queue. Further updates are rejected.
+        """
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _enqueue(self, key, update):
+        future = Future()
+        with self._condition:
+            if self._closed:
+                raise RuntimeError("The write queue is closed")
+            if key in self._pending:
+                merged, waiting = self._pending[key]
+                self._pending[key] = (merged.merge(update), waiting + [future])
+            else:
+                if not self._pending:
+                    self._oldest = time.time()
+                self._pending[key] = (update, [future])
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="gitea-write-queue")
+                self._thread.daemon = True
+                self._thread.start()
+            self._condition.notify_all()
+        return future
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._pending and not self._closed:
+                    self._condition.wait()
+                if not self._pending:
+                    return
+                deadline = self._oldest + self._flush_interval
+                while not (self._closed or self._flush_requested
+                           or len(self._pending) >= self._max_pending):
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        break
+                    self._condition.wait(remaining)
+                batch = self._pending
+                self._pending = OrderedDict()
+                self._flush_requested = False
+                self._sending = [f for (_, waiting) in batch.values() for f in waiting]
+            self._send(batch)
+
+    def _send(self, batch):
+        for (key, (_, waiting)), result, exc in bounded_map(self._write, batch.items(),
+                                                            self._concurrency):
+            for future in waiting:
+                if exc is None:
+                    future.set_result(result)
+                else:
+                    future.set_exception(exc)
+
+    def _write(self, entry):
+        key, (update, _) = entry
+        if key[0] == "user":
+            return self._api.update_user(self._auth, key[1], update, only_changes=self._only_changes)
+        _, repo_name, hook_id, organization = key
+        return self._api.update_hook(self._auth, repo_name, hook_id, update,
+                                     organization=organization, only_changes=self._only_changes)
+
+
+def _team(team_id, _):
+    return "team", team_id
+
+
+def _repo(username, repo_name, *_):
+    return "repo", username, repo_name
+
+
+# operation -> (target of the operation, whether a 404 means it was already applied)
+_MUTATIONS = {
+    "add_team_membership": (_team, False),
+    "remove_team_membership": (_team, True),
+    "add_repo_to_team": (_team, False),
+    "remove_repo_from_team": (_team, True),
+    "delete_repo": (_repo, True),
+    "delete_hook": (_repo, True),
+}
+
+
+class MutationHandle(object):
+    """
+    The status of an operation queued in a :class:`~MutationQueue`
+    """
+
+    PENDING = "pending"
+    DONE = "done"
+    FAILED = "failed"
+
+    def __init__(self, mutation_id, operation, args):
+        self._id = mutation_id
+        self._operation = operation
+        self._args = tuple(args)
+        self._status = MutationHandle.PENDING
+        self._error = None
+        self._finished = threading.Event()
+
+    @property
+    def id(self):
+        """
+        Identifies the operation, also across restarts of the queue
+
+        :type: str
+        """
+        return self._id
+
+    @property
+    def operation(self):
+        """
+        Name of the :class:`~gitea_client.GiteaApi` method applying the operation
+
+        :type: str
+        """
+        return self._operation
+
+    @property
+    def args(self):
+        """
+        Arguments of the operation, excluding authentication
+
+        :type: tuple
+        """
+        return self._args
+
+    @property
+    def status(self):
+        """
+        One of :data:`PENDING`, :data:`DONE` and :data:`FAILED`
+
+        :type: str
+        """
+        return self._status
+
+    @property
+    def error(self):
+        """
+        Description of the failure, if the operation failed
+
+        :type: str
+        """
+        return self._error
+
+    def wait(self, timeout=None):
+        """
+        Waits until the operation has been applied or has failed.
+
+        :param float timeout: maximum number of seconds to wait
+        :return: whether the operation is no longer pending
+        :rtype: bool
+        """
+        return self._finished.wait(timeout)
+
+    def _finish(self, status, error=None):
+        self._status = status
+        self._error = error
+        self._finished.set()
+
+
+class MutationQueue(object):
+    """
+    A durable queue of fire-and-forget operations (team membership and team
+    repository changes, repository and hook deletions), applied by background workers.
+
+    Every operation is recorded in a journal before it is queued, so operations
+    that were still pending when the process stopped are applied again when a
+    queue is next opened on the same journal. Operations on the same team, or on the
+    same repository (including its hooks), are applied one at a time in the order
+    they were queued. Transient failures are retried with exponential backoff;
+    deletions of things that no longer exist count as applied.
+    """
+
+    #: Number of finished operations whose handles :meth:`handle` still returns
+    FINISHED_HANDLES = 10000
+
+    def __init__(self, api, auth, journal_path, workers=4, retries=5, backoff=1.0, sync=True):
+        """
+        :param GiteaApi api: client to apply operations with
+        :param auth.Authentication auth: authentication object, must be admin-level.
+                                         Never written to the journal
+        :param str journal_path: location of the journal file
+        :param int workers: number of background threads applying operations
+        :param int retries: maximum number of retries per operation
+        :param float backoff: seconds to wait before an operation's first retry
+        :param bool sync: whether to ``fsync`` the journal after every record, so that
+                          queued operations survive a power loss
+        """
+        self._api = api
+        self._auth = auth
+        self._retries = retries
+        self._backoff = backoff
+        self._journal = Journal(journal_path, sync=sync)
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+        self._handles = OrderedDict()
+        self._finished = OrderedDict()
+        self._targets = {}
+        self._ready = Queue()
+        self._closed = False
+
+        pending = OrderedDict()
+        for record in self._journal.replay():
+            if record["state"] == "queued":
+                pending[record["id"]] = record
+            else:
+                pending.pop(record["id"], None)
+        # drop finished operations, so the journal does not grow without bound
+        self._journal.rewrite(list(pending.values()))
+        for record in pending.values():
+            self._enqueue(MutationHandle(record["id"], record["op"], record["args"]))
+
+        self._workers = [threading.Thread(target=self._work, name="gitea-mutations-{}".format(i))
+                         for i in range(workers)]
+        for worker in self._workers:
+            worker.daemon = True
+            worker.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def submit(self, operation, *args):
+        """
+        Queues an operation, and returns once it is recorded in the journal.
+
+        :param str operation: one of ``"add_team_membership"``, ``"remove_team_membership"``,
+                              ``"add_repo_to_team"``, ``"remove_repo_from_team"``,
+                              ``"delete_repo"`` and ``"delete_hook"``
+        :param args: arguments of the corresponding :class:`~gitea_client.GiteaApi`
+                     method, excluding authentication; must be JSON-serializable
+        :return: handle to query the operation's status with
+        :rtype: MutationHandle
+        """
+        if operation not in _MUTATIONS:
+            raise ValueError("Unsupported operation: {}".format(operation))
+        target, _ = _MUTATIONS[operation]
+        target(*args)  # fails early on a wrong number of arguments
+        handle = MutationHandle(uuid.uuid4().hex, operation, args)
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("The mutation queue is closed")
+            self._journal.append({"id": handle.id, "state": "queued", "op": operation,
+                                  "args": list(args)})
+        self._enqueue(handle)
+        return handle
+
+    def add_team_membership(self, team_id, username):
+        """
+        Queues :meth:`GiteaApi.add_team_membership`
+
+        :rtype: MutationHandle
+        """
+        return self.submit("add_team_membership", team_id, username)
+
+    def remove_team_membership(self, team_id, username):
+        """
+        Queues :meth:`GiteaApi.remove_team_membership`
+
+        :rtype: MutationHandle
+        """
+        return self.submit("remove_team_membership", team_id, username)
+
+    def add_repo_to_team(self, team_id, repo_name):
+        """
+        Queues :meth:`GiteaApi.add_repo_to_team`
+
+        :rtype: MutationHandle
+        """
+        return self.submit("add_repo_to_team", team_id, repo_name)
+
+    def remove_repo_from_team(self, team_id, repo_name):
+        """
+        Queues :meth:`GiteaApi.remove_repo_from_team`
+
+        :rtype: MutationHandle
+        """
+        return self.submit("remove_repo_from_team", team_id, repo_name)
+
+    def delete_repo(self, username, repo_name):
+        """
+        Queues :meth:`GiteaApi.delete_repo`
+
+        :rtype: MutationHandle
+        """
+        return self.submit("delete_repo", username, repo_name)
+
+    def delete_hook(self, username, repo_name, hook_id):
+        """
+        Queues :meth:`GiteaApi.delete_hook`
+
+        :rtype: MutationHandle
+        """
+        return self.submit("delete_hook", username, repo_name, hook_id)
+
+    def handle(self, mutation_id):
+        """
+        Returns the handle of a pending operation, or of one of the last
+        ``MutationQueue.FINISHED_HANDLES`` operations that finished since this queue
+        was opened. Pending operations replayed from the journal are included.
+
+        :param str mutation_id: the operation's :data:`MutationHandle.id`
+        :return: the operation's handle, or ``None`` if it is not known
+        :rtype: MutationHandle
+        """
+        with self._lock:
+            return self._handles.get(mutation_id) or self._finished.get(mutation_id)
+
+    def pending(self):
+        """
+        :return: handles of the operations not applied yet, in the order they were queued
+        :rtype: List[MutationHandle]
+        """
+        with self._lock:
+            return list(self._handles.values())
+
+    def join(self, timeout=None):
+        """
+        Waits until every queued operation has been applied or has failed.
+
+        :param float timeout: maximum number of seconds to wait
+        :return: whether no operations are pending
+        :rtype: bool
+        """
+        with self._idle:
+            return self._idle.wait_for(lambda: not self._targets, timeout)
+
+    def close(self, drain=True):
+        """
+        Stops the workers. Operations still pending stay in the journal.
+
+        :param bool drain: whether to first wait until every queued operation has
+                           been applied or has failed
+        """
+        if drain:
+            self.join()
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+        for _ in self._workers:
+            self._ready.put(None)
+        for worker in self._workers:
+            worker.join()
+        self._journal.close()
+
+    def _enqueue(self, handle):
+        target, _ = _MUTATIONS[handle.operation]
+        key = target(*handle.args)
+        with self._lock:
+            self._handles[handle.id] = handle
+            operations = self._targets.get(key)
+            if operations is None:
+                self._targets[key] = deque([handle])
+                self._ready.put(key)
+            else:
+                operations.append(handle)
+
+    def _work(self):
+        while True:
+            key = self._ready.get()
+            if key is None:
+                return
+            with self._lock:
+                handle = self._targets[key][0]
+            if self._closed:
+                # not applied; the journal still lists the operation as queued
+                continue
+            self._apply(handle)
+            with self._lock:
+                operations = self._targets[key]
+                operations.popleft()
+                if operations:
+                    self._ready.put(key)
+                else:
+                    del self._targets[key]
+                    self._idle.notify_all()
+
+    def _apply(self, handle):
+        _, missing_ok = _MUTATIONS[handle.operation]
+        method = getattr(self._api, handle.operation)
+        try:
+            call_with_retries(lambda: method(self._auth, *handle.args), self._retries,
+                              backoff=self._backoff)
+        except ApiFailure as exc:
+            if not (missing_ok and exc.status_code == 404):
+                self._finish(handle, MutationHandle.FAILED, str(exc))
+                return
+        except Exception as exc:
+            self._finish(handle, MutationHandle.FAILED, str(exc))
+            return
+        self._finish(handle, MutationHandle.DONE)
+
+    def _finish(self, handle, status, error=None):
+        record = {"id": handle.id, "state": status}
+        if error is not None:
+            record["error"] = error
+        self._journal.append(record)
+        with self._lock:
+            del self._handles[handle.id]
+            self._finished[handle.id] = handle
+            while len(self._finished) > self.FINISHED_HANDLES:
+                self._finished.popitem(last=False)
+        handle._finish(status, error)
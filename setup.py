@@ -20,7 +20,6 @@ setup(
     license="MIT",
     classifiers=[
         "License :: OSI Approved :: MIT License",
-        "Programming Language :: Python :: 2.7",
         'Programming Language :: Python :: 3',
         'Programming Language :: Python :: 3.3',
         'Programming Language :: Python :: 3.4',
@@ -28,6 +27,9 @@ setup(
     ],
     keywords=["gitea", "gogs", "http", "client"],
     packages=find_packages(),
-    install_requires=["future", "requests", "attrs"],
+    install_requires=["requests", "attrs"],
+    entry_points={
+        "console_scripts": ["gitea-client=gitea_client.cli:main"],
+    },
     test_suite="tests"
 )
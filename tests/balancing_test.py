@@ -0,0 +1,123 @@
+import json
+import socket
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+import gitea_client
+from gitea_client.balancing import MultiEndpointGiteaApi
+
+
+class StandInServer(ThreadingMixIn, HTTPServer):
+    """
+    A local stand-in for one Gitea frontend node, counting the requests it serves
+    """
+
+    daemon_threads = True
+
+    def __init__(self, status=200, delay=0):
+        HTTPServer.__init__(self, ("127.0.0.1", 0), StandInHandler)
+        self.status = status
+        self.delay = delay
+        self.requests = []
+        self.thread = threading.Thread(target=self.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    @property
+    def url(self):
+        return "http://127.0.0.1:{}/".format(self.server_address[1])
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def handle_error(self, request, client_address):
+        # clients that timed out have hung up before the answer is written
+        pass
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def handle_any(self):
+        self.server.requests.append((self.command, self.path))
+        length = int(self.headers.get("Content-Length") or 0)
+        self.rfile.read(length)
+        time.sleep(self.server.delay)
+        body = json.dumps({"id": 1, "username": "user", "full_name": ""}).encode()
+        self.send_response(self.server.status)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    do_GET = do_POST = do_PATCH = do_DELETE = handle_any
+
+    def log_message(self, format, *args):
+        pass
+
+
+def unused_url():
+    sock = socket.socket()
+    sock.bind(("127.0.0.1", 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return "http://127.0.0.1:{}/".format(port)
+
+
+class MultiEndpointGiteaApiTest(unittest.TestCase):
+    def setUp(self):
+        self.servers = []
+        self.token = gitea_client.Token("mytoken")
+
+    def tearDown(self):
+        for server in self.servers:
+            server.stop()
+
+    def server(self, status=200, delay=0):
+        server = StandInServer(status, delay)
+        self.servers.append(server)
+        return server
+
+    def test_reads_spread_and_writes_to_primary(self):
+        primary, replica1, replica2 = self.server(), self.server(), self.server()
+        client = MultiEndpointGiteaApi(primary.url, [replica1.url, replica2.url])
+        for _ in range(60):
+            self.assertEqual(client.get_user(self.token, "user").username, "user")
+        for server in (primary, replica1, replica2):
+            self.assertTrue(len(server.requests) > 0)
+        before = [len(server.requests) for server in (replica1, replica2)]
+        for _ in range(5):
+            client.delete_user(self.token, "user")
+        self.assertEqual([r for r in primary.requests if r[0] == "DELETE"],
+                         [("DELETE", "/api/v1/admin/users/user?token=mytoken")] * 5)
+        self.assertEqual([len(server.requests) for server in (replica1, replica2)], before)
+
+    def test_failed_endpoints_leave_rotation(self):
+        primary, broken = self.server(), self.server(status=503)
+        dead = unused_url()
+        client = MultiEndpointGiteaApi(primary.url, [broken.url, dead], cooldown=60)
+        for _ in range(20):
+            self.assertEqual(client.get_user(self.token, "user").username, "user")
+        self.assertEqual(client.healthy_endpoints(), [primary.url + "api/v1/"])
+        self.assertTrue(len(broken.requests) <= 1)
+
+    def test_slow_answer_keeps_endpoint(self):
+        slow = self.server(delay=0.5)
+        client = MultiEndpointGiteaApi(slow.url, [])
+        self.assertRaises(gitea_client.NetworkFailure, client.get, "/users/user", timeout=0.05)
+        self.assertEqual(client.healthy_endpoints(), [slow.url + "api/v1/"])
+
+    def test_session_rejected(self):
+        self.assertRaises(TypeError, MultiEndpointGiteaApi, "https://www.example.com/", [],
+                          session=object())
+
+    def test_all_endpoints_down(self):
+        client = MultiEndpointGiteaApi(unused_url(), [unused_url()])
+        self.assertRaises(gitea_client.NetworkFailure, client.get_user, self.token, "user")
+
+
+if __name__ == "__main__":
+    unittest.main()
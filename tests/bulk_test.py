@@ -0,0 +1,228 @@
+import base64
+import io
+import json
+import os
+import re
+import shutil
+import tempfile
+import threading
+import unittest
+
+import responses
+
+import gitea_client
+from gitea_client import bulk
+
+
+class FakeDeployKeys(object):
+    """
+    Keeps deploy keys for several repositories, serving them through ``responses``
+    """
+
+    def __init__(self, api_endpoint, keys, broken=()):
+        self.keys = keys  # (owner, repo) -> list of (id, key content)
+        self.broken = set(broken)  # repos that silently drop added keys
+        self.lock = threading.Lock()
+        self.next_id = 100
+        pattern = re.escape(api_endpoint) + r"repos/([^/]+)/([^/]+)/keys(?:/(\d+))?(?:\?.*)?$"
+        self.pattern = re.compile(pattern)
+        responses.add_callback(responses.GET, self.pattern, callback=self.list)
+        responses.add_callback(responses.POST, self.pattern, callback=self.add)
+        responses.add_callback(responses.DELETE, self.pattern, callback=self.delete)
+
+    def key_json(self, key_id, content):
+        return {"id": key_id, "key": content, "url": "", "title": "t",
+                "created_at": "2017-01-01T00:00:00Z", "read_only": True}
+
+    def list(self, request):
+        owner, repo, _ = self.pattern.match(request.url).groups()
+        with self.lock:
+            body = [self.key_json(i, c) for (i, c) in self.keys[(owner, repo)]]
+        return 200, {}, json.dumps(body)
+
+    def add(self, request):
+        owner, repo, _ = self.pattern.match(request.url).groups()
+        content = json.loads(request.body.decode("utf8"))["key"]
+        with self.lock:
+            self.next_id += 1
+            if (owner, repo) not in self.broken:
+                self.keys[(owner, repo)].append((self.next_id, content))
+            body = self.key_json(self.next_id, content)
+        return 201, {}, json.dumps(body)
+
+    def delete(self, request):
+        owner, repo, key_id = self.pattern.match(request.url).groups()
+        with self.lock:
+            self.keys[(owner, repo)] = [(i, c) for (i, c) in self.keys[(owner, repo)]
+                                        if i != int(key_id)]
+        return 204, {}, ""
+
+
+class BulkTest(unittest.TestCase):
+    def setUp(self):
+        self.api_endpoint = "https://www.example.com/api/v1/"
+        self.client = gitea_client.GiteaApi("https://www.example.com/")
+        self.token = gitea_client.Token("mytoken")
+        self.old_key = "ssh-ed25519 " + base64.b64encode(b"old key").decode() + " old"
+        self.new_key = "ssh-ed25519 " + base64.b64encode(b"new key").decode() + " new"
+        self.other_key = "ssh-ed25519 " + base64.b64encode(b"other key").decode()
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_key_fingerprint(self):
+        fingerprint = bulk.key_fingerprint(self.old_key)
+        self.assertTrue(fingerprint.startswith("SHA256:"))
+        self.assertFalse(fingerprint.endswith("="))
+        self.assertEqual(fingerprint, bulk.key_fingerprint(self.old_key.replace(" old", "")))
+        self.assertRaises(ValueError, bulk.key_fingerprint, "not a key")
+
+    @responses.activate
+    def test_rotate_deploy_key(self):
+        repos = [("user{}".format(i), "repo{}".format(i)) for i in range(20)]
+        fake = FakeDeployKeys(self.api_endpoint, {
+            repo: [(1, self.old_key), (2, self.other_key)] for repo in repos})
+        fake.keys[repos[0]] = [(1, self.new_key)]
+        result = bulk.rotate_deploy_key(self.client, self.token, repos,
+                                        bulk.key_fingerprint(self.old_key),
+                                        self.new_key, "new", concurrency=4)
+        self.assertEqual(sorted(result.rotated), sorted(repos))
+        self.assertEqual(result.failed, {})
+        for repo in repos[1:]:
+            contents = [c for (_, c) in fake.keys[repo]]
+            self.assertEqual(sorted(contents), sorted([self.other_key, self.new_key]))
+        self.assertEqual(fake.keys[repos[0]], [(1, self.new_key)])
+
+    @responses.activate
+    def test_rotate_deploy_key_keeps_old_key_on_failure(self):
+        repos = [("user", "good"), ("user", "bad")]
+        fake = FakeDeployKeys(self.api_endpoint, {repo: [(1, self.old_key)] for repo in repos},
+                              broken=[("user", "bad")])
+        result = bulk.rotate_deploy_key(self.client, self.token, repos,
+                                        bulk.key_fingerprint(self.old_key),
+                                        self.new_key, "new")
+        self.assertEqual(result.rotated, [("user", "good")])
+        self.assertIsInstance(result.failed[("user", "bad")], bulk.KeyRotationFailure)
+        self.assertEqual(fake.keys[("user", "bad")], [(1, self.old_key)])
+
+    @responses.activate
+    def test_rotate_deploy_key_resumes_from_journal(self):
+        repos = [("user", "repo1"), ("user", "repo2")]
+        FakeDeployKeys(self.api_endpoint, {repo: [(1, self.old_key)] for repo in repos})
+        journal_path = os.path.join(self.tmpdir, "rotation.jsonl")
+        old_fingerprint = bulk.key_fingerprint(self.old_key)
+        bulk.rotate_deploy_key(self.client, self.token, repos[:1], old_fingerprint,
+                               self.new_key, "new", journal_path=journal_path)
+        calls = len(responses.calls)
+        result = bulk.rotate_deploy_key(self.client, self.token, repos, old_fingerprint,
+                                        self.new_key, "new", journal_path=journal_path)
+        self.assertEqual(result.resumed, [("user", "repo1")])
+        self.assertEqual(result.rotated, [("user", "repo2")])
+        for call in responses.calls[calls:]:
+            self.assertNotIn("/repo1/", call.request.url)
+
+    def test_diff_branch_heads(self):
+        old = {("u", "r", "master"): "a", ("u", "r", "dev"): "b", ("u", "r", "gone"): "c"}
+        new = {("u", "r", "master"): "a", ("u", "r", "dev"): "d", ("u", "r", "new"): "e"}
+        changes = bulk.diff_branch_heads(old, new)
+        self.assertEqual(changes.created, {("u", "r", "new"): "e"})
+        self.assertEqual(changes.moved, {("u", "r", "dev"): ("b", "d")})
+        self.assertEqual(changes.deleted, {("u", "r", "gone"): "c"})
+        self.assertTrue(changes)
+        self.assertFalse(bulk.diff_branch_heads(new, new))
+
+    def test_read_user_records(self):
+        source = io.StringIO(u"username,email,password,admin,website,full_name\n"
+                             u"alice,a@example.com,True,TRUE,,false\n")
+        self.assertEqual(list(bulk.read_user_records(source)), [
+            {"username": "alice", "email": "a@example.com", "password": "True", "admin": True,
+             "full_name": "false"}])
+        source = io.StringIO(u'{"username": "bob"}\n\n')
+        self.assertEqual(list(bulk.read_user_records(source, format="jsonl")), [{"username": "bob"}])
+
+    @responses.activate
+    def test_import_users(self):
+        responses.add(responses.HEAD, re.compile(self.api_endpoint + "users/existing"), status=200)
+        responses.add(responses.HEAD, re.compile(self.api_endpoint + "users/.*"), status=404)
+
+        def create(request):
+            username = json.loads(request.body.decode("utf8"))["username"]
+            if username == "racer":
+                return 422, {}, json.dumps({"message": "user already exists"})
+            if username == "broken":
+                return 500, {}, ""
+            return 201, {}, json.dumps({"id": 1, "username": username, "full_name": ""})
+
+        updates = []
+
+        def update(request):
+            updates.append(json.loads(request.body.decode("utf8")))
+            return 200, {}, json.dumps({"id": 1, "username": "plain", "full_name": "Plain"})
+
+        responses.add_callback(responses.POST, re.compile(self.api_endpoint + "admin/users"),
+                               callback=create)
+        responses.add_callback(responses.PATCH, re.compile(self.api_endpoint + "admin/users/.*"),
+                               callback=update)
+        records = [
+            {"username": "plain", "email": "p@example.com", "password": "pw", "full_name": "Plain"},
+            {"username": "existing", "email": "e@example.com", "password": "pw"},
+            {"username": "racer", "email": "r@example.com", "password": "pw"},
+            {"username": "broken", "email": "b@example.com", "password": "pw"},
+        ]
+        results = io.StringIO()
+        counts = bulk.import_users(self.client, self.token, records, results, concurrency=2)
+        self.assertEqual(counts, {"created": 1, "updated": 0, "exists": 2, "failed": 1})
+        lines = {line["username"]: line for line in
+                 (json.loads(text) for text in results.getvalue().splitlines())}
+        self.assertEqual(lines["plain"], {"username": "plain", "status": "created"})
+        self.assertEqual(lines["racer"]["status"], "exists")
+        self.assertIn("500", lines["broken"]["error"])
+        self.assertEqual(updates, [{"login_name": "plain", "email": "p@example.com",
+                                    "full_name": "Plain"}])
+
+    @responses.activate
+    def test_import_users_streams(self):
+        responses.add(responses.HEAD, re.compile(self.api_endpoint + "users/.*"), status=200)
+        consumed = [0]
+        concurrency = 4
+
+        def records():
+            for i in range(200):
+                consumed[0] += 1
+                yield {"username": "user{}".format(i), "email": "", "password": ""}
+
+        class Results(io.StringIO):
+            lines = 0
+
+            def write(inner, line):
+                inner.lines += 1
+                self.assertLessEqual(consumed[0] - inner.lines, 2 * concurrency)
+
+        counts = bulk.import_users(self.client, self.token, records(), Results(),
+                                   concurrency=concurrency)
+        self.assertEqual(counts["exists"], 200)
+
+    @responses.activate
+    def test_import_users_completes_profile_on_rerun(self):
+        responses.add(responses.HEAD, self.api_endpoint + "users/alice", status=404)
+        responses.add(responses.HEAD, self.api_endpoint + "users/alice", status=200)
+        responses.add(responses.POST, self.api_endpoint + "admin/users", status=201,
+                      json={"id": 1, "username": "alice", "full_name": ""})
+        responses.add(responses.PATCH, self.api_endpoint + "admin/users/alice", status=500)
+        responses.add(responses.PATCH, self.api_endpoint + "admin/users/alice",
+                      json={"id": 1, "username": "alice", "full_name": "Alice"})
+        responses.add(responses.GET, self.api_endpoint + "users/alice",
+                      json={"id": 1, "username": "alice", "full_name": "", "email": "a@example.com"})
+        record = {"username": "alice", "email": "a@example.com", "password": "pw",
+                  "full_name": "Alice"}
+        counts = bulk.import_users(self.client, self.token, [record], io.StringIO())
+        self.assertEqual(counts["failed"], 1)
+        counts = bulk.import_users(self.client, self.token, [record], io.StringIO())
+        self.assertEqual(counts["updated"], 1)
+        self.assertEqual(json.loads(responses.calls[-1].request.body.decode("utf8")),
+                         {"login_name": "alice", "email": "a@example.com", "full_name": "Alice"})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,186 @@
+import json
+import multiprocessing
+import os
+import pickle
+import shutil
+import tempfile
+import time
+import unittest
+
+import responses
+
+import gitea_client
+from gitea_client.cache import DiskCache
+from gitea_client.webhooks import GiteaWebhookEvent
+
+
+def _store_in_child(cache, url):
+    cache.put(url, cache.identity("child"), 200, {"Content-Type": "application/json"}, b'{"from": "child"}')
+
+
+class DiskCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "responses.db")
+        self.base_url = "https://www.example.com/"
+        self.api_endpoint = "https://www.example.com/api/v1/"
+        self.user_json = {"id": 1, "username": "user", "full_name": "User"}
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    @responses.activate
+    def test_shared_between_clients(self):
+        responses.add(responses.GET, self.api_endpoint + "users/user", json=self.user_json)
+        first = gitea_client.GiteaApi(self.base_url, disk_cache=DiskCache(self.path))
+        second = gitea_client.GiteaApi(self.base_url, disk_cache=DiskCache(self.path))
+        token = gitea_client.Token("secret-token")
+        self.assertEqual(first.get_user(token, "user").username, "user")
+        self.assertEqual(second.get_user(token, "user").username, "user")
+        self.assertEqual(len(responses.calls), 1)
+
+        # other credentials do not see the cached response
+        second.get_user(gitea_client.Token("other-token"), "user")
+        second.get_user(gitea_client.UsernamePassword("user", "password"), "user")
+        self.assertEqual(len(responses.calls), 3)
+        with open(self.path, "rb") as f:
+            self.assertNotIn(b"secret-token", f.read())
+
+    @responses.activate
+    def test_revalidated_with_etag(self):
+        uri = self.api_endpoint + "users/user"
+        responses.add(responses.GET, uri, json=self.user_json, headers={"ETag": '"v1"'})
+        responses.add(responses.GET, uri, status=304)
+        client = gitea_client.GiteaApi(self.base_url, disk_cache=DiskCache(self.path, ttl=0))
+        token = gitea_client.Token("mytoken")
+        client.get_user(token, "user")
+        self.assertEqual(client.get_user(token, "user").username, "user")
+        self.assertEqual(len(responses.calls), 2)
+        self.assertEqual(responses.calls[1].request.headers["If-None-Match"], '"v1"')
+
+    @responses.activate
+    def test_invalidation_and_errors(self):
+        repo_uri = self.api_endpoint + "repos/user/repo/branches"
+        responses.add(responses.GET, repo_uri, json=[])
+        responses.add(responses.GET, self.api_endpoint + "users/missing", status=404)
+        client = gitea_client.GiteaApi(self.base_url, disk_cache=DiskCache(self.path))
+        token = gitea_client.Token("mytoken")
+        for _ in range(2):
+            client.get_branches(token, "user", "repo")
+            self.assertRaises(gitea_client.ApiFailure, client.get_user, token, "missing")
+        self.assertEqual(len(responses.calls), 3)
+        client.invalidate_repo("user", "repo")
+        client.get_branches(token, "user", "repo")
+        self.assertEqual(len(responses.calls), 4)
+
+    @responses.activate
+    def test_invalidation_by_event(self):
+        responses.add(responses.GET, self.api_endpoint + "repos/User/Repo/branches", json=[])
+        responses.add(responses.GET, self.api_endpoint + "users/user", json=self.user_json)
+        responses.add(responses.GET, self.api_endpoint + "orgs/acme",
+                      json={"id": 2, "username": "acme", "full_name": "Acme", "avatar_url": "",
+                            "description": "", "website": "", "location": ""})
+        client = gitea_client.GiteaApi(self.base_url, disk_cache=DiskCache(self.path))
+        token = gitea_client.Token("mytoken")
+
+        def fetch():
+            client.get_branches(token, "User", "Repo")
+            client.get_user(token, "user")
+            client.get_organization(token, "acme")
+
+        fetch()
+        # names are case-insensitive, and events without a repository only drop their organization
+        client.invalidate_repo("user", "repo")
+        client.invalidate_for_event(GiteaWebhookEvent.from_json(
+            {"organization": {"id": 2, "login": "acme"}}))
+        fetch()
+        requested = [c.request.url.replace(self.api_endpoint, "").split("?")[0] for c in responses.calls]
+        self.assertEqual(requested, ["repos/User/Repo/branches", "users/user", "orgs/acme",
+                                     "repos/User/Repo/branches", "orgs/acme"])
+
+    @responses.activate
+    def test_mutations_discard_entries(self):
+        state = dict(self.user_json, email="user@example.com")
+
+        def patch(request):
+            state.update(json.loads(request.body.decode("utf-8")))
+            return 200, {}, json.dumps(state)
+
+        responses.add_callback(responses.GET, self.api_endpoint + "users/user",
+                               callback=lambda request: (200, {}, json.dumps(state)))
+        responses.add_callback(responses.PATCH, self.api_endpoint + "admin/users/user", callback=patch)
+        client = gitea_client.GiteaApi(self.base_url, disk_cache=DiskCache(self.path))
+        token = gitea_client.Token("mytoken")
+        self.assertEqual(client.get_user(token, "user").full_name, "User")
+        for full_name in ("New", "User"):
+            update = gitea_client.GiteaUserUpdate.Builder("user", "user@example.com") \
+                .set_full_name(full_name) \
+                .build()
+            client.update_user(token, "user", update, only_changes=True)
+        self.assertEqual(state["full_name"], "User")
+        self.assertEqual(len([c for c in responses.calls if c.request.method == "PATCH"]), 2)
+        self.assertEqual(client.get_user(token, "user").full_name, "User")
+
+    @responses.activate
+    def test_warm_up_bypasses_cache(self):
+        responses.add(responses.GET, self.api_endpoint + "version", json={"version": "1.0"})
+        client = gitea_client.GiteaApi(self.base_url, disk_cache=DiskCache(self.path), pool_size=2)
+        client.get("/version")
+        self.assertTrue(client.warm_up().reachable)
+        self.assertEqual(len(responses.calls), 3)
+
+    @responses.activate
+    def test_unusable_database(self):
+        responses.add(responses.GET, self.api_endpoint + "users/user", json=self.user_json)
+        responses.add(responses.DELETE, self.api_endpoint + "repos/user/repo", status=204)
+        cache = DiskCache(os.path.join(self.directory, "missing", "responses.db"))
+        client = gitea_client.GiteaApi(self.base_url, disk_cache=cache)
+        token = gitea_client.Token("mytoken")
+        with self.assertLogs("gitea_client.cache", "WARNING"):
+            self.assertEqual(client.get_user(token, "user").username, "user")
+            client.delete_repo(token, "user", "repo")
+            client.invalidate_all()
+            self.assertEqual(len(cache), 0)
+
+    def test_eviction(self):
+        cache = DiskCache(self.path, max_bytes=2000)
+        identity = cache.identity("token")
+        for i in range(10):
+            cache.put("https://www.example.com/{}".format(i), identity, 200, {}, b"x" * 400)
+            time.sleep(0.01)
+        self.assertLess(len(cache), 5)
+        self.assertIsNone(cache.get("https://www.example.com/0", identity))
+        self.assertIsNotNone(cache.get("https://www.example.com/9", identity))
+
+    def test_eviction_tracks_replaced_and_removed_responses(self):
+        cache = DiskCache(self.path, max_bytes=2000)
+        identity = cache.identity("token")
+        cache.put("https://www.example.com/kept", identity, 200, {}, b"x" * 400)
+        for _ in range(10):
+            cache.put("https://www.example.com/replaced", identity, 200, {}, b"x" * 400)
+        for i in range(10):
+            cache.put("https://www.example.com/removed/{}".format(i), identity, 200, {}, b"x" * 50)
+        cache.discard_prefix("https://www.example.com/removed")
+        cache.put("https://www.example.com/other", identity, 200, {}, b"x" * 400)
+        self.assertEqual(len(cache), 3)
+        cache.clear()
+        for i in range(4):
+            cache.put("https://www.example.com/{}".format(i), identity, 200, {}, b"x" * 400)
+        self.assertEqual(len(cache), 4)
+
+    def test_shared_between_processes(self):
+        cache = DiskCache(self.path)
+        cache.put("https://www.example.com/parent", cache.identity("parent"), 200, {}, b"{}")
+        url = "https://www.example.com/child"
+        process = multiprocessing.Process(target=_store_in_child, args=(pickle.loads(pickle.dumps(cache)), url))
+        process.start()
+        process.join(30)
+        self.assertEqual(process.exitcode, 0)
+        cached = cache.get(url, cache.identity("child"))
+        self.assertEqual(json.loads(cached.body.decode("utf-8")), {"from": "child"})
+        self.assertTrue(cached.fresh)
+        self.assertIsNone(cache.get(url, cache.identity("parent")))
+
+
+if __name__ == "__main__":
+    unittest.main()
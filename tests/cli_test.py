@@ -0,0 +1,76 @@
+import io
+import json
+import tempfile
+import unittest
+from unittest import mock
+
+import responses
+
+from gitea_client import cli
+
+
+class CliTest(unittest.TestCase):
+    def setUp(self):
+        self.api_endpoint = "https://www.example.com/api/v1/"
+        self.args = ["--url", "https://www.example.com/", "--token", "mytoken"]
+
+    def run_cli(self, argv, stdin=""):
+        out = io.StringIO()
+        with mock.patch("sys.stdin", io.StringIO(stdin)), mock.patch("sys.stdout", out):
+            status = cli.main(self.args + argv)
+        lines = [json.loads(line) for line in out.getvalue().splitlines()]
+        return status, sorted(lines, key=lambda line: line["line"])
+
+    @responses.activate
+    def test_repo_exists(self):
+        responses.add(responses.HEAD, self.api_endpoint + "repos/user/a", status=200)
+        responses.add(responses.HEAD, self.api_endpoint + "repos/user/b", status=404)
+        stdin = ('{"username": "user", "repo_name": "a"}\n'
+                 '\n'
+                 '{"username": "user", "repo_name": "b"}\n')
+        status, lines = self.run_cli(["--concurrency", "2", "repo", "exists"], stdin)
+        self.assertEqual(status, 0)
+        self.assertEqual([(line["line"], line["status"], line["result"]) for line in lines],
+                         [(1, "ok", True), (3, "ok", False)])
+        self.assertEqual(lines[0]["input"], {"username": "user", "repo_name": "a"})
+
+    @responses.activate
+    def test_team_add_member_failures(self):
+        responses.add(responses.PUT, self.api_endpoint + "admin/teams/1/members/user", status=204)
+        responses.add(responses.PUT, self.api_endpoint + "admin/teams/2/members/user", status=404)
+        stdin = ('{"team_id": 1, "username": "user"}\n'
+                 '{"team_id": 2, "username": "user"}\n'
+                 '{"team": 3}\n'
+                 'not json\n')
+        status, lines = self.run_cli(["team", "add-member"], stdin)
+        self.assertEqual(status, 1)
+        self.assertEqual([line["status"] for line in lines], ["ok", "failed", "failed", "failed"])
+        self.assertIn("404", lines[1]["error"])
+        self.assertIn("Invalid target", lines[2]["error"])
+        self.assertEqual(lines[3]["input"], "not json")
+
+    @responses.activate
+    def test_repo_create_from_file(self):
+        responses.add(responses.POST, self.api_endpoint + "user/repos", status=201, json={
+            "id": 1, "name": "notes", "full_name": "user/notes", "private": True, "fork": False,
+            "default_branch": "master", "html_url": "", "ssh_url": "", "clone_url": "",
+            "owner": {"id": 2, "username": "user", "full_name": ""}, "permissions": {}})
+        with tempfile.NamedTemporaryFile("w", suffix=".jsonl") as targets:
+            targets.write('{"name": "notes", "private": true}\n')
+            targets.flush()
+            status, lines = self.run_cli(["--input", targets.name, "repo", "create"])
+        self.assertEqual(status, 0)
+        self.assertEqual(lines[0]["result"]["full_name"], "user/notes")
+        self.assertNotIn("json", lines[0]["result"]["owner"])
+        body = json.loads(responses.calls[0].request.body.decode("utf8"))
+        self.assertEqual((body["name"], body["private"]), ("notes", True))
+
+    def test_usage_errors(self):
+        with mock.patch("sys.stderr", io.StringIO()):
+            self.assertRaises(SystemExit, cli.main, ["--url", "https://www.example.com/",
+                                                     "repo", "exists"])
+            self.assertRaises(SystemExit, cli.main, self.args + ["repo", "rename"])
+
+
+if __name__ == "__main__":
+    unittest.main()
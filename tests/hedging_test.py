@@ -0,0 +1,96 @@
+import json
+import pickle
+import threading
+import time
+import unittest
+
+import responses
+
+import gitea_client
+from gitea_client.hedging import HedgePolicy
+
+
+class HedgingTest(unittest.TestCase):
+    def setUp(self):
+        self.api_endpoint = "https://www.example.com/api/v1/"
+        self.base_url = "https://www.example.com/"
+        self.user_json = {"id": 1, "username": "user", "full_name": "User"}
+        self.calls = 0
+        self.calls_lock = threading.Lock()
+        self.slow_done = threading.Event()
+
+    def client(self, **kwargs):
+        return gitea_client.GiteaApi(self.base_url, hedging=HedgePolicy(**kwargs))
+
+    def slow_then_fast(self, delay):
+        def callback(request):
+            with self.calls_lock:
+                self.calls += 1
+                first = self.calls == 1
+            if first:
+                time.sleep(delay)
+                self.slow_done.set()
+            return 200, {}, json.dumps(self.user_json)
+        return callback
+
+    @responses.activate
+    def test_slow_request_hedged(self):
+        responses.add_callback(responses.GET, self.api_endpoint + "users/user",
+                               callback=self.slow_then_fast(1.0))
+        client = self.client(initial_delay=0.05, budget=1.0)
+        start = time.time()
+        self.assertEqual(client.get_user(None, "user").username, "user")
+        self.assertLess(time.time() - start, 0.9)
+        stats = client.hedge_stats()
+        self.assertEqual((stats.requests, stats.hedged, stats.hedge_wins), (1, 1, 1))
+        # let the slow attempt finish while its responses mock is still active
+        self.assertTrue(self.slow_done.wait(5))
+
+    @responses.activate
+    def test_queueing_not_hedged(self):
+        responses.add(responses.GET, self.api_endpoint + "users/user", json=self.user_json)
+        client = gitea_client.GiteaApi(self.base_url, pool_size=1,
+                                       hedging=HedgePolicy(initial_delay=0.1, budget=1.0))
+        for _ in range(2):
+            client._hedger._executor.submit(time.sleep, 0.3)
+        self.assertEqual(client.get_user(None, "user").username, "user")
+        self.assertEqual(client.hedge_stats().hedged, 0)
+
+    @responses.activate
+    def test_budget(self):
+        responses.add_callback(responses.GET, self.api_endpoint + "users/user",
+                               callback=self.slow_then_fast(0.2))
+        client = self.client(initial_delay=0.05, budget=0.0)
+        self.assertEqual(client.get_user(None, "user").username, "user")
+        stats = client.hedge_stats()
+        self.assertEqual((stats.hedged, stats.over_budget), (0, 1))
+        self.assertEqual(self.calls, 1)
+
+    @responses.activate
+    def test_fast_requests_not_hedged(self):
+        responses.add(responses.GET, self.api_endpoint + "users/user", json=self.user_json)
+        client = self.client(min_samples=8)
+        for _ in range(32):
+            client.get_user(None, "user")
+        stats = client.hedge_stats()
+        self.assertEqual((stats.requests, stats.hedged), (32, 0))
+        self.assertLess(stats.delay, 0.5)
+
+    @responses.activate
+    def test_failures(self):
+        responses.add(responses.GET, self.api_endpoint + "users/user", status=404)
+        client = self.client()
+        self.assertRaises(gitea_client.ApiFailure, client.get_user, None, "user")
+        self.assertRaises(gitea_client.NetworkFailure, client.get_user, None, "other")
+
+    def test_disabled(self):
+        self.assertIsNone(gitea_client.GiteaApi(self.base_url).hedge_stats())
+
+    def test_pickle(self):
+        client = pickle.loads(pickle.dumps(self.client(budget=0.1)))
+        self.assertEqual(client.hedge_stats().requests, 0)
+        self.assertEqual(client._config["hedging"], HedgePolicy(budget=0.1))
+
+
+if __name__ == "__main__":
+    unittest.main()
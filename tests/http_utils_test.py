@@ -1,4 +1,11 @@
+import os
+import pickle
+import threading
 import unittest
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+import requests
 
 import gitea_client._implementation.http_utils as http_utils
 
@@ -39,6 +46,99 @@ class HttpUtilsTest(unittest.TestCase):
         self.assertEqual(requestor.absolute_url(path),
                          "https://hello.org/dir1/dir2/dir3/file.txt")
 
+    def test_per_thread_sessions(self):
+        requestor = http_utils.RelativeHttpRequestor("https://www.google.com/", pool_size=4)
+        sessions = []
+        thread = threading.Thread(target=lambda: sessions.append(requestor.session))
+        thread.start()
+        thread.join()
+        self.assertIs(requestor.session, requestor.session)
+        self.assertIsNot(requestor.session, sessions[0])
+        self.assertIs(requestor.session.get_adapter("https://www.google.com/"),
+                      sessions[0].get_adapter("https://www.google.com/"))
+
+    def test_supplied_session(self):
+        session = requests.Session()
+        requestor = http_utils.RelativeHttpRequestor("https://www.google.com/", session=session)
+        sessions = []
+        thread = threading.Thread(target=lambda: sessions.append(requestor.session))
+        thread.start()
+        thread.join()
+        self.assertIs(requestor.session, session)
+        self.assertIs(sessions[0], session)
+
+    def test_pickle(self):
+        requestor = http_utils.RelativeHttpRequestor("https://www.google.com/", pool_size=3,
+                                                     max_retries=2)
+        session = requestor.session
+        copy = pickle.loads(pickle.dumps(requestor))
+        self.assertEqual(copy.base_url, "https://www.google.com/")
+        self.assertEqual((copy.pool_size, copy.max_retries), (3, 2))
+        self.assertIsNot(copy.session, session)
+        adapter = copy.session.get_adapter("https://www.google.com/")
+        self.assertEqual(adapter.max_retries.total, 2)
+
+    @unittest.skipUnless(hasattr(os, "fork"), "requires fork")
+    def test_fork_discards_connections(self):
+        requestor = http_utils.RelativeHttpRequestor("https://www.google.com/")
+        parent_adapter = requestor.session.get_adapter("https://www.google.com/")
+        pid = os.fork()
+        if pid == 0:
+            child_adapter = requestor.session.get_adapter("https://www.google.com/")
+            os._exit(0 if child_adapter is not parent_adapter else 1)
+        _, status = os.waitpid(pid, 0)
+        self.assertEqual(status, 0)
+        self.assertIs(requestor.session.get_adapter("https://www.google.com/"), parent_adapter)
+
+    def test_warm_up(self):
+        server = _VersionServer()
+        try:
+            requestor = http_utils.RelativeHttpRequestor(server.url, pool_size=4)
+            results = requestor.warm_up(6)
+            self.assertEqual(len(results), 4)
+            self.assertTrue(all(isinstance(rtt, float) for rtt in results))
+            self.assertEqual(len(server.clients), 4)
+            for _ in range(8):
+                requestor.get("/version").content
+            self.assertEqual(len(server.clients), 4)
+        finally:
+            server.shutdown()
+            server.server_close()
+
+    def test_warm_up_unreachable(self):
+        server = _VersionServer()
+        server.server_close()
+        requestor = http_utils.RelativeHttpRequestor(server.url)
+        results = requestor.warm_up(2, timeout=1)
+        self.assertTrue(all(isinstance(r, requests.ConnectionError) for r in results))
+
+
+class _VersionServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def __init__(self):
+        HTTPServer.__init__(self, ("127.0.0.1", 0), _VersionHandler)
+        self.clients = set()
+        self.url = "http://127.0.0.1:{}/api/v1/".format(self.server_address[1])
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+
+class _VersionHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        self.server.clients.add(self.client_address)
+        body = b'{"version": "1.0"}'
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,39 @@
+import subprocess
+import sys
+import unittest
+
+
+def run_python(code):
+    return subprocess.check_output([sys.executable, "-c", code]).decode("utf-8").strip()
+
+
+@unittest.skipIf(sys.version_info < (3, 7), "lazy loading requires Python 3.7")
+class ImportTest(unittest.TestCase):
+    def test_import_is_lazy(self):
+        loaded = run_python("import sys, gitea_client\n"
+                            "print(sorted(m for m in ('requests', 'attr', 'future', 'gitea_client.entities',"
+                            " 'gitea_client.interface') if m in sys.modules))")
+        self.assertEqual(loaded, "[]")
+
+    def test_exports_load_on_use(self):
+        loaded = run_python("import sys, gitea_client\n"
+                            "from gitea_client import GiteaApi, Token\n"
+                            "print(GiteaApi.__module__, Token.__module__, 'requests' in sys.modules)")
+        self.assertEqual(loaded, "gitea_client.interface gitea_client.auth True")
+
+    def test_import_time(self):
+        # -X importtime reports the cumulative import time of each module in microseconds
+        output = subprocess.check_output([sys.executable, "-X", "importtime", "-c", "import gitea_client"],
+                                         stderr=subprocess.STDOUT).decode("utf-8")
+        times = {line.split("|")[2].strip(): int(line.split("|")[1]) for line in output.splitlines()
+                 if line.startswith("import time:") and line.split("|")[1].strip().isdigit()}
+        self.assertLess(times["gitea_client"], 50000)
+
+    def test_unknown_attribute(self):
+        import gitea_client
+        self.assertRaises(AttributeError, getattr, gitea_client, "NoSuchName")
+        self.assertIn("GiteaApi", dir(gitea_client))
+
+
+if __name__ == "__main__":
+    unittest.main()
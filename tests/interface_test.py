@@ -1,12 +1,17 @@
 import base64
 import json
+import pickle
+import threading
 import unittest
+from urllib.parse import parse_qs
 
+import requests
 import responses
-from future.moves.urllib.parse import parse_qs
 
 import gitea_client
 import gitea_client._implementation.http_utils as http_utils
+from gitea_client._implementation.retry import call_with_retries
+import gitea_client.webhooks
 
 
 class GiteaClientInterfaceTest(unittest.TestCase):
@@ -289,8 +294,8 @@ class GiteaClientInterfaceTest(unittest.TestCase):
     def test_repo_exists1(self):
         uri1 = self.path("/repos/username/repo1")
         uri2 = self.path("/repos/username/repo2")
-        responses.add(responses.GET, uri1, body=self.repo_json_str, status=200)
-        responses.add(responses.GET, uri2, status=404)
+        responses.add(responses.HEAD, uri1, status=200)
+        responses.add(responses.HEAD, uri2, status=404)
         self.assertTrue(self.client.repo_exists(self.token, "username", "repo1"))
         self.assertFalse(self.client.repo_exists(self.token, "username", "repo2"))
         self.assertEqual(len(responses.calls), 2)
@@ -299,6 +304,60 @@ class GiteaClientInterfaceTest(unittest.TestCase):
         last_call = responses.calls[1]
         self.assertEqual(last_call.request.url, self.path_with_token(uri2))
 
+    @responses.activate
+    def test_repo_exists_without_head_support(self):
+        uri1 = self.path("/repos/username/repo1")
+        uri2 = self.path("/repos/username/repo2")
+        responses.add(responses.HEAD, uri1, status=405)
+        responses.add(responses.GET, uri1, body=self.repo_json_str, status=200)
+        responses.add(responses.GET, uri2, status=404)
+        self.assertTrue(self.client.repo_exists(self.token, "username", "repo1"))
+        self.assertFalse(self.client.repo_exists(self.token, "username", "repo2"))
+        self.assertEqual([c.request.method for c in responses.calls], ["HEAD", "GET", "GET"])
+
+    @responses.activate
+    def test_repos_exist(self):
+        for i in range(10):
+            responses.add(responses.HEAD, self.path("/repos/username/repo{}".format(i)),
+                          status=200 if i % 2 == 0 else 404)
+        repos = [("username", "repo{}".format(i)) for i in range(10)]
+        result = self.client.repos_exist(self.token, repos, concurrency=3)
+        self.assertEqual(result, {repo: i % 2 == 0 for (i, repo) in enumerate(repos)})
+
+    @responses.activate
+    def test_users_exist_with_negative_cache(self):
+        client = gitea_client.GiteaApi(self.base_url, negative_cache_ttl=60)
+        responses.add(responses.HEAD, self.path("/users/username1"), status=200)
+        responses.add(responses.HEAD, self.path("/users/username2"), status=404)
+        expected = {"username1": True, "username2": False}
+        self.assertEqual(client.users_exist(["username1", "username2"]), expected)
+        self.assertEqual(client.users_exist(["username1", "username2"]), expected)
+        self.assertEqual(len(responses.calls), 3)
+
+    @responses.activate
+    def test_user_exists_after_create(self):
+        client = gitea_client.GiteaApi(self.base_url, negative_cache_ttl=60)
+        responses.add(responses.HEAD, self.path("/users/username"), status=404)
+        responses.add(responses.HEAD, self.path("/users/username"), status=200)
+        responses.add(responses.POST, self.path("/admin/users"), body=self.user_json_str, status=201)
+        self.assertFalse(client.user_exists("username"))
+        client.create_user(self.token, "loginname", "username", "u@gitea.io", "password")
+        self.assertTrue(client.user_exists("username"))
+
+    @responses.activate
+    def test_org_exists_after_ensure(self):
+        client = gitea_client.GiteaApi(self.base_url, negative_cache_ttl=60)
+        responses.add(responses.HEAD, self.path("/users/myorg"), status=404)
+        responses.add(responses.HEAD, self.path("/users/myorg"), status=200)
+        responses.add(responses.POST, self.path("/admin/users/username/orgs"), status=422,
+                      json={"message": "already exists"})
+        responses.add(responses.GET, self.path("/orgs/myorg"),
+                      json={"id": 2, "username": "myorg", "full_name": "", "avatar_url": "",
+                            "description": "", "website": "", "location": ""})
+        self.assertFalse(client.user_exists("myorg"))
+        client.ensure_org(self.token, "username", "myorg")
+        self.assertTrue(client.user_exists("myorg"))
+
     @responses.activate
     def test_get_repo1(self):
         uri1 = self.path("/repos/username/repo1")
@@ -353,6 +412,89 @@ class GiteaClientInterfaceTest(unittest.TestCase):
         self.assertEqual(len(branches), 2)
         self.assert_branches_equal(branches[0], self.expected_branch)
 
+    @responses.activate
+    def test_branch_heads(self):
+        responses.add(responses.GET, self.path("/repos/username/repo1/branches"),
+                      body=self.branches_list_json_str)
+        responses.add(responses.GET, self.path("/repos/username/repo2/branches"), body="[]")
+        heads = self.client.branch_heads(self.token, [("username", "repo1"), ("username", "repo2")])
+        self.assertEqual(heads, {
+            ("username", "repo1", "master"): "c17825309a0d52201e78a19f49948bcc89e52488",
+            ("username", "repo1", "develop"): "r03kd7cjr9a0d52201e78a19f49948bcc89e52488"})
+
+    @responses.activate
+    def test_cache_invalidated_by_webhook_event(self):
+        client = gitea_client.GiteaApi(self.base_url, cache_ttl=3600, negative_cache_ttl=3600)
+        responses.add(responses.GET, self.path("/repos/unknwon/Hello-World"), body=self.repo_json_str)
+        responses.add(responses.GET, self.path("/repos/unknwon/Hello-World/branches"),
+                      body=self.branches_list_json_str)
+        responses.add(responses.HEAD, self.path("/repos/unknwon/Other"), status=404)
+        for _ in range(2):
+            client.get_repo(self.token, "unknwon", "Hello-World")
+            client.get_branches(self.token, "unknwon", "Hello-World")
+            self.assertFalse(client.repo_exists(self.token, "unknwon", "Other"))
+        self.assertEqual(len(responses.calls), 3)
+
+        repo = client.get_repo(self.token, "unknwon", "Hello-World")
+        client.invalidate_for_event(gitea_client.webhooks.GiteaPushEvent.from_json({
+            "ref": "refs/heads/master", "before": "a", "after": "b",
+            "repository": json.loads(self.repo_json_str)}))
+        client.get_repo(self.token, "unknwon", "Hello-World")
+        client.get_branches(self.token, "unknwon", "Hello-World")
+        client.repo_exists(self.token, "unknwon", "Other")
+        self.assertEqual(len(responses.calls), 5)
+
+        client.invalidate_for_event(gitea_client.webhooks.GiteaWebhookEvent.from_json({}))
+        client.repo_exists(self.token, "unknwon", "Other")
+        self.assertEqual(len(responses.calls), 6)
+
+        client.invalidate_repo("Unknwon", "hello-world")
+        client.get_repo(self.token, "unknwon", "Hello-World")
+        self.assertEqual(len(responses.calls), 7)
+        self.assert_repos_equal(repo, self.expected_repo)
+
+    @responses.activate
+    def test_caller_params_not_modified(self):
+        uri = self.path("/users/search")
+        responses.add(responses.GET, uri, body="{\"data\": []}")
+        params = {"q": "keyword"}
+        self.client.get("/users/search", auth=self.token, params=params)
+        self.assertEqual(params, {"q": "keyword"})
+        self.assertEqual(responses.calls[0].request.url, uri + "?q=keyword&token=mytoken")
+
+    @responses.activate
+    def test_concurrent_use(self):
+        tokens = [gitea_client.Token("token{}".format(i)) for i in range(64)]
+
+        def callback(request):
+            return 200, {}, json.dumps({"id": 1, "username": request.url.split("token=")[1],
+                                        "full_name": ""})
+
+        responses.add_callback(responses.GET, self.path("/user"), callback=callback)
+        users = {}
+
+        def work(token):
+            for _ in range(5):
+                users.setdefault(token.token, set()).add(self.client.authenticated_user(token).username)
+
+        threads = [threading.Thread(target=work, args=(token,)) for token in tokens]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(users, {token.token: {token.token} for token in tokens})
+
+    @responses.activate
+    def test_pickle(self):
+        client = gitea_client.GiteaApi(self.base_url, cache_ttl=60, pool_size=4)
+        responses.add(responses.GET, self.path("/repos/username/repo1"), body=self.repo_json_str)
+        client.get_repo(self.token, "username", "repo1")
+        copy = pickle.loads(pickle.dumps(client))
+        self.assert_repos_equal(copy.get_repo(self.token, "username", "repo1"), self.expected_repo)
+        self.assertEqual(len(responses.calls), 2)
+        copy.get_repo(self.token, "username", "repo1")
+        self.assertEqual(len(responses.calls), 2)
+
     @responses.activate
     def test_create_user1(self):
         uri = self.path("/admin/users")
@@ -369,8 +511,8 @@ class GiteaClientInterfaceTest(unittest.TestCase):
     def test_user_exists1(self):
         uri1 = self.path("/users/username1")
         uri2 = self.path("/users/username2")
-        responses.add(responses.GET, uri1, body=self.user_json_str, status=200)
-        responses.add(responses.GET, uri2, status=404)
+        responses.add(responses.HEAD, uri1, status=200)
+        responses.add(responses.HEAD, uri2, status=404)
         self.assertTrue(self.client.user_exists("username1"))
         self.assertFalse(self.client.user_exists("username2"))
         self.assertEqual(len(responses.calls), 2)
@@ -449,6 +591,40 @@ class GiteaClientInterfaceTest(unittest.TestCase):
         user = self.client.update_user(self.token, "username", update)
         self.assert_users_equals(user, self.expected_user)
 
+    @responses.activate
+    def test_update_user_only_changes(self):
+        responses.add(responses.GET, self.path("/users/username"), body=self.user_json_str)
+        responses.add(responses.PATCH, self.path("/admin/users/username"), body=self.user_json_str)
+        noop = gitea_client.GiteaUserUpdate.Builder("loginname", "u@gitea.io") \
+            .set_full_name("") \
+            .build()
+        self.client.update_user(self.token, "username", noop, only_changes=True)
+        self.assertEqual(len(responses.calls), 1)
+
+        update = gitea_client.GiteaUserUpdate.Builder("loginname", "u@gitea.io") \
+            .set_full_name("New") \
+            .set_admin(True) \
+            .build()
+        self.client.update_user(self.token, "username", update, only_changes=True)
+        self.assertEqual(json.loads(responses.calls[2].request.body.decode("utf8")),
+                         {"login_name": "loginname", "email": "u@gitea.io", "full_name": "New",
+                          "admin": True})
+
+        moved = gitea_client.GiteaUserUpdate.Builder("loginname", "new@gitea.io").build()
+        self.client.update_user(self.token, "username", moved, only_changes=True)
+        self.assertEqual(json.loads(responses.calls[4].request.body.decode("utf8")),
+                         {"login_name": "loginname", "email": "new@gitea.io"})
+
+        current = dict(json.loads(self.user_json_str), website="mywebsite.net", is_admin=False)
+        unchanged = gitea_client.GiteaUserUpdate.Builder("loginname", "u@gitea.io") \
+            .set_website("mywebsite.net") \
+            .set_admin(False) \
+            .build()
+        known = gitea_client.GiteaUser.from_json(current)
+        user = self.client.update_user(self.token, "username", unchanged, only_changes=True, current=known)
+        self.assertIs(user, known)
+        self.assertEqual(len(responses.calls), 5)
+
     @responses.activate
     def test_delete_user1(self):
         uri1 = self.path("/admin/users/username1")
@@ -555,6 +731,32 @@ class GiteaClientInterfaceTest(unittest.TestCase):
         hook = self.client.update_hook(self.token, "repo1", 4, update, organization="username")
         self.assert_hooks_equals(hook, self.expected_hook)
 
+    @responses.activate
+    def test_update_hook_only_changes(self):
+        uri = self.path("/repos/username/repo1/hooks/4")
+        responses.add(responses.GET, uri, body=self.hook_json_str)
+        responses.add(responses.PATCH, uri, body=self.hook_json_str)
+        unchanged = gitea_client.GiteaHookUpdate.Builder() \
+            .set_events(["push", "issues", "create"]) \
+            .set_config({"url": "http://test.io/hook"}) \
+            .set_active(False) \
+            .build()
+        hook = self.client.update_hook(self.token, "repo1", 4, unchanged, organization="username",
+                                       only_changes=True)
+        self.assert_hooks_equals(hook, self.expected_hook)
+        self.assertEqual([call.request.method for call in responses.calls], ["GET"])
+
+        update = gitea_client.GiteaHookUpdate.Builder() \
+            .set_events(["push", "issues", "create"]) \
+            .set_config({"url": "http://test.io/hook", "secret": "s3cret"}) \
+            .set_active(True) \
+            .build()
+        self.client.update_hook(self.token, "repo1", 4, update, organization="username",
+                                only_changes=True, current=self.expected_hook)
+        self.assertEqual(len(responses.calls), 2)
+        self.assertEqual(json.loads(responses.calls[1].request.body.decode("utf8")),
+                         {"config": {"url": "http://test.io/hook", "secret": "s3cret"}, "active": True})
+
     @responses.activate
     def test_list_hooks(self):
         uri = self.path("/repos/username/repo1/hooks")
@@ -586,6 +788,51 @@ class GiteaClientInterfaceTest(unittest.TestCase):
         call = responses.calls[0]
         self.assertEqual(call.request.url, self.path_with_token(uri))
 
+    @responses.activate
+    def test_get_organization(self):
+        uri = self.path("/orgs/gitea2")
+        responses.add(responses.GET, uri, body=self.org_json_str)
+        org = self.client.get_organization(self.token, "gitea2")
+        self.assert_org_equals(org, self.expected_org)
+
+    @responses.activate
+    def test_ensure_repo(self):
+        uri = self.path("/user/repos")
+        responses.add(responses.POST, uri, body=requests.ConnectionError("timed out"))
+        responses.add(responses.POST, uri, status=409, json={"message": "repository already exists"})
+        responses.add(responses.GET, self.path("/user"), body=self.user_json_str)
+        responses.add(responses.GET, self.path("/repos/unknwon/Hello-World"), body=self.repo_json_str)
+        repo = call_with_retries(lambda: self.client.ensure_repo(self.token, "Hello-World"), 2, backoff=0.01)
+        self.assert_repos_equal(repo, self.expected_repo)
+
+        responses.add(responses.POST, self.path("/org/myorg/repos"), status=201, body=self.repo_json_str)
+        repo = self.client.ensure_repo(self.token, "Hello-World", organization="myorg")
+        self.assert_repos_equal(repo, self.expected_repo)
+
+    @responses.activate
+    def test_ensure_user_and_org(self):
+        responses.add(responses.POST, self.path("/admin/users"), status=422)
+        responses.add(responses.GET, self.path("/users/unknwon"), body=self.user_json_str)
+        user = self.client.ensure_user(self.token, "unknwon", "unknwon", "u@gitea.io", "password")
+        self.assert_users_equals(user, self.expected_user)
+
+        # a 422 for invalid input is not mistaken for an existing organization
+        responses.add(responses.POST, self.path("/admin/users/unknwon/orgs"), status=422)
+        responses.add(responses.GET, self.path("/orgs/gitea2"), status=404)
+        try:
+            self.client.ensure_org(self.token, "unknwon", "gitea2")
+            self.fail("ensure_org should have failed")
+        except gitea_client.ApiFailure as exc:
+            self.assertEqual(exc.status_code, 422)
+
+    @responses.activate
+    def test_ensure_team(self):
+        responses.add(responses.POST, self.path("/admin/orgs/gitea2/teams"), status=409)
+        responses.add(responses.GET, self.path("/orgs/gitea2/teams"), body="[" + self.team_json_str + "]")
+        team = self.client.ensure_team(self.token, "gitea2", "new-team")
+        self.assert_team_equals(team, self.expected_team)
+        self.assertRaises(gitea_client.ApiFailure, self.client.ensure_team, self.token, "gitea2", "other")
+
     @responses.activate
     def test_create_organization_team(self):
         uri = self.path("/admin/orgs/username/teams")
@@ -747,6 +994,23 @@ class GiteaClientInterfaceTest(unittest.TestCase):
         self.assertEqual(key.read_only, expected.read_only)
         self.assertEqual(key.created_at, expected.created_at)
 
+    @responses.activate
+    def test_warm_up(self):
+        responses.add(responses.GET, self.api_endpoint + "version", json={"version": "1.0"})
+        report = self.client.warm_up(3)
+        self.assertTrue(report.reachable)
+        self.assertEqual(len(report.rtts), 3)
+        self.assertEqual(report.errors, [])
+        self.assertEqual(report.rtt, report.rtts[1])
+
+    @responses.activate
+    def test_warm_up_unreachable(self):
+        report = self.client.warm_up(2)
+        self.assertFalse(report.reachable)
+        self.assertIsNone(report.rtt)
+        self.assertEqual(len(report.errors), 2)
+        self.assertIsInstance(report.errors[0], gitea_client.NetworkFailure)
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,242 @@
+import json
+import unittest
+
+import responses
+
+import gitea_client
+from gitea_client.inventory import InventoryCrawler, InventorySnapshot
+
+
+def user_json(user_id, username):
+    return {"id": user_id, "username": username, "full_name": username.title(),
+            "email": username + "@example.com", "avatar_url": "/avatars/1"}
+
+
+def repo_json(repo_id, owner, name, private=False):
+    return {"id": repo_id, "owner": user_json(1, owner), "name": name,
+            "full_name": owner + "/" + name, "private": private, "fork": False,
+            "default_branch": "master", "html_url": "", "clone_url": "", "ssh_url": "",
+            "permissions": {"admin": True, "push": True, "pull": True}}
+
+
+def branch_json(name, commit_id):
+    return {"name": name, "commit": {"id": commit_id, "message": "msg", "url": "",
+                                     "timestamp": "2017-05-17T21:11:25Z"}}
+
+
+def hook_json(hook_id, events, active=True):
+    return {"id": hook_id, "type": "gitea", "events": events, "active": active,
+            "config": {"url": "http://hooks.example.com/", "content_type": "json"}}
+
+
+class InventoryTest(unittest.TestCase):
+    def setUp(self):
+        self.api_endpoint = "https://www.example.com/api/v1/"
+        self.client = gitea_client.GiteaApi("https://www.example.com/")
+        self.token = gitea_client.Token("mytoken")
+        self.snapshot = InventorySnapshot(":memory:")
+
+    def tearDown(self):
+        self.snapshot.close()
+
+    def add(self, path, body, status=200):
+        responses.add(responses.GET, self.api_endpoint + path, body=json.dumps(body), status=status)
+
+    def add_pages(self, path, *pages, **kwargs):
+        for number, page in enumerate(pages + ([],), 1):
+            responses.add(responses.GET, "{}{}?page={}&limit=50&token=mytoken".format(self.api_endpoint, path, number),
+                          body=json.dumps(page), **kwargs)
+
+    def add_server(self):
+        self.add("users/alice", user_json(1, "alice"))
+        self.add("orgs/acme", {"id": 2, "username": "acme", "full_name": "Acme", "avatar_url": "",
+                               "description": "", "website": "", "location": ""})
+        self.add_pages("users/alice/repos", [repo_json(10, "alice", "public"),
+                                             repo_json(11, "alice", "secret", private=True)])
+        self.add_pages("users/acme/repos", [repo_json(20, "acme", "hooked", private=True)])
+        self.add_pages("repos/alice/public/branches", [branch_json("master", "aaa")])
+        self.add_pages("repos/alice/secret/branches", [branch_json("master", "bbb"),
+                                                       branch_json("dev", "ccc")])
+        self.add_pages("repos/acme/hooked/branches", [])
+        self.add_pages("repos/alice/public/hooks", [])
+        self.add_pages("repos/alice/secret/hooks", [hook_json(1, ["push"], active=False)])
+        self.add_pages("repos/acme/hooked/hooks", [hook_json(2, ["create", "push"])])
+
+    @responses.activate
+    def test_crawl_and_query(self):
+        self.add_server()
+        errors = InventoryCrawler(self.client, self.token, concurrency=4) \
+            .crawl(self.snapshot, usernames=["alice"], org_names=["acme"])
+        self.assertEqual(errors, {})
+
+        self.assertEqual([u.username for u in self.snapshot.users()], ["alice"])
+        self.assertEqual(self.snapshot.user("alice").email, "alice@example.com")
+        self.assertIsNone(self.snapshot.user("bob"))
+        self.assertEqual(self.snapshot.org("acme").full_name, "Acme")
+        self.assertEqual([r.full_name for r in self.snapshot.repos()],
+                         ["acme/hooked", "alice/public", "alice/secret"])
+        self.assertEqual([r.name for r in self.snapshot.repos(owner="alice", private=True)],
+                         ["secret"])
+        repo = self.snapshot.repo("alice", "secret")
+        self.assertIsInstance(repo, gitea_client.GiteaRepo)
+        self.assertEqual(repo.owner.username, "alice")
+        self.assertEqual(self.snapshot.repo_by_id(10).name, "public")
+        self.assertEqual([b.commit.id for b in self.snapshot.branches("alice", "secret")],
+                         ["ccc", "bbb"])
+        self.assertEqual(self.snapshot.hooks("acme", "hooked")[0].events, ["create", "push"])
+        self.assertEqual([r.full_name for r in self.snapshot.repos_without_hook("push", private=True)],
+                         ["alice/secret"])
+        self.assertEqual([r.full_name for r in self.snapshot.repos_without_hook(
+            "push", private=True, include_inactive=True)], [])
+
+    @responses.activate
+    def test_crawl_records_errors(self):
+        self.add("users/alice", user_json(1, "alice"))
+        self.add_pages("users/alice/repos", [repo_json(10, "alice", "public")])
+        self.add_pages("repos/alice/public/branches", [branch_json("master", "aaa")])
+        self.add("repos/alice/public/hooks", {"message": "forbidden"}, status=403)
+        errors = InventoryCrawler(self.client, self.token).crawl(self.snapshot, usernames=["alice"])
+        self.assertEqual(list(errors), [("hooks", "alice/public")])
+        self.assertEqual(len(self.snapshot.branches("alice", "public")), 1)
+        self.assertEqual(self.snapshot.hooks("alice", "public"), [])
+
+    @responses.activate
+    def test_refresh(self):
+        self.add_server()
+        InventoryCrawler(self.client, self.token).crawl(self.snapshot, usernames=["alice"],
+                                                        org_names=["acme"])
+        before = self.snapshot.last_seen("alice", "public")
+        responses.reset()
+
+        changed_public = repo_json(10, "alice", "public")
+        changed_public["description"] = "pushed to"
+        self.add_pages("users/alice/repos", [changed_public, repo_json(12, "alice", "new")])
+        responses.add(responses.GET, self.api_endpoint + "users/acme/repos", status=304)
+        self.add_pages("repos/alice/public/branches", [branch_json("master", "ddd"),
+                                                       branch_json("feature", "eee")])
+        self.add_pages("repos/alice/new/branches", [])
+        changes = InventoryCrawler(self.client, self.token).refresh(self.snapshot)
+
+        self.assertEqual(changes.errors, {})
+        self.assertEqual(sorted(c.key for c in changes.added),
+                         [("alice", "new"), ("alice", "public", "feature")])
+        self.assertEqual(sorted(c.key for c in changes.modified),
+                         [("alice", "public"), ("alice", "public", "master")])
+        self.assertEqual([c.key for c in changes.removed], [("alice", "secret")])
+        self.assertEqual(changes.removed[0].entity.private, True)
+        requested = sorted(c.request.url.replace(self.api_endpoint, "").split("&")[0]
+                           for c in responses.calls)
+        self.assertEqual(requested, ["repos/alice/new/branches?page=1",
+                                     "repos/alice/public/branches?page=1",
+                                     "repos/alice/public/branches?page=2",
+                                     "users/acme/repos?page=1",
+                                     "users/alice/repos?page=1", "users/alice/repos?page=2"])
+
+        self.assertEqual(self.snapshot.repo("alice", "public").description, "pushed to")
+        self.assertIsNone(self.snapshot.repo("alice", "secret"))
+        self.assertEqual(self.snapshot.branches("alice", "secret"), [])
+        self.assertEqual([b.commit.id for b in self.snapshot.branches("alice", "public")],
+                         ["eee", "ddd"])
+        self.assertEqual(self.snapshot.repo("acme", "hooked").name, "hooked")
+        self.assertTrue(self.snapshot.last_seen("alice", "public") >= before)
+        self.assertTrue(self.snapshot.last_seen("acme", "hooked") >= before)
+
+    @responses.activate
+    def test_refresh_sends_etags(self):
+        self.add("users/alice", user_json(1, "alice"))
+        responses.add(responses.GET, self.api_endpoint + "users/alice/repos", body="[]",
+                      headers={"ETag": '"v0"'})
+        crawler = InventoryCrawler(self.client, self.token)
+        crawler.crawl(self.snapshot, usernames=["alice"])
+        responses.reset()
+        responses.add(responses.GET, self.api_endpoint + "users/alice/repos", body="[]",
+                      headers={"ETag": '"v1"'})
+        crawler.refresh(self.snapshot)
+        request = responses.calls[0].request
+        self.assertEqual(request.headers["If-None-Match"], '"v0"')
+        self.assertEqual(request.headers["Cache-Control"], "no-cache")
+        responses.reset()
+        responses.add(responses.GET, self.api_endpoint + "users/alice/repos", status=304)
+        changes = crawler.refresh(self.snapshot)
+        self.assertEqual(responses.calls[0].request.headers["If-None-Match"], '"v1"')
+        self.assertEqual((changes.added, changes.removed, changes.modified), ([], [], []))
+
+    @responses.activate
+    def test_crawl_reads_every_page(self):
+        self.add("users/alice", user_json(1, "alice"))
+        self.add_pages("users/alice/repos", [repo_json(10, "alice", "one")], [repo_json(11, "alice", "two")])
+        self.add_pages("repos/alice/one/branches", [branch_json("master", "aaa")],
+                       [branch_json("dev", "bbb")])
+        self.add_pages("repos/alice/two/branches", [])
+        self.add_pages("repos/alice/one/hooks", [])
+        self.add_pages("repos/alice/two/hooks", [hook_json(1, ["create"])], [hook_json(2, ["push"])])
+        errors = InventoryCrawler(self.client, self.token).crawl(self.snapshot, usernames=["alice"])
+        self.assertEqual(errors, {})
+        self.assertEqual([r.name for r in self.snapshot.repos()], ["one", "two"])
+        self.assertEqual([b.name for b in self.snapshot.branches("alice", "one")], ["dev", "master"])
+        self.assertEqual([r.name for r in self.snapshot.repos_without_hook("push")], ["one"])
+
+    @responses.activate
+    def test_refresh_reads_every_page(self):
+        self.add("users/alice", user_json(1, "alice"))
+        self.add_pages("users/alice/repos", [repo_json(10, "alice", "one")], [repo_json(11, "alice", "two")],
+                       headers={"ETag": '"v1"'})
+        self.add_pages("repos/alice/one/branches", [])
+        self.add_pages("repos/alice/two/branches", [])
+        self.add_pages("repos/alice/one/hooks", [])
+        self.add_pages("repos/alice/two/hooks", [])
+        crawler = InventoryCrawler(self.client, self.token)
+        crawler.crawl(self.snapshot, usernames=["alice"])
+        responses.reset()
+
+        url = self.api_endpoint + "users/alice/repos?page={}&limit=50&token=mytoken"
+        responses.add(responses.GET, url.format(1), status=304)
+        responses.add(responses.GET, url.format(2), status=304)
+        responses.add(responses.GET, url.format(3), status=304)
+        changes = crawler.refresh(self.snapshot)
+        self.assertEqual((changes.added, changes.removed, changes.modified), ([], [], []))
+        self.assertEqual([c.request.headers["If-None-Match"] for c in responses.calls], ['"v1"'] * 3)
+
+        # the first page is unchanged but the second one changed, so the whole listing is read again
+        responses.reset()
+        responses.add(responses.GET, url.format(1), status=304)
+        self.add_pages("users/alice/repos", [repo_json(10, "alice", "one")], [], headers={"ETag": '"v2"'})
+        changes = crawler.refresh(self.snapshot)
+        self.assertEqual([c.key for c in changes.removed], [("alice", "two")])
+        self.assertEqual([r.name for r in self.snapshot.repos()], ["one"])
+
+    @responses.activate
+    def test_refresh_retries_failed_branches(self):
+        self.add_server()
+        crawler = InventoryCrawler(self.client, self.token)
+        crawler.crawl(self.snapshot, usernames=["alice"], org_names=["acme"])
+        responses.reset()
+
+        changed_public = repo_json(10, "alice", "public")
+        changed_public["description"] = "pushed to"
+        self.add_pages("users/alice/repos", [changed_public, repo_json(11, "alice", "secret", private=True)],
+                       headers={"ETag": '"v2"'})
+        responses.add(responses.GET, self.api_endpoint + "users/acme/repos", status=304)
+        self.add("repos/alice/public/branches", {"message": "oops"}, status=500)
+        changes = crawler.refresh(self.snapshot)
+        self.assertEqual(list(changes.errors), [("branches", "alice/public")])
+        self.assertEqual(changes.modified, [])
+        self.assertIsNone(self.snapshot.repo("alice", "public").description)
+
+        responses.reset()
+        self.add_pages("users/alice/repos", [changed_public, repo_json(11, "alice", "secret", private=True)],
+                       headers={"ETag": '"v2"'})
+        responses.add(responses.GET, self.api_endpoint + "users/acme/repos", status=304)
+        self.add_pages("repos/alice/public/branches", [branch_json("master", "ddd")])
+        changes = crawler.refresh(self.snapshot)
+        listing = [c.request for c in responses.calls if "users/alice/repos" in c.request.url]
+        self.assertNotIn("If-None-Match", listing[0].headers)
+        self.assertEqual(changes.errors, {})
+        self.assertEqual(sorted(c.key for c in changes.modified),
+                         [("alice", "public"), ("alice", "public", "master")])
+        self.assertEqual([b.commit.id for b in self.snapshot.branches("alice", "public")], ["ddd"])
+        self.assertEqual(self.snapshot.repo("alice", "public").description, "pushed to")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,168 @@
+import io
+import pickle
+import random
+import unittest
+
+import requests
+import responses
+
+import gitea_client
+from gitea_client._implementation.sketch import LogSketch
+from gitea_client.metrics import LatencyRecorder, Metrics, RequestRecord, endpoint_template
+
+
+class EndpointTemplateTest(unittest.TestCase):
+    def test_templates(self):
+        self.assertEqual(endpoint_template("/repos/alice/notes"), "/repos/{u}/{r}")
+        self.assertEqual(endpoint_template("/repos/alice/notes/hooks/3"), "/repos/{u}/{r}/hooks/{i}")
+        self.assertEqual(endpoint_template("/repos/migrate"), "/repos/migrate")
+        self.assertEqual(endpoint_template("/users/search?q=al"), "/users/search")
+        self.assertEqual(endpoint_template("/users/alice"), "/users/{u}")
+
+    def test_branch_names_with_slashes(self):
+        self.assertEqual(endpoint_template("/repos/alice/notes/branches/feature/x"),
+                         "/repos/{u}/{r}/branches/{b}")
+
+    def test_unknown_paths(self):
+        self.assertEqual(endpoint_template("/markdown/raw"), "/markdown/*")
+        self.assertEqual(endpoint_template("/"), "/")
+        self.assertEqual(endpoint_template("/repos/u/r/contents/a/b"), "/repos/*")
+        self.assertEqual(endpoint_template("/repos/u/r/raw/master/README.md"), "/repos/*")
+        self.assertEqual(endpoint_template("/users/alice/starred"), "/users/*")
+
+    def test_hooks_without_owner(self):
+        self.assertEqual(endpoint_template("/repos/notes/hooks"), "/repos/{r}/hooks")
+        self.assertEqual(endpoint_template("/repos/notes/hooks/3"), "/repos/{r}/hooks/{i}")
+
+
+class MetricsTest(unittest.TestCase):
+    def setUp(self):
+        self.api_endpoint = "https://www.example.com/api/v1/"
+        self.metrics = Metrics()
+        self.client = gitea_client.GiteaApi("https://www.example.com/", metrics=self.metrics)
+        self.token = gitea_client.Token("secret-token")
+
+    @responses.activate
+    def test_requests_and_decoding(self):
+        responses.add(responses.GET, self.api_endpoint + "users/alice",
+                      json={"id": 1, "username": "alice", "full_name": "Alice"})
+        responses.add(responses.GET, self.api_endpoint + "users/bob", status=404)
+        self.client.get_user(self.token, "alice")
+        self.assertRaises(gitea_client.ApiFailure, self.client.get_user, self.token, "bob")
+        snapshot = self.metrics.snapshot()
+        self.assertEqual(snapshot.requests, {("GET", "/users/{u}", "2xx", "ok"): 1,
+                                             ("GET", "/users/{u}", "4xx", "ApiFailure"): 1})
+        self.assertEqual(snapshot.latency[("GET", "/users/{u}", "2xx", "ok")].count, 1)
+        self.assertGreater(snapshot.bytes_received[("GET", "/users/{u}")], 0)
+        self.assertEqual(snapshot.decode["GiteaUser"].count, 1)
+
+    @responses.activate
+    def test_network_failure(self):
+        responses.add(responses.GET, self.api_endpoint + "version",
+                      body=requests.ConnectionError("refused"))
+        self.assertRaises(gitea_client.NetworkFailure, self.client.get, "/version")
+        self.assertEqual(self.metrics.snapshot().requests,
+                         {("GET", "/version", "error", "NetworkFailure"): 1})
+
+    @responses.activate
+    def test_callbacks(self):
+        responses.add(responses.POST, self.api_endpoint + "admin/users", status=201,
+                      json={"id": 1, "username": "alice", "full_name": "Alice"})
+        before, after = [], []
+        self.metrics.add_before_request(lambda *args: before.append(args))
+        self.metrics.add_before_request(lambda *args: 1 / 0)
+        self.metrics.add_after_request(after.append)
+        self.client.create_user(self.token, "Alice", "alice", "alice@example.com", "password")
+        self.assertEqual(before, [("POST", "/admin/users", "/admin/users")])
+        self.assertEqual(len(after), 1)
+        record = after[0]
+        self.assertIsInstance(record, RequestRecord)
+        self.assertEqual((record.status_code, record.outcome), (201, "ok"))
+        self.assertGreater(record.bytes_sent, 0)
+
+    def test_pickle(self):
+        self.metrics.count("hedge_sent")
+        copy = pickle.loads(pickle.dumps(self.client))
+        self.assertEqual(copy._config["metrics"].snapshot().events, {})
+        self.assertEqual(self.metrics.snapshot().events, {"hedge_sent": 1})
+
+
+class LogSketchTest(unittest.TestCase):
+    def test_accuracy(self):
+        values = [random.expovariate(10) for _ in range(10000)]
+        sketch = LogSketch(relative_accuracy=0.01)
+        for value in values:
+            sketch.add(value)
+        values.sort()
+        for q in (0.5, 0.9, 0.99, 0.999):
+            exact = values[int(q * (len(values) - 1))]
+            self.assertAlmostEqual(sketch.quantile(q), exact, delta=0.011 * exact)
+
+    def test_bounded(self):
+        sketch = LogSketch(relative_accuracy=0.01, max_buckets=50)
+        for i in range(1, 10001):
+            sketch.add(i / 1000.0)
+        self.assertLessEqual(len(sketch._buckets), 50)
+        self.assertAlmostEqual(sketch.quantile(0.999), 9.99, delta=0.1)
+
+
+class LatencyRecorderTest(unittest.TestCase):
+    def record(self, duration, endpoint="/repos/{u}/{r}", retries=0):
+        return RequestRecord("GET", endpoint, "/repos/a/b", 200, "ok", duration, 0, 512, retries)
+
+    def test_percentiles_and_summary(self):
+        recorder = LatencyRecorder(slow_threshold=None)
+        for i in range(1, 1001):
+            recorder.record(self.record(i / 1000.0))
+        recorder.record(self.record(0.01, endpoint="/version"))
+        percentiles = recorder.percentiles()
+        repo = percentiles[("GET", "/repos/{u}/{r}")]
+        self.assertEqual(repo.count, 1000)
+        self.assertAlmostEqual(repo.p50, 0.5, delta=0.01)
+        self.assertAlmostEqual(repo.p99, 0.99, delta=0.02)
+        self.assertEqual(percentiles[("GET", "/version")].count, 1)
+        stream = io.StringIO()
+        recorder.report(stream)
+        lines = stream.getvalue().splitlines()
+        self.assertEqual(len(lines), 3)
+        self.assertIn("/repos/{u}/{r}", lines[1])
+
+    def test_window(self):
+        recorder = LatencyRecorder(slow_threshold=None, window=0.0)
+        recorder.record(self.record(5.0))
+        recorder.record(self.record(0.1))
+        self.assertEqual(recorder.percentiles()[("GET", "/repos/{u}/{r}")].count, 1)
+
+    def test_slow_requests(self):
+        recorder = LatencyRecorder(slow_threshold=0.5)
+        with self.assertLogs("gitea_client.slow", "WARNING") as logs:
+            recorder.record(self.record(0.1))
+            recorder.record(self.record(2.0, retries=1))
+        self.assertEqual(len(logs.records), 1)
+        entry = logs.records[0]
+        self.assertEqual((entry.endpoint, entry.status, entry.duration, entry.retries),
+                         ("/repos/{u}/{r}", 200, 2.0, 1))
+
+    @responses.activate
+    def test_attach(self):
+        responses.add(responses.GET, "https://www.example.com/api/v1/version", json={"version": "1"})
+        metrics = Metrics()
+        recorder = LatencyRecorder().attach(metrics)
+        gitea_client.GiteaApi("https://www.example.com/", metrics=metrics).get("/version")
+        self.assertEqual(list(recorder.percentiles()), [("GET", "/version")])
+
+    def test_pickle(self):
+        metrics = Metrics()
+        recorder = LatencyRecorder(slow_threshold=None).attach(metrics)
+        recorder.record(self.record(0.2))
+        client = pickle.loads(pickle.dumps(gitea_client.GiteaApi("https://www.example.com/",
+                                                                 metrics=metrics)))
+        copy = client._config["metrics"]._after[0].__self__
+        self.assertIsNot(copy, recorder)
+        self.assertEqual(copy.percentiles()[("GET", "/repos/{u}/{r}")].count, 1)
+        copy.record(self.record(0.3))
+        self.assertEqual(recorder.percentiles()[("GET", "/repos/{u}/{r}")].count, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
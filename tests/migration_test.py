@@ -0,0 +1,126 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import requests
+import responses
+
+import gitea_client
+from gitea_client.migration import MigrationScheduler
+
+
+class MigrationSchedulerTest(unittest.TestCase):
+    def setUp(self):
+        self.api_endpoint = "https://www.example.com/api/v1/"
+        self.client = gitea_client.GiteaApi("https://www.example.com/")
+        self.token = gitea_client.Token("mytoken")
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def repo_json(self, name):
+        return json.dumps({
+            "id": 1, "owner": {"id": 1, "username": "owner", "full_name": ""},
+            "name": name, "full_name": "owner/" + name, "private": False, "fork": False,
+            "default_branch": "master", "html_url": "", "clone_url": "", "ssh_url": "",
+            "permissions": {"admin": True, "push": True, "pull": True}})
+
+    def add_migrate_callback(self, statuses):
+        """
+        Serves migrations, failing each repo's attempts with the given statuses first
+        """
+        attempts = {}
+
+        def callback(request):
+            name = json.loads(request.body.decode("utf8"))["repo_name"]
+            attempt = attempts.get(name, 0)
+            attempts[name] = attempt + 1
+            failures = statuses.get(name, [])
+            if attempt < len(failures):
+                return failures[attempt], {}, ""
+            return 201, {}, self.repo_json(name)
+
+        responses.add_callback(responses.POST, self.api_endpoint + "repos/migrate", callback=callback)
+        return attempts
+
+    @responses.activate
+    def test_run(self):
+        attempts = self.add_migrate_callback({"repo1": [503, 502]})
+        responses.add(responses.GET, self.api_endpoint + "repos/search", body='{"ok": true, "data": []}')
+        progress = []
+        scheduler = MigrationScheduler(self.client, self.token, concurrency=2, backoff=0,
+                                       progress=progress.append)
+        jobs = [scheduler.submit("https://old.example.com/r{}.git".format(i), 1, "repo{}".format(i))
+                for i in range(5)]
+        result = scheduler.run()
+        self.assertEqual(set(result.migrated), set(jobs))
+        self.assertEqual(result.migrated[jobs[1]].name, "repo1")
+        self.assertEqual(attempts["repo1"], 3)
+        self.assertEqual(len(progress), 5)
+        self.assertEqual(progress[-1].migrated, 5)
+        self.assertEqual(progress[-1].eta, 0)
+        self.assertTrue(progress[-1].throughput > 0)
+
+    @responses.activate
+    def test_permanent_failure(self):
+        attempts = self.add_migrate_callback({"repo": [422, 422]})
+        scheduler = MigrationScheduler(self.client, self.token, backoff=0)
+        job = scheduler.submit("https://old.example.com/r.git", 1, "repo")
+        result = scheduler.run()
+        self.assertIsInstance(result.failed[job], gitea_client.ApiFailure)
+        self.assertEqual(attempts["repo"], 1)
+
+    @responses.activate
+    def test_timed_out_migration_not_repeated(self):
+        responses.add(responses.POST, self.api_endpoint + "repos/migrate",
+                      body=requests.exceptions.ReadTimeout())
+        responses.add(responses.HEAD, self.api_endpoint + "repos/owner/repo")
+        responses.add(responses.GET, self.api_endpoint + "repos/owner/repo",
+                      body=self.repo_json("repo"))
+        scheduler = MigrationScheduler(self.client, self.token, timeout=1, backoff=0)
+        job = scheduler.submit("https://old.example.com/r.git", 1, "repo", owner="owner")
+        result = scheduler.run()
+        self.assertEqual(result.migrated[job].full_name, "owner/repo")
+        posts = [c for c in responses.calls if c.request.method == "POST"]
+        self.assertEqual(len(posts), 1)
+
+    @responses.activate
+    def test_timed_out_migration_found_by_uid(self):
+        responses.add(responses.POST, self.api_endpoint + "repos/migrate",
+                      body=requests.exceptions.ReadTimeout())
+        responses.add(responses.POST, self.api_endpoint + "repos/migrate", status=409)
+        responses.add(responses.GET, self.api_endpoint + "repos/search",
+                      body=json.dumps({"ok": True, "data": [json.loads(self.repo_json("repo"))]}))
+        scheduler = MigrationScheduler(self.client, self.token, timeout=1, backoff=0)
+        job = scheduler.submit("https://old.example.com/r.git", 1, "repo")
+        result = scheduler.run()
+        self.assertEqual(result.migrated[job].full_name, "owner/repo")
+        posts = [c for c in responses.calls if c.request.method == "POST"]
+        self.assertEqual(len(posts), 1)
+        search = [c.request.url for c in responses.calls if c.request.method == "GET"]
+        self.assertIn("uid=1", search[0])
+
+    @responses.activate
+    def test_resume(self):
+        attempts = self.add_migrate_callback({"repo2": [404]})
+        journal_path = os.path.join(self.tmpdir, "migrations.jsonl")
+        scheduler = MigrationScheduler(self.client, self.token, backoff=0, journal_path=journal_path)
+        job1 = scheduler.submit("https://old.example.com/r1.git", 1, "repo1")
+        job2 = scheduler.submit("https://old.example.com/r2.git", 1, "repo2")
+        result = scheduler.run()
+        self.assertIn(job2, result.failed)
+
+        scheduler = MigrationScheduler(self.client, self.token, backoff=0, journal_path=journal_path)
+        scheduler.submit("https://old.example.com/r1.git", 1, "repo1")
+        scheduler.submit("https://old.example.com/r2.git", 1, "repo2")
+        result = scheduler.run()
+        self.assertEqual(result.resumed, [job1])
+        self.assertEqual(list(result.migrated), [job2])
+        self.assertEqual(attempts, {"repo1": 1, "repo2": 2})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,99 @@
+import pickle
+import unittest
+
+import responses
+
+import gitea_client
+from gitea_client.tracing import Span, Tracer
+
+
+class _RecordingSpan(Span):
+    def __init__(self, tracer, name, parent, attributes):
+        self.tracer = tracer
+        self.name = name
+        self.parent = parent
+        self.attributes = dict(attributes or {})
+        self.exception = None
+
+    def set_attribute(self, key, value):
+        self.attributes[key] = value
+
+    def record_exception(self, exception):
+        self.exception = exception
+
+    def end(self):
+        self.tracer.active.pop()
+
+
+class _RecordingTracer(Tracer):
+    def __init__(self):
+        self.spans = []
+        self.active = []
+
+    def start_span(self, name, attributes=None):
+        parent = self.active[-1].name if self.active else None
+        span = _RecordingSpan(self, name, parent, attributes)
+        self.spans.append(span)
+        self.active.append(span)
+        return span
+
+    def inject(self, headers):
+        headers["traceparent"] = "00-{}".format(len(self.spans))
+
+
+class TracingTest(unittest.TestCase):
+    def setUp(self):
+        self.api_endpoint = "https://www.example.com/api/v1/"
+        self.tracer = _RecordingTracer()
+        self.client = gitea_client.GiteaApi("https://www.example.com/", tracer=self.tracer)
+        self.auth = gitea_client.UsernamePassword("alice", "password")
+
+    @responses.activate
+    def test_ensure_token(self):
+        responses.add(responses.GET, self.api_endpoint + "user",
+                      json={"id": 1, "username": "alice", "full_name": "Alice"})
+        responses.add(responses.GET, self.api_endpoint + "users/alice/tokens", json=[])
+        responses.add(responses.POST, self.api_endpoint + "users/alice/tokens", status=201,
+                      json={"name": "ci", "sha1": "abc"})
+        self.client.ensure_token(self.auth, "ci")
+        self.assertEqual([(span.name, span.parent) for span in self.tracer.spans], [
+            ("GiteaApi.ensure_token", None),
+            ("GiteaApi.authenticated_user", "GiteaApi.ensure_token"),
+            ("HTTP GET", "GiteaApi.authenticated_user"),
+            ("decode GiteaUser", "GiteaApi.authenticated_user"),
+            ("GiteaApi.get_tokens", "GiteaApi.ensure_token"),
+            ("HTTP GET", "GiteaApi.get_tokens"),
+            ("decode Token", "GiteaApi.get_tokens"),
+            ("GiteaApi.create_token", "GiteaApi.ensure_token"),
+            ("HTTP POST", "GiteaApi.create_token"),
+            ("decode Token", "GiteaApi.create_token"),
+        ])
+        self.assertEqual(self.tracer.active, [])
+        http = self.tracer.spans[2]
+        self.assertEqual(http.attributes, {"http.method": "GET", "http.route": "/user",
+                                           "http.status_code": 200})
+        self.assertEqual(responses.calls[0].request.headers["traceparent"], "00-3")
+
+    @responses.activate
+    def test_failure(self):
+        responses.add(responses.GET, self.api_endpoint + "users/bob", status=404)
+        self.assertRaises(gitea_client.ApiFailure, self.client.get_user, self.auth, "bob")
+        method = self.tracer.spans[0]
+        self.assertIsInstance(method.exception, gitea_client.ApiFailure)
+        self.assertEqual(self.tracer.spans[1].attributes["http.status_code"], 404)
+
+    def test_noop_tracer(self):
+        with Tracer().start_span("name", {"key": "value"}) as span:
+            span.set_attribute("other", 1)
+        headers = {}
+        Tracer().inject(headers)
+        self.assertEqual(headers, {})
+
+    def test_pickle(self):
+        copy = pickle.loads(pickle.dumps(gitea_client.GiteaApi("https://www.example.com/",
+                                                               tracer=Tracer())))
+        self.assertIsInstance(copy._tracer, Tracer)
+
+
+if __name__ == "__main__":
+    unittest.main()
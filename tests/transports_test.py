@@ -0,0 +1,90 @@
+import json
+import os
+import pickle
+import shutil
+import tempfile
+import time
+import unittest
+
+import responses
+
+import gitea_client
+from gitea_client.transports import RecordingAdapter, ReplayAdapter, UnrecordedRequest
+
+
+class TransportsTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "cassette.jsonl")
+        self.base_url = "https://www.example.com/"
+        self.api_endpoint = "https://www.example.com/api/v1/"
+        self.token = gitea_client.Token("secret-token")
+        self.repo_json = {"id": 7, "name": "notes", "full_name": "alice/notes",
+                          "owner": {"id": 1, "username": "alice", "full_name": "Alice",
+                                    "email": "alice@example.com", "avatar_url": ""},
+                          "description": "", "private": False, "fork": False, "parent": None,
+                          "default_branch": "master", "empty": False, "size": 12,
+                          "html_url": "", "clone_url": "", "ssh_url": "",
+                          "permissions": {"admin": True, "push": True, "pull": True}}
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    @responses.activate
+    def record(self):
+        responses.add(responses.GET, self.api_endpoint + "repos/alice/notes", json=self.repo_json)
+        responses.add(responses.DELETE, self.api_endpoint + "repos/alice/notes", status=204)
+        responses.add(responses.DELETE, self.api_endpoint + "repos/alice/notes", status=404)
+        client = gitea_client.GiteaApi(self.base_url, adapter=RecordingAdapter(self.path))
+        repo = client.get_repo(self.token, "alice", "notes")
+        client.delete_repo(self.token, "alice", "notes")
+        self.assertRaises(gitea_client.ApiFailure, client.delete_repo, self.token, "alice", "notes")
+        return repo
+
+    def test_record(self):
+        self.record()
+        with open(self.path) as cassette:
+            entries = [json.loads(line) for line in cassette]
+        self.assertEqual([(e["method"], e["status"]) for e in entries],
+                         [("GET", 200), ("DELETE", 204), ("DELETE", 404)])
+        self.assertEqual(entries[0]["url"], self.api_endpoint + "repos/alice/notes")
+        self.assertNotIn("secret-token", open(self.path).read())
+        self.assertGreaterEqual(entries[0]["elapsed"], 0)
+
+    def test_replay(self):
+        recorded = self.record()
+        client = gitea_client.GiteaApi(self.base_url,
+                                       adapter=ReplayAdapter(self.path, time_scale=0.0))
+        self.assertEqual(client.get_repo(self.token, "alice", "notes"), recorded)
+        client.delete_repo(self.token, "alice", "notes")
+        self.assertRaises(gitea_client.ApiFailure, client.delete_repo, self.token, "alice", "notes")
+        # served in order, starting over
+        client.delete_repo(self.token, "alice", "notes")
+        try:
+            client.get_repo(self.token, "alice", "other")
+            self.fail("expected NetworkFailure")
+        except gitea_client.NetworkFailure as failure:
+            self.assertIsInstance(failure.cause, UnrecordedRequest)
+
+    def test_replay_timing(self):
+        with open(self.path, "w") as cassette:
+            cassette.write(json.dumps({
+                "method": "GET", "url": self.api_endpoint + "version", "request_body": None,
+                "status": 200, "reason": "OK", "headers": {"Content-Type": "application/json"},
+                "body": {"text": '{"version": "1.0"}'}, "elapsed": 0.2}) + "\n")
+        client = gitea_client.GiteaApi(self.base_url,
+                                       adapter=ReplayAdapter(self.path, time_scale=0.5))
+        start = time.perf_counter()
+        self.assertEqual(client.get("/version").json(), {"version": "1.0"})
+        self.assertGreaterEqual(time.perf_counter() - start, 0.1)
+
+    def test_pickle(self):
+        self.record()
+        client = gitea_client.GiteaApi(self.base_url,
+                                       adapter=ReplayAdapter(self.path, time_scale=0.0))
+        copy = pickle.loads(pickle.dumps(client))
+        self.assertEqual(copy.get_repo(self.token, "alice", "notes").name, "notes")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,153 @@
+import hashlib
+import hmac
+import json
+import threading
+import unittest
+
+import requests
+
+from gitea_client import GiteaRepo, GiteaUser
+from gitea_client.webhooks import (WebhookReceiver, WebhookServer, parse_event,
+                                   verify_signature)
+
+
+def push_payload():
+    owner = {"id": 1, "login": "unknwon", "full_name": "", "email": "u@gitea.io",
+             "avatar_url": "/avatars/1"}
+    return {
+        "ref": "refs/heads/master",
+        "before": "28e1879d029cb852e4844d9c718537df08844e03",
+        "after": "bffeb74224043ba2feb48d137756c8a9331c449a",
+        "compare_url": "http://localhost:3000/unknwon/webhooks/compare/28e1...bffe",
+        "commits": [{
+            "id": "bffeb74224043ba2feb48d137756c8a9331c449a",
+            "message": "Webhooks Yay!",
+            "url": "http://localhost:3000/unknwon/webhooks/commit/bffeb74224043ba2feb48d137756c8a9331c449a",
+            "author": {"name": "Unknwon", "email": "u@gitea.io", "username": "unknwon"},
+            "timestamp": "2017-03-13T13:52:11-04:00"
+        }],
+        "repository": {
+            "id": 140, "owner": owner, "name": "webhooks", "full_name": "unknwon/webhooks",
+            "description": "", "private": False, "fork": False,
+            "html_url": "http://localhost:3000/unknwon/webhooks",
+            "ssh_url": "ssh://unknwon@localhost:2222/unknwon/webhooks.git",
+            "clone_url": "http://localhost:3000/unknwon/webhooks.git",
+            "default_branch": "master"
+        },
+        "pusher": dict(owner),
+        "sender": dict(owner)
+    }
+
+
+class WebhooksTest(unittest.TestCase):
+    def setUp(self):
+        self.secret = "s3cret"
+        self.body = json.dumps(push_payload()).encode("utf-8")
+        self.signature = hmac.new(self.secret.encode(), self.body, hashlib.sha256).hexdigest()
+
+    def headers(self, event="push", signature=None):
+        return {"X-Gitea-Event": event,
+                "X-Gitea-Signature": self.signature if signature is None else signature}
+
+    def test_verify_signature(self):
+        self.assertTrue(verify_signature(self.secret, self.body, self.signature))
+        self.assertFalse(verify_signature(self.secret, self.body + b" ", self.signature))
+        self.assertFalse(verify_signature("wrong", self.body, self.signature))
+        self.assertFalse(verify_signature(self.secret, self.body, None))
+        self.assertFalse(verify_signature(self.secret, self.body, u"\u00e9" + self.signature[1:]))
+
+    def test_parse_push(self):
+        event = parse_event("push", push_payload())
+        self.assertEqual(event.event_type, "push")
+        self.assertEqual(event.ref, "refs/heads/master")
+        self.assertEqual(event.after, "bffeb74224043ba2feb48d137756c8a9331c449a")
+        self.assertEqual(event.commits[0].message, "Webhooks Yay!")
+        self.assertIsInstance(event.repository, GiteaRepo)
+        self.assertEqual(event.repository.owner.username, "unknwon")
+        self.assertFalse(event.repository.permissions.admin)
+        self.assertIsInstance(event.pusher, GiteaUser)
+
+    def test_parse_create_delete_and_other(self):
+        payload = push_payload()
+        create = parse_event("create", {"ref": "feature", "ref_type": "branch", "sha": "abc",
+                                        "repository": payload["repository"],
+                                        "sender": payload["sender"]})
+        self.assertEqual((create.event_type, create.ref, create.sha), ("create", "feature", "abc"))
+        payload = push_payload()
+        delete = parse_event("delete", {"ref": "feature", "ref_type": "branch", "pusher_type": "user",
+                                        "repository": payload["repository"]})
+        self.assertEqual(delete.repository.full_name, "unknwon/webhooks")
+        payload = push_payload()
+        other = parse_event("repository", {"action": "deleted", "repository": payload["repository"],
+                                           "organization": {}})
+        self.assertEqual((other.event_type, other.action), ("repository", "deleted"))
+        self.assertIn("organization", other.json)
+
+    def test_receive(self):
+        receiver = WebhookReceiver(self.secret, workers=2)
+        received = []
+        done = threading.Event()
+
+        def handler(event):
+            received.append(event)
+            done.set()
+
+        receiver.add_handler(handler, events=["push"])
+        receiver.add_handler(lambda event: self.fail("not a create event"), events=["create"])
+        self.assertEqual(receiver.receive(self.headers(signature="00"), self.body), 401)
+        self.assertEqual(receiver.receive(self.headers(signature=u"\u00e9"), self.body), 401)
+        self.assertEqual(receiver.receive(self.headers(), self.body[:-1]), 401)
+        self.assertEqual(receiver.receive(self.headers(), self.body), 202)
+        self.assertTrue(done.wait(5))
+        receiver.stop()
+        self.assertEqual(received[0].repository.name, "webhooks")
+        self.assertEqual(receiver.receive(self.headers(), self.body), 503)
+        receiver.stop()
+        self.assertEqual(len(received), 1)
+
+    def test_malformed_payload(self):
+        receiver = WebhookReceiver()
+        self.assertEqual(receiver.receive({"X-Gitea-Event": "push"}, b"not json"), 400)
+        self.assertEqual(receiver.receive({"X-Gitea-Event": "push"}, b"{}"), 400)
+
+    def test_backpressure(self):
+        receiver = WebhookReceiver(workers=1, queue_size=1, enqueue_timeout=0.01)
+        release = threading.Event()
+        started = threading.Event()
+
+        def handler(event):
+            started.set()
+            release.wait(5)
+
+        receiver.add_handler(handler)
+        self.assertEqual(receiver.receive(self.headers(), self.body), 202)
+        self.assertTrue(started.wait(5))
+        self.assertEqual(receiver.receive(self.headers(), self.body), 202)
+        self.assertEqual(receiver.receive(self.headers(), self.body), 503)
+        release.set()
+        receiver.stop()
+
+    def test_server(self):
+        receiver = WebhookReceiver(self.secret)
+        received = threading.Event()
+        receiver.add_handler(lambda event: received.set())
+        server = WebhookServer(receiver, host="127.0.0.1", port=0)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        try:
+            url = "http://127.0.0.1:{}/".format(server.server_address[1])
+            with requests.Session() as session:
+                response = session.post(url, data=self.body, headers=self.headers())
+                self.assertEqual(response.status_code, 202)
+                response = session.post(url, data=self.body, headers=self.headers(signature="00"))
+                self.assertEqual(response.status_code, 401)
+            self.assertTrue(received.wait(5))
+        finally:
+            server.shutdown()
+            server.server_close()
+            receiver.stop()
+
+
+if __name__ == "__main__":
+    unittest.main()
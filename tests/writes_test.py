@@ -0,0 +1,167 @@
+import json
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+import responses
+
+import gitea_client
+from gitea_client.writes import CoalescingWriteQueue, MutationHandle, MutationQueue
+
+
+class CoalescingWriteQueueTest(unittest.TestCase):
+    def setUp(self):
+        self.api_endpoint = "https://www.example.com/api/v1/"
+        self.client = gitea_client.GiteaApi("https://www.example.com/")
+        self.token = gitea_client.Token("mytoken")
+        self.user_json = {"id": 1, "username": "user", "full_name": "User"}
+        self.hook_json = {"id": 4, "type": "gitea", "events": ["push"], "active": True,
+                          "config": {"url": "http://test.io/hook", "content_type": "json"}}
+
+    def bodies(self, method):
+        return [json.loads(call.request.body.decode("utf8")) for call in responses.calls
+                if call.request.method == method]
+
+    @responses.activate
+    def test_updates_merged_per_target(self):
+        responses.add(responses.PATCH, self.api_endpoint + "admin/users/user", json=self.user_json)
+        responses.add(responses.PATCH, self.api_endpoint + "repos/org/repo/hooks/4", json=self.hook_json)
+        with CoalescingWriteQueue(self.client, self.token, flush_interval=60) as queue:
+            first = queue.update_user("user", gitea_client.GiteaUserUpdate.Builder("user", "a@example.com")
+                                      .set_full_name("Old Name").set_website("site.net").build())
+            second = queue.update_user("user", gitea_client.GiteaUserUpdate.Builder("user", "b@example.com")
+                                       .set_full_name("New Name").build())
+            hooks = [queue.update_hook("repo", 4, gitea_client.GiteaHookUpdate.Builder()
+                                       .set_config({"url": "http://new.io/hook"}).build(),
+                                       organization="org"),
+                     queue.update_hook("repo", 4, gitea_client.GiteaHookUpdate.Builder()
+                                       .set_config({"secret": "s3cret"}).set_active(False).build(),
+                                       organization="org")]
+            self.assertFalse(first.done())
+            self.assertTrue(queue.flush(timeout=10))
+            self.assertEqual(first.result().username, "user")
+            self.assertIs(first.result(), second.result())
+            self.assertEqual(hooks[0].result().id, 4)
+        bodies = sorted(self.bodies("PATCH"), key=lambda body: "config" in body)
+        self.assertEqual(bodies, [
+            {"login_name": "user", "email": "b@example.com", "full_name": "New Name", "website": "site.net"},
+            {"config": {"url": "http://new.io/hook", "secret": "s3cret"}, "active": False}])
+
+    @responses.activate
+    def test_flush_on_timer_and_size(self):
+        responses.add(responses.PATCH, self.api_endpoint + "admin/users/user1", json=self.user_json)
+        responses.add(responses.PATCH, self.api_endpoint + "admin/users/user2", json=self.user_json)
+        update = gitea_client.GiteaUserUpdate.Builder("user", "a@example.com").build()
+        queue = CoalescingWriteQueue(self.client, self.token, flush_interval=0.05)
+        start = time.time()
+        queue.update_user("user1", update).result(timeout=10)
+        self.assertGreaterEqual(time.time() - start, 0.04)
+
+        queue = CoalescingWriteQueue(self.client, self.token, flush_interval=60, max_pending=2)
+        futures = [queue.update_user("user1", update), queue.update_user("user2", update)]
+        for future in futures:
+            future.result(timeout=10)
+        queue.close()
+        self.assertEqual(len(responses.calls), 3)
+
+    @responses.activate
+    def test_failures_and_close(self):
+        responses.add(responses.PATCH, self.api_endpoint + "admin/users/user", status=404)
+        update = gitea_client.GiteaUserUpdate.Builder("user", "a@example.com").build()
+        queue = CoalescingWriteQueue(self.client, self.token, flush_interval=60)
+        futures = [queue.update_user("user", update) for _ in range(3)]
+        queue.close()
+        for future in futures:
+            self.assertIsInstance(future.exception(), gitea_client.ApiFailure)
+        self.assertEqual(len(responses.calls), 1)
+        self.assertRaises(RuntimeError, queue.update_user, "user", update)
+
+    def test_merge(self):
+        merged = gitea_client.GiteaHookUpdate.Builder().set_events(["push"]).set_active(True).build() \
+            .merge(gitea_client.GiteaHookUpdate.Builder().set_active(False).build())
+        self.assertEqual(merged.as_dict(), {"events": ["push"], "active": False})
+
+
+class MutationQueueTest(unittest.TestCase):
+    def setUp(self):
+        self.api_endpoint = "https://www.example.com/api/v1/"
+        self.client = gitea_client.GiteaApi("https://www.example.com/")
+        self.token = gitea_client.Token("mytoken")
+        self.directory = tempfile.mkdtemp()
+        self.journal_path = os.path.join(self.directory, "mutations.jsonl")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def journal(self):
+        with open(self.journal_path) as f:
+            return [json.loads(line) for line in f]
+
+    @responses.activate
+    def test_ordered_per_target(self):
+        responses.add(responses.PUT, self.api_endpoint + "admin/teams/1/members/alice", status=204)
+        responses.add(responses.DELETE, self.api_endpoint + "admin/teams/1/members/alice", status=204)
+        responses.add(responses.PUT, self.api_endpoint + "admin/teams/1/repos/notes", status=204)
+        with MutationQueue(self.client, self.token, self.journal_path, workers=4, sync=False) as queue:
+            handles = [queue.add_team_membership(1, "alice"),
+                       queue.remove_team_membership(1, "alice"),
+                       queue.add_repo_to_team(1, "notes")]
+            self.assertTrue(queue.join(timeout=10))
+            self.assertIs(queue.handle(handles[0].id), handles[0])
+            self.assertEqual(queue.pending(), [])
+        self.assertEqual([h.status for h in handles], [MutationHandle.DONE] * 3)
+        self.assertEqual([(call.request.method, call.request.url.split("?")[0]) for call in responses.calls],
+                         [("PUT", self.api_endpoint + "admin/teams/1/members/alice"),
+                          ("DELETE", self.api_endpoint + "admin/teams/1/members/alice"),
+                          ("PUT", self.api_endpoint + "admin/teams/1/repos/notes")])
+        self.assertEqual(sorted(record["state"] for record in self.journal()), ["done"] * 3 + ["queued"] * 3)
+
+    @responses.activate
+    def test_retries_and_failures(self):
+        responses.add(responses.DELETE, self.api_endpoint + "repos/user/gone", status=404)
+        responses.add(responses.DELETE, self.api_endpoint + "repos/user/flaky", status=503)
+        responses.add(responses.DELETE, self.api_endpoint + "repos/user/flaky", status=204)
+        responses.add(responses.PUT, self.api_endpoint + "admin/teams/2/members/bob", status=403)
+        with MutationQueue(self.client, self.token, self.journal_path, backoff=0.01, sync=False) as queue:
+            gone = queue.delete_repo("user", "gone")
+            flaky = queue.delete_repo("user", "flaky")
+            forbidden = queue.add_team_membership(2, "bob")
+            for handle in (gone, flaky, forbidden):
+                self.assertTrue(handle.wait(timeout=10))
+        self.assertEqual((gone.status, flaky.status), (MutationHandle.DONE, MutationHandle.DONE))
+        self.assertEqual(forbidden.status, MutationHandle.FAILED)
+        self.assertIn("403", forbidden.error)
+        with MutationQueue(self.client, self.token, self.journal_path, sync=False) as queue:
+            self.assertRaises(ValueError, queue.submit, "create_repo", "name")
+            self.assertRaises(TypeError, queue.delete_hook, "user", "repo")
+
+    @responses.activate
+    def test_replay(self):
+        with open(self.journal_path, "w") as f:
+            f.write(json.dumps({"id": "a", "state": "queued", "op": "delete_hook",
+                                "args": ["user", "repo", 4]}) + "\n")
+            f.write(json.dumps({"id": "b", "state": "queued", "op": "delete_repo",
+                                "args": ["user", "repo"]}) + "\n")
+            f.write(json.dumps({"id": "a", "state": "done"}) + "\n")
+            f.write('{"id": "c", "sta')
+        responses.add(responses.DELETE, self.api_endpoint + "repos/user/repo", status=204)
+        queue = MutationQueue(self.client, self.token, self.journal_path, sync=False)
+        handle = queue.handle("b")
+        self.assertEqual(handle.args, ("user", "repo"))
+        self.assertTrue(handle.wait(timeout=10))
+        queue.close()
+        self.assertEqual(len(responses.calls), 1)
+        self.assertEqual(self.journal(), [
+            {"id": "b", "state": "queued", "op": "delete_repo", "args": ["user", "repo"]},
+            {"id": "b", "state": "done"}])
+        # a queue reopened on the journal has nothing left to do
+        queue = MutationQueue(self.client, self.token, self.journal_path, sync=False)
+        self.assertEqual(queue.pending(), [])
+        queue.close()
+        self.assertEqual(self.journal(), [])
+
+
+if __name__ == "__main__":
+    unittest.main()